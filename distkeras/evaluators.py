@@ -3,6 +3,23 @@
 An evaluator will evaluate a dataframe according to specific requirements.
 """
 
+## BEGIN Imports. ##############################################################
+
+from distkeras.utils import deserialize_keras_model
+from distkeras.utils import serialize_keras_model
+
+import numpy as np
+
+import tensorflow as tf
+
+import threading
+
+import time
+
+import traceback
+
+## END Imports. ################################################################
+
 class Evaluator(object):
     """An evaluator is an abstract class which will, given a label and a prediction,
        will compute an evaluation metric.
@@ -46,3 +63,142 @@ class AccuracyEvaluator(Evaluator):
         validated_instances = cleaned.count()
 
         return float(validated_instances) / float(num_instances)
+
+
+def collect_validation_set(dataframe, features_col="features", label_col="label", max_samples=10000):
+    """Collects a bounded validation set on the driver.
+
+    # Arguments
+        dataframe: dataframe. Spark Dataframe which holds the validation set.
+        features_col: string or list of strings. Name(s) of the features column(s).
+        label_col: string or list of strings. Name(s) of the label column(s).
+        max_samples: int. Maximum number of rows to collect.
+
+    # Returns
+        The features and labels, as lists with an array for every column.
+    """
+    features_col = [features_col] if isinstance(features_col, str) else features_col
+    label_col = [label_col] if isinstance(label_col, str) else label_col
+    rows = dataframe.select(*(features_col + label_col)).limit(max_samples).collect()
+    X = [np.asarray([row[column] for row in rows]) for column in features_col]
+    Y = [np.asarray([row[column] for row in rows]) for column in label_col]
+
+    return X, Y
+
+
+class SnapshotEvaluator(object):
+    """Periodically evaluates the loss of the center variable on a validation set while
+    the workers are training.
+
+    The evaluator runs in a background thread on the driver, with its own TensorFlow
+    graph and session, and reads snapshots of the center variable from the parameter
+    server without pausing the workers. The evaluated losses form a live loss curve,
+    and can be used for early stopping.
+
+    # Arguments
+        keras_model: model. Keras model which is trained.
+        loss: string. String representing the loss.
+              See: https://keras.io/objectives/
+        X: list. Features of the validation set, see collect_validation_set.
+        Y: list. Labels of the validation set, see collect_validation_set.
+        batch_size: int. Number of samples per batch of the evaluation.
+        interval: float. Number of seconds between two evaluations.
+        patience: int. Stops the training procedure when the loss did not improve by at
+                  least `min_delta` during `patience` evaluations. None disables early stopping.
+        min_delta: float. Minimal improvement of the loss.
+        callback: function. Function which is called with the elapsed time, the number of
+                  center variable updates and the loss after every evaluation.
+    """
+
+    def __init__(self, keras_model, loss, X, Y, batch_size=256, interval=30.0, patience=None,
+                 min_delta=0.0, callback=None):
+        self.model = serialize_keras_model(keras_model)
+        self.loss = loss
+        self.X = X
+        self.Y = Y
+        self.batch_size = batch_size
+        self.interval = interval
+        self.patience = patience
+        self.min_delta = min_delta
+        self.callback = callback
+        self.losses = []
+        self.mutex = threading.Lock()
+        self.best_loss = float('inf')
+        self.best_weights = None
+        self.thread = None
+
+    def start(self, parameter_server, stop_training, training_done):
+        """Starts the evaluation thread.
+
+        # Arguments
+            parameter_server: parameter server. Parameter server of the training procedure.
+            stop_training: function. Function which stops the training procedure.
+            training_done: threading.Event. Event which is set when the training is done.
+        """
+        with self.mutex:
+            self.losses = []
+        self.best_loss = float('inf')
+        self.best_weights = None
+        self.thread = threading.Thread(target=self.run, args=(parameter_server, stop_training, training_done))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, parameter_server, stop_training, training_done):
+        """Event loop of the evaluator.
+
+        The snapshots are fetched outside the graph of the evaluator, as some parameter
+        servers read the center variable from a Keras model in the graph of the driver.
+        Failures are reported, and end the evaluation without affecting the training.
+        """
+        time_start = time.time()
+        num_evaluations_without_improvement = 0
+        graph = tf.Graph()
+        session = tf.Session(graph=graph)
+        try:
+            # Keras uses the default session, which keeps the session of the driver untouched.
+            with graph.as_default(), session.as_default():
+                model = deserialize_keras_model(self.model)
+                model.compile(loss=self.loss, optimizer='sgd')
+            while not training_done.wait(self.interval):
+                num_updates = parameter_server.get_num_updates()
+                weights = parameter_server.get_center_variable()
+                with graph.as_default(), session.as_default():
+                    model.set_weights(weights)
+                    loss = float(np.ravel(model.evaluate(self.X, self.Y, batch_size=self.batch_size, verbose=0))[0])
+                elapsed = time.time() - time_start
+                with self.mutex:
+                    self.losses.append((elapsed, num_updates, loss))
+                if self.callback is not None:
+                    self.callback(elapsed, num_updates, loss)
+                # Check if the loss improved.
+                if loss < self.best_loss - self.min_delta:
+                    self.best_loss = loss
+                    self.best_weights = weights
+                    num_evaluations_without_improvement = 0
+                else:
+                    num_evaluations_without_improvement += 1
+                # Check if the training procedure needs to be stopped early.
+                if self.patience is not None and num_evaluations_without_improvement >= self.patience:
+                    stop_training()
+                    break
+        except Exception as e:
+            print("Snapshot evaluation failed: " + str(e))
+            traceback.print_exc()
+        finally:
+            session.close()
+
+    def get_losses(self):
+        """Returns the loss curve as a list of tuples, which hold the number of seconds since
+        the start of the evaluator, the number of center variable updates, and the loss."""
+        with self.mutex:
+            return list(self.losses)
+
+    def get_best_weights(self):
+        """Returns the weights of the evaluated snapshot with the lowest loss."""
+        return self.best_weights
+
+    def join(self):
+        """Waits for the evaluation thread to finish."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
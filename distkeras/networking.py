@@ -31,6 +31,9 @@ def recvall(connection, num_bytes):
         data = connection.recv(bytes_left)
         # Compute the size of the frame.
         delta = len(data)
+        # Check if the remote host closed the connection.
+        if delta == 0:
+            raise EOFError("Connection closed by the remote host.")
         buffer_size += delta
         bytes_left -= delta
         # Append the data to the buffer.
@@ -51,15 +54,26 @@ def recv_data(connection):
     # Arguments
         connection: socket. Opened socket.
     """
-    data = b''
+    return deserialize_data(recv_buffer(connection))
+
+
+def recv_buffer(connection):
+    """Fetches the next serialized data frame from the connection, without deserializing it.
+
+    # Arguments
+        connection: socket. Opened socket.
+    """
     # Fetch the serialized data length.
     length = int(recvall(connection, 20).decode())
     # Fetch the serialized data.
     serialized_data = recvall(connection, length)
-    # Deserialize the data.
-    data = pickle.loads(serialized_data)
 
-    return data
+    return serialized_data
+
+
+def deserialize_data(serialized_data):
+    """Deserializes a data frame which was received using recv_buffer."""
+    return pickle.loads(serialized_data)
 
 
 def send_data(connection, data):
@@ -76,8 +90,21 @@ def send_data(connection, data):
         connection: socket. Opened socket.
         data: any. Data to send.
     """
-    # Serialize the data.
-    serialized_data = pickle.dumps(data, -1)
+    send_buffer(connection, serialize_data(data))
+
+
+def serialize_data(data):
+    """Serializes the data into a buffer which can be sent using send_buffer."""
+    return pickle.dumps(data, -1)
+
+
+def send_buffer(connection, serialized_data):
+    """Sends a buffer produced by serialize_data to the other endpoint of the socket.
+
+    # Arguments
+        connection: socket. Opened socket.
+        serialized_data: bytes. Serialized data.
+    """
     length = len(serialized_data)
     # Serialize the number of bytes in the data.
     serialized_length = str(length).zfill(20)
@@ -9,6 +9,8 @@ This center variable will eventually be the produced model of the trainer.
 
 import copy
 
+import json
+
 import math
 
 import numpy as np
@@ -17,12 +19,157 @@ import socket
 
 import threading
 
+import time
+
+from distkeras.networking import deserialize_data
+from distkeras.networking import recv_buffer
 from distkeras.networking import recv_data
+from distkeras.networking import send_buffer
 from distkeras.networking import send_data
+from distkeras.networking import serialize_data
+
+from distkeras.tracing import NullSpan
+from distkeras.tracing import Tracer
+
 from distkeras.utils import deserialize_keras_model
+from distkeras.utils import flatten_weights
+from distkeras.utils import unflatten_weights
+from distkeras.utils import weights_array
+from distkeras.utils import write_checkpoint
 
 ## END Imports. ################################################################
 
+class ParameterServerMetrics(object):
+    """Collects the metrics of a socket parameter server.
+
+    This includes the number of commits and pulls, the number of bytes received and
+    sent, the time spent waiting for and holding the mutex of the center variable,
+    the number of connections, and the staleness distribution of every worker. The
+    staleness of a commit is the number of center variable updates since the last
+    pull of the committing worker. Commits which exceed the staleness bound of the
+    parameter server are counted as dropped.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.start_time = time.time()
+        self.num_commits = 0
+        self.num_pulls = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.lock_wait_time = 0.0
+        self.lock_hold_time = 0.0
+        self.lock_acquisitions = 0
+        self.active_connections = 0
+        self.total_connections = 0
+        self.staleness = {}
+        self.num_dropped_commits = 0
+
+    def record_commit(self, worker_id, num_bytes, staleness):
+        """Records a commit of the specified worker."""
+        with self.mutex:
+            self.num_commits += 1
+            self.bytes_received += num_bytes
+            histogram = self.staleness.setdefault(worker_id, {})
+            histogram[staleness] = histogram.get(staleness, 0) + 1
+
+    def record_dropped_commit(self, num_bytes):
+        """Records a commit which was dropped because it exceeded the staleness bound."""
+        with self.mutex:
+            self.num_dropped_commits += 1
+            self.bytes_received += num_bytes
+
+    def record_pull(self, num_bytes):
+        """Records a pull of a worker."""
+        with self.mutex:
+            self.num_pulls += 1
+            self.bytes_sent += num_bytes
+
+    def record_lock(self, wait_time, hold_time):
+        """Records an acquisition of the center variable mutex."""
+        with self.mutex:
+            self.lock_acquisitions += 1
+            self.lock_wait_time += wait_time
+            self.lock_hold_time += hold_time
+
+    def record_connection(self, opened):
+        """Records the opening (True) or closing (False) of a worker connection."""
+        with self.mutex:
+            if opened:
+                self.active_connections += 1
+                self.total_connections += 1
+            else:
+                self.active_connections -= 1
+
+    def snapshot(self):
+        """Returns the current metrics as a dictionary."""
+        with self.mutex:
+            uptime = max(time.time() - self.start_time, 1e-9)
+            metrics = {}
+            metrics['uptime'] = uptime
+            metrics['commits'] = self.num_commits
+            metrics['pulls'] = self.num_pulls
+            metrics['commits_per_second'] = self.num_commits / uptime
+            metrics['pulls_per_second'] = self.num_pulls / uptime
+            metrics['bytes_received'] = self.bytes_received
+            metrics['bytes_sent'] = self.bytes_sent
+            metrics['lock_acquisitions'] = self.lock_acquisitions
+            metrics['lock_wait_time'] = self.lock_wait_time
+            metrics['lock_hold_time'] = self.lock_hold_time
+            metrics['active_connections'] = self.active_connections
+            metrics['total_connections'] = self.total_connections
+            metrics['staleness'] = copy.deepcopy(self.staleness)
+            metrics['commits_dropped'] = self.num_dropped_commits
+
+        return metrics
+
+
+class MeteredLock(object):
+    """Mutex which reports the time spent waiting for, and holding the lock.
+
+    # Arguments
+        metrics: ParameterServerMetrics. Metrics to report to.
+    """
+
+    def __init__(self, metrics):
+        self.lock = threading.Lock()
+        self.metrics = metrics
+        self.tracer = None
+        self.request_time = 0.0
+        self.acquire_time = 0.0
+
+    def set_tracer(self, tracer):
+        """Records the lock wait and hold times as trace events with the specified tracer."""
+        self.tracer = tracer
+
+    def now(self):
+        """Returns the current time of the tracer clock, or the wall clock."""
+        if self.tracer is None:
+            return time.time()
+
+        return self.tracer.now()
+
+    def __enter__(self):
+        request_time = self.now()
+        self.lock.acquire()
+        self.request_time = request_time
+        self.acquire_time = self.now()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        request_time = self.request_time
+        acquire_time = self.acquire_time
+        release_time = self.now()
+        self.lock.release()
+        self.metrics.record_lock(acquire_time - request_time, release_time - acquire_time)
+        if self.tracer is not None:
+            self.tracer.add_event('lock wait', 'parameter server', request_time, acquire_time)
+            self.tracer.add_event('lock hold', 'parameter server', acquire_time, release_time)
+
+        return False
+
+
 class ParameterServer(object):
     """Abstract class which provides basic attributed and methods for all
        parameter servers.
@@ -92,27 +239,69 @@ class SocketParameterServer(ParameterServer):
         self.socket = None
         self.running = False
         self.connections = []
-        self.mutex = threading.Lock()
+        self.metrics = ParameterServerMetrics()
+        self.mutex = MeteredLock(self.metrics)
+        self.metrics_path = None
+        self.metrics_interval = 10.0
+        self.metrics_exporter = None
+        self.metrics_exporter_stop = threading.Event()
+        self.tracer = None
+        self.worker_traces = []
+        self.stop_requested = False
+        self.pulled_updates = {}
+        self.telemetry = {}
+        self.telemetry_mutex = threading.Lock()
+        self.checkpoint_path = None
+        self.checkpoint_interval = 60.0
+        self.checkpoint_config = {}
+        self.checkpointer = None
+        self.checkpointer_stop = threading.Event()
+        self.shard_states = {}
+        self.shard_claims = {}
+        self.num_refused_claims = 0
+        self.shard_mutex = threading.Lock()
+        self.update_rule = None
+        self.staleness_bound = None
+        self.hyperparameters = {}
+        self.hyperparameters_version = 0
+        self.hyperparameters_sent = {}
+        self.initialized = threading.Event()
+        self.initialization_error = None
 
     def initialize(self):
-        """Sets up the listing port."""
+        """Sets up the listing port.
+
+        The `initialized` event is set once the parameter server listens, after which
+        `master_port` holds the port which was assigned by the OS if it was None. If the
+        port could not be bound, the event is set as well, and the exception is stored
+        in `initialization_error`.
+        """
         # Reset the running flag.
         self.running = True
-        # Prepare a socket.
-        file_descriptor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Disable Nagle's algorithm.
-        file_descriptor.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        # Check if the master port needs to be assigned by the OS.
-        if self.master_port is None:
-            file_descriptor.bind(('0.0.0.0', 0))
-            # Retrieve the port assigned by the OS.
-            self.master_port = int(file_descriptor.getsockname()[1])
-        else:
-            file_descriptor.bind(('0.0.0.0', self.master_port))
-        # Listen to the socket.
-        file_descriptor.listen(5)
-        # Assign the socket.
-        self.socket = file_descriptor
+        self.initialization_error = None
+        try:
+            # Prepare a socket.
+            file_descriptor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Disable Nagle's algorithm.
+            file_descriptor.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Check if the master port needs to be assigned by the OS.
+            if self.master_port is None:
+                file_descriptor.bind(('0.0.0.0', 0))
+                # Retrieve the port assigned by the OS.
+                self.master_port = int(file_descriptor.getsockname()[1])
+            else:
+                file_descriptor.bind(('0.0.0.0', self.master_port))
+            # Listen to the socket.
+            file_descriptor.listen(5)
+            # Assign the socket.
+            self.socket = file_descriptor
+        except Exception as e:
+            self.running = False
+            self.initialization_error = e
+            raise
+        finally:
+            # Never leave a waiting trainer behind, even if the port could not be bound.
+            self.initialized.set()
 
     def handle_commit(self, conn, addr):
         """Handles parameter updates coming from the workers.
@@ -123,6 +312,396 @@ class SocketParameterServer(ParameterServer):
         """
         raise NotImplementedError
 
+    def receive_commit(self, conn, addr):
+        """Receives the data of a commit from the specified connection. The commit is
+        recorded with record_commit, once it is applied or dropped.
+
+        # Arguments:
+            conn: socket. The opened connection.
+            addr: addr. Address of the remote host.
+
+        # Returns
+            The data sent by the worker.
+        """
+        serialized_data = recv_buffer(conn)
+        data = deserialize_data(serialized_data)
+        data['num_bytes'] = len(serialized_data) + 21
+
+        return data
+
+    def record_commit(self, data, staleness, applied=True):
+        """Records the commit, and the telemetry which the worker piggybacked on it.
+
+        # Arguments:
+            data: dict. Data of the commit, see receive_commit.
+            staleness: int. Number of center variable updates since the last pull of the worker.
+            applied: boolean. False if the commit was dropped, see exceeds_staleness_bound.
+        """
+        if applied:
+            self.metrics.record_commit(data.get('worker_id'), data['num_bytes'], staleness)
+        else:
+            self.metrics.record_dropped_commit(data['num_bytes'])
+        telemetry = data.get('telemetry')
+        if telemetry is not None:
+            self.record_telemetry(data.get('worker_id'), telemetry, staleness, applied)
+
+    def send_pull(self, conn, addr, data, num_updates):
+        """Sends the data of a pull to the specified connection.
+
+        # Arguments:
+            conn: socket. The opened connection.
+            addr: addr. Address of the remote host.
+            data: any. Center variable (and additional data) to send.
+            num_updates: int. Number of center variable updates, read while holding the
+                         lock together with the center variable. The staleness of the
+                         next commit of the worker is relative to it.
+        """
+        self.pulled_updates[addr] = num_updates
+        serialized_data = serialize_data(data)
+        send_buffer(conn, serialized_data)
+        # Send the hyperparameters if they changed since the last pull of the worker.
+        hyperparameters = None
+        version = self.hyperparameters_version
+        if self.hyperparameters_sent.get(addr, 0) < version:
+            hyperparameters = {'version': version, 'hyperparameters': self.hyperparameters}
+            self.hyperparameters_sent[addr] = version
+        serialized_hyperparameters = serialize_data(hyperparameters)
+        send_buffer(conn, serialized_hyperparameters)
+        self.metrics.record_pull(len(serialized_data) + len(serialized_hyperparameters) + 40)
+
+    def update_hyperparameters(self, hyperparameters):
+        """Updates the hyperparameters of the running training procedure.
+
+        Every pull is followed by a second frame, which holds the versioned hyperparameters
+        if they changed since the last pull of the worker, or None otherwise. Workers
+        apply the hyperparameters they receive, see
+        distkeras.workers.NetworkWorker.apply_hyperparameters. The staleness bound is
+        applied by the parameter server itself, see exceeds_staleness_bound.
+
+        # Arguments
+            hyperparameters: dict. Hyperparameters to update, e.g., 'learning_rate',
+                             'communication_window' or 'staleness_bound'.
+        """
+        if 'staleness_bound' in hyperparameters:
+            self.staleness_bound = hyperparameters['staleness_bound']
+        # Replace the dictionary, as it might be serialized by a connection thread.
+        updated_hyperparameters = dict(self.hyperparameters)
+        updated_hyperparameters.update(hyperparameters)
+        self.hyperparameters = updated_hyperparameters
+        self.hyperparameters_version += 1
+
+    def get_hyperparameters(self):
+        """Returns the version and the dictionary of the current hyperparameters."""
+        return self.hyperparameters_version, self.hyperparameters
+
+    def set_staleness_bound(self, staleness_bound):
+        """Sets the maximum number of center variable updates since the last pull of a
+        worker for its commit to be accepted. None accepts all commits."""
+        self.staleness_bound = staleness_bound
+
+    def get_staleness(self, addr):
+        """Returns the number of center variable updates since the last pull of the
+        specified connection. The caller should hold the lock."""
+        return self.num_updates - self.pulled_updates.get(addr, self.num_updates)
+
+    def exceeds_staleness_bound(self, staleness):
+        """Checks if a commit with the specified staleness exceeds the staleness bound.
+
+        The caller should hold the lock until the commit is applied, so the center
+        variable can not be updated in between.
+        """
+        return self.staleness_bound is not None and staleness > self.staleness_bound
+
+    def record_telemetry(self, worker_id, summary, staleness, applied=True):
+        """Aggregates the telemetry summary which was piggybacked on a commit of a worker.
+
+        # Arguments:
+            worker_id: int. Identifier of the worker.
+            summary: dict. See distkeras.workers.Worker.get_telemetry.
+            staleness: int. Number of center variable updates since the last pull of the worker.
+            applied: boolean. False if the commit was dropped, which is counted in
+                     'commits_dropped' instead of 'commits'.
+        """
+        with self.telemetry_mutex:
+            if worker_id not in self.telemetry:
+                self.telemetry[worker_id] = {'samples': 0, 'iterations': 0, 'commits': 0, 'commits_dropped': 0,
+                                             'wait_time': 0.0, 'compute_time': 0.0, 'serialize_time': 0.0,
+                                             'commit_time': 0.0, 'pull_time': 0.0,
+                                             'bytes_sent': 0, 'bytes_received': 0}
+            worker = self.telemetry[worker_id]
+            for key in ['samples', 'iterations', 'wait_time', 'compute_time', 'serialize_time',
+                        'commit_time', 'pull_time', 'bytes_sent', 'bytes_received']:
+                worker[key] += summary[key]
+            if applied:
+                worker['commits'] += 1
+            else:
+                worker['commits_dropped'] += 1
+            worker['iteration'] = summary['iteration']
+            worker['loss'] = summary['loss']
+            worker['throughput'] = summary['samples'] / max(summary['duration'], 1e-9)
+            worker['staleness'] = staleness
+            worker['timestamp'] = time.time()
+
+    def get_telemetry(self):
+        """Returns a snapshot of the telemetry which was reported by the workers.
+
+        # Returns
+            A dictionary with the telemetry of the individual workers ('workers'), and the
+            aggregated throughput (samples / second), mean loss, total number of samples
+            and the number of center variable updates.
+        """
+        with self.telemetry_mutex:
+            workers = copy.deepcopy(self.telemetry)
+        telemetry = {}
+        telemetry['workers'] = workers
+        telemetry['num_updates'] = self.num_updates
+        telemetry['samples'] = sum(w['samples'] for w in workers.values())
+        telemetry['throughput'] = sum(w['throughput'] for w in workers.values())
+        if len(workers) > 0:
+            telemetry['loss'] = sum(w['loss'] for w in workers.values()) / len(workers)
+        else:
+            telemetry['loss'] = float('nan')
+
+        return telemetry
+
+    def get_metrics(self):
+        """Returns a snapshot of the metrics of the parameter server.
+
+        See ParameterServerMetrics. The snapshot also holds the number of center
+        variable updates, the number of updates per second, the number of shards which
+        were trained on, and the number of refused shard claims (see handle_shard).
+        """
+        metrics = self.metrics.snapshot()
+        metrics['num_updates'] = self.num_updates
+        metrics['updates_per_second'] = self.num_updates / metrics['uptime']
+        with self.shard_mutex:
+            metrics['shards_done'] = sum(1 for state in self.shard_states.values() if state == 'done')
+            metrics['shard_claims_refused'] = self.num_refused_claims
+
+        return metrics
+
+    def get_center_variable(self):
+        """Returns a snapshot of the center variable, this method can be called while the
+        workers are training.
+
+        Parameter servers which maintain a separate center variable replace it on every
+        commit instead of updating it in place. As a result, the returned reference is a
+        consistent snapshot, which should not be modified.
+        """
+        with self.mutex:
+            return self.read_center_variable()
+
+    def read_center_variable(self):
+        """Returns the center variable, see get_center_variable. The caller should hold
+        the lock."""
+        return self.model.get_weights()
+
+    def set_center_variable(self, center_variable):
+        """Replaces the center variable, e.g., with the center variable of a checkpoint.
+
+        # Arguments
+            center_variable: list. List of weight arrays, see get_center_variable.
+        """
+        with self.mutex:
+            self.model.set_weights(center_variable)
+
+    def supports_update_rule(self):
+        """Returns True if the parameter server integrates deltas which an update rule
+        can be applied to."""
+        return False
+
+    def set_update_rule(self, update_rule):
+        """Sets the server-side rule which integrates the incoming deltas into the center
+        variable, see distkeras.update_rules. None adds the deltas to the center variable.
+
+        Update rules are supported by the DeltaParameterServer and ADAGParameterServer.
+        """
+        assert update_rule is None or self.supports_update_rule(), \
+            type(self).__name__ + " does not support update rules"
+        self.update_rule = update_rule
+
+    def apply_update_rule(self, center_variable, delta):
+        """Integrates the delta into the center variable using the update rule, and returns
+        the new center variable. The caller should hold the lock.
+
+        The update rule operates on flat vectors, the state of the rule is kept in flat
+        buffers of the same size.
+        """
+        shapes = [w.shape for w in center_variable]
+        center_variable = self.update_rule.apply(flatten_weights(center_variable), flatten_weights(delta),
+                                                 self.num_updates)
+
+        return weights_array(unflatten_weights(center_variable, shapes))
+
+    def set_checkpointing(self, path, interval=60.0, config=None):
+        """Periodically writes a checkpoint of the center variable and the update counter
+        to the specified path while the parameter server is running.
+
+        The checkpoint is written to a temporary file first, which replaces the previous
+        checkpoint once it is complete. As a result, the path always holds a complete
+        checkpoint, even if the driver dies while writing. The path can be local, or on
+        a mounted distributed file system.
+
+        # Arguments
+            path: string. Path of the checkpoint. None disables the checkpoints.
+            interval: float. Number of seconds between two checkpoints.
+            config: dict. Configuration of the trainer, which is stored in the checkpoint.
+        """
+        self.checkpoint_path = path
+        self.checkpoint_interval = interval
+        self.checkpoint_config = config if config is not None else {}
+
+    def get_checkpoint(self):
+        """Returns a checkpoint of the parameter server as a dictionary.
+
+        The center variable, the update counter and the update rule are taken together
+        while holding the lock, see get_center_variable. The checkpoint is serialized
+        while the workers keep committing.
+        """
+        checkpoint = {}
+        with self.mutex:
+            checkpoint['center_variable'] = self.read_center_variable()
+            checkpoint['num_updates'] = self.num_updates
+            # The update rule replaces its state instead of updating it in place.
+            checkpoint['update_rule'] = copy.copy(self.update_rule)
+        checkpoint['timestamp'] = time.time()
+        checkpoint['config'] = self.checkpoint_config
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        """Restores the center variable and the update counter of the specified checkpoint."""
+        self.set_center_variable(checkpoint['center_variable'])
+        self.num_updates = checkpoint['num_updates']
+        if checkpoint.get('update_rule') is not None:
+            self.update_rule = checkpoint['update_rule']
+
+    def checkpointing(self):
+        """Event loop of the checkpointer."""
+        while not self.checkpointer_stop.wait(self.checkpoint_interval):
+            write_checkpoint(self.get_checkpoint(), self.checkpoint_path)
+        # Write the final checkpoint.
+        write_checkpoint(self.get_checkpoint(), self.checkpoint_path)
+
+    def set_metrics_export(self, path, interval=10.0):
+        """Periodically appends the metrics of the parameter server as a JSON line to the
+        specified local file while the parameter server is running.
+
+        # Arguments
+            path: string. Path of the file. None disables the export.
+            interval: float. Number of seconds between two exports.
+        """
+        self.metrics_path = path
+        self.metrics_interval = interval
+
+    def export_metrics(self):
+        """Appends the current metrics to the metrics file."""
+        with open(self.metrics_path, 'a') as f:
+            f.write(json.dumps(self.get_metrics()) + "\n")
+
+    def metrics_export(self):
+        """Event loop of the metrics exporter."""
+        while not self.metrics_exporter_stop.wait(self.metrics_interval):
+            self.export_metrics()
+        # Export the final metrics.
+        self.export_metrics()
+
+    def set_tracing(self, enabled):
+        """Records the commits, pulls and the critical sections of the parameter server as
+        trace events, and collects the trace events of the workers.
+
+        See distkeras.tracing.
+        """
+        if enabled:
+            self.tracer = Tracer(0, "Parameter server")
+        else:
+            self.tracer = None
+        self.mutex.set_tracer(self.tracer)
+
+    def trace(self, name):
+        """Returns a context manager which records the enclosed code as a trace event,
+        if tracing is enabled."""
+        if self.tracer is None:
+            return NullSpan()
+
+        return self.tracer.span(name, 'parameter server')
+
+    def handle_trace(self, conn, addr):
+        """Receives the trace events of a worker."""
+        events = recv_data(conn)
+        with self.telemetry_mutex:
+            self.worker_traces.append(events)
+
+    def get_traces(self):
+        """Returns the trace events of the parameter server, and of the workers which
+        finished their training procedure."""
+        traces = []
+        if self.tracer is not None:
+            traces.append(self.tracer.get_events())
+        with self.telemetry_mutex:
+            traces.extend(self.worker_traces)
+
+        return traces
+
+    def handle_shard(self, conn, addr):
+        """Handles the shard claims of the workers.
+
+        A worker claims the shard (partition) it is about to train on, and reports the
+        shard as done when its training procedure ends. A claim is refused when the
+        shard is being trained on, or was already trained on, e.g., by a speculative
+        copy of the task. The claim of a worker which disconnects before its shard is
+        done is released, which allows a retry of the task to claim the shard again.
+
+        # Arguments:
+            conn: socket. The opened connection.
+            addr: addr. Address of the remote host.
+        """
+        data = recv_data(conn)
+        shard = data['shard']
+        with self.shard_mutex:
+            if data['done']:
+                self.shard_states[shard] = 'done'
+                self.shard_claims.pop(addr, None)
+                granted = True
+            else:
+                granted = shard not in self.shard_states
+                if granted:
+                    self.shard_states[shard] = 'active'
+                    self.shard_claims[addr] = shard
+                else:
+                    self.num_refused_claims += 1
+        send_data(conn, granted)
+
+    def release_shard(self, addr):
+        """Releases the claim of the specified connection, if its shard is not done."""
+        with self.shard_mutex:
+            shard = self.shard_claims.pop(addr, None)
+            if shard is not None and self.shard_states.get(shard) == 'active':
+                del self.shard_states[shard]
+
+    def next_round(self):
+        """Prepares the running parameter server for the next training round of the same
+        trainer, see distkeras.trainers.DistributedTrainer.set_warm_start. The center
+        variable, the update counter and the hyperparameters are kept, while the stop
+        request, the shard states, the state of the connections and the trace events of
+        the workers are reset."""
+        self.stop_requested = False
+        self.pulled_updates = {}
+        self.hyperparameters_sent = {}
+        with self.shard_mutex:
+            self.shard_states = {}
+            self.shard_claims = {}
+        with self.telemetry_mutex:
+            self.worker_traces = []
+
+    def request_stop(self):
+        """Requests the workers to stop training.
+
+        The parameter server closes the connection of a worker on its next request, which
+        ends the optimization procedure of that worker.
+        """
+        self.stop_requested = True
+
     def handle_pull(self, conn, addr):
         """Handles parameter requests coming from the workers. This will
         actually send the model parameters to the requesting host.
@@ -135,8 +714,9 @@ class SocketParameterServer(ParameterServer):
         with self.mutex:
             center_variable = self.model.get_weights()
             cv = copy.deepcopy(center_variable)
+            num_updates = self.num_updates
         # Send the data over the socket.
-        send_data(conn, cv)
+        self.send_pull(conn, addr, cv, num_updates)
 
     def cancel_accept(self):
         """This method will cancel the accept procedure. The method
@@ -157,24 +737,55 @@ class SocketParameterServer(ParameterServer):
         in the following functionality. Classes which implement these interfaces
         should not worry about connection handling.
         """
+        self.metrics.record_connection(True)
         try:
             while self.running:
                 # Fetch the current action.
                 action = conn.recv(1).decode()
+                # Check if the worker closed the connection, or if the workers should stop.
+                if action == '' or self.stop_requested:
+                    break
                 # Check if the action is a commit (most of the cases).
                 if action == 'c':
                     # Handle the commit.
-                    self.handle_commit(conn, addr)
+                    with self.trace('handle commit'):
+                        self.handle_commit(conn, addr)
                 elif action == 'p':
                     # Handle the pull.
-                    self.handle_pull(conn, addr)
+                    with self.trace('handle pull'):
+                        self.handle_pull(conn, addr)
+                elif action == 't':
+                    # Handle the trace events of a worker.
+                    self.handle_trace(conn, addr)
+                elif action == 's':
+                    # Handle the shard claim of a worker.
+                    self.handle_shard(conn, addr)
         except Exception as e:
             print(e)
+        self.release_shard(addr)
+        # Forget the connection, its address can be reused by a later connection.
+        self.pulled_updates.pop(addr, None)
+        self.hyperparameters_sent.pop(addr, None)
+        conn.close()
+        self.metrics.record_connection(False)
 
     def start(self):
         """Starts the parameter server."""
         # Set the running flag.
         self.running = True
+        self.stop_requested = False
+        # Start the metrics exporter.
+        if self.metrics_path is not None:
+            self.metrics_exporter_stop.clear()
+            self.metrics_exporter = threading.Thread(target=self.metrics_export)
+            self.metrics_exporter.daemon = True
+            self.metrics_exporter.start()
+        # Start the checkpointer.
+        if self.checkpoint_path is not None:
+            self.checkpointer_stop.clear()
+            self.checkpointer = threading.Thread(target=self.checkpointing)
+            self.checkpointer.daemon = True
+            self.checkpointer.start()
 
     def run(self):
         """Main event loop of the parameter server."""
@@ -194,6 +805,7 @@ class SocketParameterServer(ParameterServer):
     def stop(self):
         """Stop the parameter server. This will also cleanup all existing connections."""
         self.running = False
+        self.initialized.clear()
         # Check if a socket is allocated.
         if self.socket:
             self.cleanup_connections()
@@ -202,6 +814,16 @@ class SocketParameterServer(ParameterServer):
             self.cancel_accept()
             self.socket = None
         self.connections = []
+        # Stop the metrics exporter.
+        if self.metrics_exporter is not None:
+            self.metrics_exporter_stop.set()
+            self.metrics_exporter.join()
+            self.metrics_exporter = None
+        # Stop the checkpointer.
+        if self.checkpointer is not None:
+            self.checkpointer_stop.set()
+            self.checkpointer.join()
+            self.checkpointer = None
 
     def finalize(self):
         """Method that is called when the parameter server stops."""
@@ -227,18 +849,30 @@ class DeltaParameterServer(SocketParameterServer):
 
     def __init__(self, model, master_port):
         super(DeltaParameterServer, self).__init__(model, master_port)
-        self.center_variable = np.asarray(self.model.get_weights())
+        self.center_variable = weights_array(self.model.get_weights())
+
+    def supports_update_rule(self):
+        """See SocketParameterServer.supports_update_rule."""
+        return True
 
     def handle_commit(self, conn, addr):
         # Receive the parameters from the remote node.
-        data = recv_data(conn)
+        data = self.receive_commit(conn, addr)
         # Extract the delta from the dictionary.
         delta = data['delta']
-        # Update the center variable with the delta.
         with self.mutex:
-            self.center_variable = self.center_variable + delta
-        # Next iteration.
-        self.next_update()
+            # Check if the commit is too stale to be applied.
+            staleness = self.get_staleness(addr)
+            applied = not self.exceeds_staleness_bound(staleness)
+            if applied:
+                # Update the center variable with the delta.
+                if self.update_rule is None:
+                    self.center_variable = self.center_variable + delta
+                else:
+                    self.center_variable = self.apply_update_rule(self.center_variable, delta)
+                # Next iteration.
+                self.next_update()
+        self.record_commit(data, staleness, applied)
 
     def handle_pull(self, conn, addr):
         """Handles parameter requests coming from the workers. This will
@@ -251,8 +885,18 @@ class DeltaParameterServer(SocketParameterServer):
         # Fetch the raw center variables.
         with self.mutex:
             cv = copy.deepcopy(self.center_variable)
+            num_updates = self.num_updates
         # Send the data over the socket.
-        send_data(conn, cv)
+        self.send_pull(conn, addr, cv, num_updates)
+
+    def read_center_variable(self):
+        """See SocketParameterServer.read_center_variable."""
+        return self.center_variable
+
+    def set_center_variable(self, center_variable):
+        """See SocketParameterServer.set_center_variable."""
+        with self.mutex:
+            self.center_variable = weights_array(center_variable)
 
     def finalize(self):
         # Set the final weights of the model.
@@ -271,18 +915,30 @@ class ADAGParameterServer(SocketParameterServer):
 
     def __init__(self, model, master_port):
         super(ADAGParameterServer, self).__init__(model, master_port)
-        self.center_variable = np.asarray(self.model.get_weights())
+        self.center_variable = weights_array(self.model.get_weights())
+
+    def supports_update_rule(self):
+        """See SocketParameterServer.supports_update_rule."""
+        return True
 
     def handle_commit(self, conn, addr):
         # Receive the parameters from the remote node.
-        data = recv_data(conn)
+        data = self.receive_commit(conn, addr)
         # Extract the data from the dictionary.
         r = data['residual']
         with self.mutex:
-            # Update the center variable.
-            self.center_variable = self.center_variable + r
-        # Increment the number of parameter server updates.
-        self.next_update()
+            # Check if the commit is too stale to be applied.
+            staleness = self.get_staleness(addr)
+            applied = not self.exceeds_staleness_bound(staleness)
+            if applied:
+                # Update the center variable.
+                if self.update_rule is None:
+                    self.center_variable = self.center_variable + r
+                else:
+                    self.center_variable = self.apply_update_rule(self.center_variable, r)
+                # Increment the number of parameter server updates.
+                self.next_update()
+        self.record_commit(data, staleness, applied)
 
     def handle_pull(self, conn, addr):
         """Handles parameter requests coming from the workers. This will
@@ -295,8 +951,18 @@ class ADAGParameterServer(SocketParameterServer):
         # Fetch the raw center variables.
         with self.mutex:
             cv = copy.deepcopy(self.center_variable)
+            num_updates = self.num_updates
         # Send the data over the socket.
-        send_data(conn, cv)
+        self.send_pull(conn, addr, cv, num_updates)
+
+    def read_center_variable(self):
+        """See SocketParameterServer.read_center_variable."""
+        return self.center_variable
+
+    def set_center_variable(self, center_variable):
+        """See SocketParameterServer.set_center_variable."""
+        with self.mutex:
+            self.center_variable = weights_array(center_variable)
 
     def finalize(self):
         # Set the weights of the model.
@@ -337,21 +1003,26 @@ class DynSGDParameterServer(SocketParameterServer):
         # Store the model (m).
         data['model'] = cv
         # Send the data over the socket.
-        send_data(conn, data)
+        self.send_pull(conn, addr, data, data['update'])
 
     def handle_commit(self, conn, addr):
-        data = recv_data(conn)
+        data = self.receive_commit(conn, addr)
         r = data['residual']
         # Fetch the last iteration number
         last_update = data['last_update']
-        du = (self.num_updates - last_update) + 1
-        r /= du
         with self.mutex:
-            center_variable = self.model.get_weights()
-            center_variable = center_variable + r
-            self.model.set_weights(center_variable)
-        # Increment the number of parameter server updates.
-        self.next_update()
+            # Check if the commit is too stale to be applied.
+            staleness = self.get_staleness(addr)
+            applied = not self.exceeds_staleness_bound(staleness)
+            if applied:
+                du = (self.num_updates - last_update) + 1
+                r /= du
+                center_variable = weights_array(self.model.get_weights())
+                center_variable = center_variable + r
+                self.model.set_weights(center_variable)
+                # Increment the number of parameter server updates.
+                self.next_update()
+        self.record_commit(data, staleness, applied)
 
 
 class ExperimentalParameterServer(SocketParameterServer):
@@ -366,24 +1037,36 @@ class ExperimentalParameterServer(SocketParameterServer):
 
     def __init__(self, model, master_port, learning_rate):
         super(ExperimentalParameterServer, self).__init__(model, master_port)
-        self.center_variable = np.asarray(self.model.get_weights())
+        self.center_variable = weights_array(self.model.get_weights())
         self.inverse_learning_rate = 1.0 / learning_rate
 
+    def update_hyperparameters(self, hyperparameters):
+        """See SocketParameterServer.update_hyperparameters, the learning rate is applied
+        to the incoming residuals."""
+        if 'learning_rate' in hyperparameters:
+            self.inverse_learning_rate = 1.0 / hyperparameters['learning_rate']
+        super(ExperimentalParameterServer, self).update_hyperparameters(hyperparameters)
+
     def handle_commit(self, conn, addr):
         # Receive the parameters from the remote node.
-        data = recv_data(conn)
+        data = self.receive_commit(conn, addr)
         # Extract the data from the dictionary.
         r = data['residual']
         worker_id = data['worker_id']
         stale_cv = data['stale_center_variable']
         with self.mutex:
-            diff_cv = np.subtract(self.center_variable, stale_cv)
-            d = 1 / (self.inverse_learning_rate * np.power(diff_cv, 2) + 1)
-            r = np.multiply(d, r)
-            # Update the center variable.
-            self.center_variable = self.center_variable + r
-        # Increment the number of parameter server updates.
-        self.next_update()
+            # Check if the commit is too stale to be applied.
+            staleness = self.get_staleness(addr)
+            applied = not self.exceeds_staleness_bound(staleness)
+            if applied:
+                diff_cv = np.subtract(self.center_variable, stale_cv)
+                d = 1 / (self.inverse_learning_rate * np.power(diff_cv, 2) + 1)
+                r = np.multiply(d, r)
+                # Update the center variable.
+                self.center_variable = self.center_variable + r
+                # Increment the number of parameter server updates.
+                self.next_update()
+        self.record_commit(data, staleness, applied)
 
     def handle_pull(self, conn, addr):
         """Handles parameter requests coming from the workers. This will
@@ -396,9 +1079,147 @@ class ExperimentalParameterServer(SocketParameterServer):
         # Fetch the raw center variables.
         with self.mutex:
             cv = copy.deepcopy(self.center_variable)
+            num_updates = self.num_updates
         # Send the data over the socket.
-        send_data(conn, cv)
+        self.send_pull(conn, addr, cv, num_updates)
+
+    def read_center_variable(self):
+        """See SocketParameterServer.read_center_variable."""
+        return self.center_variable
+
+    def set_center_variable(self, center_variable):
+        """See SocketParameterServer.set_center_variable."""
+        with self.mutex:
+            self.center_variable = weights_array(center_variable)
 
     def finalize(self):
         # Set the weights of the model.
         self.model.set_weights(self.center_variable)
+
+
+class AveragingParameterServer(SocketParameterServer):
+    """A parameter server which periodically averages the models of the workers (local SGD).
+
+    Training is divided in rounds. In every round, the workers commit the flattened
+    weights of their model replica, and wait in their pull until the round completes.
+    A round completes when all active workers committed, after which the waiting
+    workers receive the average of the committed models. A worker becomes active with
+    its first pull or commit, so tasks which Spark did not schedule yet (e.g., when
+    there are more partitions than cores) are not waited for. Workers which exhausted
+    their partition send a final commit, their weights are included in the current
+    round, but the following rounds do not wait for them. The same holds for workers
+    which lost their connection.
+
+    # Arguments
+        model: string. Serialized Keras model.
+               See: distkeras.utils.serialize_keras_model
+        master_port: int. Port number of the parameter server.
+        timeout: float. Number of seconds a round waits for the missing workers. Only
+                 guards against workers which hang without closing their connection.
+    """
+
+    def __init__(self, model, master_port, timeout=60.0):
+        super(AveragingParameterServer, self).__init__(model, master_port)
+        self.weight_shapes = [w.shape for w in self.model.get_weights()]
+        self.center_variable = flatten_weights(self.model.get_weights())
+        self.active_workers = set()
+        self.timeout = timeout
+        self.round = 0
+        self.round_sum = 0.0
+        self.round_num_models = 0
+        self.round_num_waiting = 0
+        self.committed_rounds = {}
+        self.condition = threading.Condition()
+
+    def complete_round(self):
+        """Averages the models which were committed in the current round.
+
+        This method should be called while holding the condition.
+        """
+        if self.round_num_models > 0:
+            self.center_variable = self.round_sum / self.round_num_models
+            self.next_update()
+        self.round_sum = 0.0
+        self.round_num_models = 0
+        self.round_num_waiting = 0
+        self.round += 1
+        self.condition.notify_all()
+
+    def check_round(self):
+        """Completes the current round if all active workers committed their model.
+
+        This method should be called while holding the condition.
+        """
+        if self.round_num_waiting > 0 and self.round_num_waiting >= len(self.active_workers):
+            self.complete_round()
+
+    def handle_connection(self, conn, addr):
+        """See SocketParameterServer.handle_connection. The rounds stop waiting for
+        the worker once its connection is closed."""
+        try:
+            super(AveragingParameterServer, self).handle_connection(conn, addr)
+        finally:
+            with self.condition:
+                self.active_workers.discard(addr)
+                self.committed_rounds.pop(addr, None)
+                self.check_round()
+
+    def handle_commit(self, conn, addr):
+        data = self.receive_commit(conn, addr)
+        with self.condition:
+            staleness = self.get_staleness(addr)
+            self.round_sum = self.round_sum + data['weights']
+            self.round_num_models += 1
+            # Check if the worker leaves the averaging procedure.
+            if data['final']:
+                self.active_workers.discard(addr)
+            else:
+                self.active_workers.add(addr)
+                self.round_num_waiting += 1
+                self.committed_rounds[addr] = self.round
+            self.check_round()
+        self.record_commit(data, staleness)
+
+    def handle_pull(self, conn, addr):
+        """Sends the averaged model to the worker, once the round in which the worker
+        committed its model is completed.
+
+        # Arguments:
+            conn: socket. The opened connection.
+            addr: addr. Address of the remote host.
+        """
+        with self.condition:
+            # Check if the worker joins the averaging procedure.
+            if addr not in self.committed_rounds:
+                self.active_workers.add(addr)
+            committed_round = self.committed_rounds.pop(addr, None)
+            deadline = time.time() + self.timeout
+            while committed_round == self.round:
+                remaining = deadline - time.time()
+                # Check if the round needs to be completed without the missing workers.
+                if remaining <= 0:
+                    self.complete_round()
+                    break
+                self.condition.wait(remaining)
+            cv = self.center_variable
+            num_updates = self.num_updates
+        # Send the data over the socket.
+        self.send_pull(conn, addr, cv, num_updates)
+
+    def read_center_variable(self):
+        """See SocketParameterServer.read_center_variable. The center variable is
+        replaced at the end of every round, so reading it does not need the condition."""
+        return unflatten_weights(self.center_variable, self.weight_shapes)
+
+    def set_center_variable(self, center_variable):
+        """See SocketParameterServer.set_center_variable."""
+        with self.condition:
+            self.center_variable = flatten_weights(center_variable)
+
+    def finalize(self):
+        # Average the models of the incomplete round.
+        with self.condition:
+            if self.round_num_models > 0:
+                self.complete_round()
+        # Set the weights of the model.
+        self.model.set_weights(unflatten_weights(self.center_variable, self.weight_shapes))
@@ -6,8 +6,18 @@ adjust the hyperparameters to improve training performance.
 
 ## BEGIN Imports. ##############################################################
 
+from distkeras.trainers import DynSGD
+
+from distkeras.utils import deserialize_keras_model
+
 import math
 
+import tensorflow as tf
+
+import threading
+
+import traceback
+
 ## END Imports. ################################################################
 
 class Scheme(object):
@@ -64,25 +74,204 @@ class Emperor(Scheme):
     def optimize(self, training_set, validation_set):
         trained_model = None
 
+        # Keep the parameter server and the prepared training set alive between the rounds.
+        self.optimizer.set_warm_start(True)
         # Fetch the number of evaluations, to match the number of epochs.
         num_evaluations = self.get_epoch_over_evaluation_frequency() + 1
-        # Iterate over the number of evaluation epochs.
-        for i in range(0, num_evaluations):
-            # Train the model.
-            trained_model = self.optimizer.train(training_set)
-            self.optimizer.set_model(trained_model)
-            # Evaluate the training set, and fetch the loss.
-            loss = self.evaluate_loss(trained_model, validation_set)
-            print("Current loss: " + str(loss))
-            dl = math.fabs(loss - self.previous_loss)
-            self.previous_loss = loss
-            if dl <= self.loss_threshold:
-                print("Lowering learning rate.")
-                print("Old learning rate: " + str(self.optimizer.get_learning_rate()))
-                # Modify the learning rate.
-                learning_rate = self.optimizer.get_learning_rate()
-                learning_rate /= 10
-                self.optimizer.set_learning_rate(learning_rate)
-                print("New learning rate: "+ str(self.optimizer.get_learning_rate()))
+        try:
+            # Iterate over the number of evaluation epochs.
+            for i in range(0, num_evaluations):
+                # Train the model, continuing from the center variable of the previous round.
+                trained_model = self.optimizer.train(training_set)
+                self.optimizer.set_model(trained_model)
+                # Evaluate the training set, and fetch the loss.
+                loss = self.evaluate_loss(trained_model, validation_set)
+                print("Current loss: " + str(loss))
+                dl = math.fabs(loss - self.previous_loss)
+                self.previous_loss = loss
+                if dl <= self.loss_threshold:
+                    print("Lowering learning rate.")
+                    print("Old learning rate: " + str(self.optimizer.get_learning_rate()))
+                    # Modify the learning rate, which the workers of the next round pull.
+                    learning_rate = self.optimizer.get_learning_rate()
+                    learning_rate /= 10
+                    self.optimizer.update_hyperparameters(learning_rate=learning_rate)
+                    print("New learning rate: "+ str(self.optimizer.get_learning_rate()))
+        finally:
+            self.optimizer.shutdown()
+            self.optimizer.set_warm_start(False)
 
         return trained_model
+
+
+class Trial(object):
+    """A trial of a hyperparameter search. Every trial trains its own distributed trainer
+    in its own driver thread, Keras graph and Spark scheduler pool.
+
+    # Arguments
+        trial_id: int. Identifier of the trial.
+        configuration: dict. Hyperparameters of the trial.
+        trainer: trainer. Distributed trainer of the trial.
+        pool: string. Name of the FAIR scheduler pool of the trial.
+    """
+
+    def __init__(self, trial_id, configuration, trainer, pool):
+        self.trial_id = trial_id
+        self.configuration = configuration
+        self.trainer = trainer
+        self.pool = pool
+        self.graph = tf.Graph()
+        self.session = tf.Session(graph=self.graph)
+        self.losses = []
+        self.num_epoch = 0
+        self.weights = None
+        self.thread = None
+
+    def get_loss(self):
+        """Returns the validation loss of the last rung."""
+        return self.losses[-1]
+
+    def run_rung(self, training_set, validation_set, evaluate_loss):
+        """Trains the trainer of the trial for another rung, and evaluates the trained model."""
+        # Submit the Spark jobs of this thread to the pool of the trial.
+        training_set.rdd.context.setLocalProperty('spark.scheduler.pool', self.pool)
+        try:
+            # Keras uses the default session, which isolates the models of the trials.
+            with self.graph.as_default(), self.session.as_default():
+                model = self.trainer.train(training_set)
+                self.weights = model.get_weights()
+                self.losses.append(float(evaluate_loss(model, validation_set)))
+        except Exception as e:
+            print("Trial " + str(self.trial_id) + " failed: " + str(e))
+            traceback.print_exc()
+            self.losses.append(float('inf'))
+        self.num_epoch += self.trainer.get_num_epoch()
+
+    def start_rung(self, training_set, validation_set, evaluate_loss):
+        """Runs the next rung of the trial in a separate thread."""
+        self.thread = threading.Thread(target=self.run_rung, args=(training_set, validation_set, evaluate_loss))
+        self.thread.start()
+
+    def join(self):
+        """Waits for the rung of the trial to finish."""
+        self.thread.join()
+        self.thread = None
+
+    def stop(self):
+        """Stops the parameter server of the trial, and releases its Keras graph."""
+        with self.graph.as_default(), self.session.as_default():
+            self.trainer.shutdown()
+        self.trainer.set_warm_start(False)
+        self.session.close()
+
+    def get_model(self):
+        """Returns the model of the last rung, in the Keras graph of the caller, or None if
+        the trial failed."""
+        if self.weights is None:
+            return None
+
+        return deserialize_keras_model({'model': self.trainer.master_model['model'], 'weights': self.weights})
+
+
+class SuccessiveHalving(Scheme):
+    """The 'SuccessiveHalving' scheme searches the hyperparameters of a distributed
+    optimizer by training many trials concurrently, and by stopping the worst trials
+    at the end of every rung.
+
+    Every trial trains `evaluation_frequency` epochs per rung, after which it is evaluated
+    on the validation set. Only the best 1 / `reduction_factor` of the trials continue
+    with the next rung, from their current center variable (see
+    distkeras.trainers.DistributedTrainer.set_warm_start). A trial which fails is
+    reported with its traceback and ranked last, the search is aborted with a
+    RuntimeError once all remaining trials failed.
+
+    The trials share the executors of the cluster. Every trial runs its own parameter
+    server on a port which is assigned by the OS, and submits its Spark jobs to its own
+    scheduler pool. Set `spark.scheduler.mode` to FAIR, so the trials receive an equal
+    share of the executors, and size the number of workers of a trial accordingly. The
+    pool of a trial is a local property of its driver thread, which requires the pinned
+    thread mode of PySpark (the default since Spark 3.2).
+
+    # Arguments
+        allocate_trainer: function. Function which accepts a dictionary of hyperparameters
+                          (e.g., the learning rate, mini-batch size and communication
+                          window), and returns a distributed trainer of which the master
+                          port is None. DynSGD is not supported, as its parameter server
+                          updates the Keras model from the threads of its connections.
+        configurations: list. Dictionaries of hyperparameters, one for every trial.
+        evaluate_loss: function. Function which evaluates the loss. This
+                       function should accept a model, and a dataframe.
+        num_epoch: int. Maximum number of epochs of a trial.
+        evaluation_frequency: int. Number of epochs per rung.
+        reduction_factor: int. The number of trials is divided by this factor at the end
+                          of every rung.
+        pool_prefix: string. Prefix of the names of the scheduler pools of the trials.
+    """
+
+    def __init__(self, allocate_trainer, configurations, evaluate_loss, num_epoch=15, evaluation_frequency=5,
+                 reduction_factor=2, pool_prefix="trial-"):
+        self.allocate_trainer = allocate_trainer
+        self.configurations = configurations
+        self.evaluate_loss = evaluate_loss
+        self.reduction_factor = reduction_factor
+        self.pool_prefix = pool_prefix
+        self.trials = []
+        super(SuccessiveHalving, self).__init__(None, num_epoch, evaluation_frequency)
+
+    def initialize(self):
+        """Every trial allocates its own optimizer, see allocate_trial."""
+        pass
+
+    def allocate_trial(self, trial_id, configuration):
+        """Allocates the trial with the specified hyperparameters."""
+        trainer = self.allocate_trainer(configuration)
+        assert not isinstance(trainer, DynSGD), "SuccessiveHalving does not support DynSGD"
+        trainer.set_num_epoch(self.evaluation_frequency)
+        trainer.set_warm_start(True)
+
+        return Trial(trial_id, configuration, trainer, self.pool_prefix + str(trial_id))
+
+    def get_results(self):
+        """Returns the hyperparameters, the validation losses after every rung, and the
+        number of trained epochs of every trial, ordered by the final loss."""
+        results = []
+        for trial in sorted(self.trials, key=lambda trial: trial.get_loss()):
+            result = {}
+            result['configuration'] = trial.configuration
+            result['losses'] = trial.losses
+            result['num_epoch'] = trial.num_epoch
+            results.append(result)
+
+        return results
+
+    def optimize(self, training_set, validation_set):
+        self.trials = [self.allocate_trial(i, c) for i, c in enumerate(self.configurations)]
+        active_trials = list(self.trials)
+        # Fetch the number of rungs, to match the number of epochs.
+        num_rungs = max(1, self.get_epoch_over_evaluation_frequency())
+        try:
+            for rung in range(0, num_rungs):
+                # Train all remaining trials concurrently.
+                for trial in active_trials:
+                    trial.start_rung(training_set, validation_set, self.evaluate_loss)
+                for trial in active_trials:
+                    trial.join()
+                active_trials.sort(key=lambda trial: trial.get_loss())
+                # Check if all remaining trials failed.
+                if math.isinf(active_trials[0].get_loss()):
+                    raise RuntimeError("All trials failed in rung " + str(rung))
+                print("Rung " + str(rung) + ", best loss: " + str(active_trials[0].get_loss()) +
+                      " (" + str(len(active_trials)) + " trials)")
+                # Check if this is the last rung.
+                if rung == num_rungs - 1:
+                    break
+                # Stop the worst trials.
+                num_trials = max(1, int(math.ceil(len(active_trials) / float(self.reduction_factor))))
+                for trial in active_trials[num_trials:]:
+                    trial.stop()
+                active_trials = active_trials[:num_trials]
+        finally:
+            for trial in active_trials:
+                trial.stop()
+
+        return active_trials[0].get_model()
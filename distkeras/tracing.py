@@ -0,0 +1,124 @@
+"""Tracing module.
+
+This module records the begin and end of the different phases of a distributed
+training procedure (data wait, compute, commit, pull and the critical sections of
+the parameter server), and exports them in the Chrome trace event format. The
+resulting file can be inspected with chrome://tracing or https://ui.perfetto.dev.
+"""
+
+## BEGIN Imports. ##############################################################
+
+import json
+
+import threading
+
+import time
+
+## END Imports. ################################################################
+
+# Monotonic clock, falls back to the wall clock in Python 2.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class NullSpan(object):
+    """Span which does not record anything, used when tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Span(object):
+    """Records a complete event from the moment the span is entered until it is exited.
+
+    # Arguments
+        tracer: Tracer. Tracer which records the event.
+        name: string. Name of the event.
+        category: string. Category of the event.
+    """
+
+    def __init__(self, tracer, name, category):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = self.tracer.now()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.add_event(self.name, self.category, self.start, self.tracer.now())
+
+        return False
+
+
+class Tracer(object):
+    """Records trace events of a single process of the training procedure.
+
+    Timestamps are taken from a monotonic clock, which is aligned with the wall clock
+    when the tracer is allocated. This allows us to merge the traces of different
+    machines into a single timeline.
+
+    # Arguments
+        process_id: int. Identifier of the process in the trace.
+        process_name: string. Human-readable name of the process.
+    """
+
+    def __init__(self, process_id, process_name):
+        self.process_id = process_id
+        self.offset = time.time() - monotonic()
+        self.mutex = threading.Lock()
+        self.events = [{'name': 'process_name', 'ph': 'M', 'pid': process_id,
+                        'args': {'name': process_name}}]
+
+    def now(self):
+        """Returns the current time of the tracer clock in seconds."""
+        return monotonic() + self.offset
+
+    def span(self, name, category):
+        """Returns a context manager which records the enclosed code as an event."""
+        return Span(self, name, category)
+
+    def add_event(self, name, category, start, end):
+        """Records a complete event.
+
+        # Arguments
+            name: string. Name of the event.
+            category: string. Category of the event.
+            start: float. Begin of the event (see now()).
+            end: float. End of the event (see now()).
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self.process_id,
+                 'tid': threading.current_thread().ident,
+                 'ts': start * 1e6, 'dur': (end - start) * 1e6}
+        with self.mutex:
+            self.events.append(event)
+
+    def get_events(self):
+        """Returns the recorded events."""
+        with self.mutex:
+            return list(self.events)
+
+
+def merge_traces(traces):
+    """Merges the events of several tracers into a single Chrome trace.
+
+    # Arguments
+        traces: list. List of event lists, see Tracer.get_events.
+    """
+    events = []
+    for trace in traces:
+        events.extend(trace)
+    events.sort(key=lambda e: e.get('ts', 0))
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_trace(trace, path):
+    """Writes the Chrome trace to the specified path."""
+    with open(path, 'w') as f:
+        json.dump(trace, f)
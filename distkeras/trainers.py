@@ -3,6 +3,8 @@ Keras model in a distributed manner (with exception of the SingleTrainer)."""
 
 ## BEGIN Imports. ##############################################################
 
+import copy
+
 import numpy as np
 
 import threading
@@ -10,26 +12,39 @@ import threading
 import time
 
 from distkeras.parameter_servers import ADAGParameterServer
+from distkeras.parameter_servers import AveragingParameterServer
 from distkeras.parameter_servers import DeltaParameterServer
 from distkeras.parameter_servers import DynSGDParameterServer
 from distkeras.parameter_servers import ExperimentalParameterServer
 
+from distkeras.utils import balance_partitions
+from distkeras.utils import concatenate_histories
 from distkeras.utils import deserialize_keras_model
 from distkeras.utils import history_executor
 from distkeras.utils import history_executors_average
+from distkeras.utils import load_checkpoint
 from distkeras.utils import pickle_object
 from distkeras.utils import serialize_keras_model
 from distkeras.utils import set_keras_base_directory
+from distkeras.utils import shuffle as shuffle_dataframe
+from distkeras.utils import StatisticsAccumulatorParam
+from distkeras.utils import sum_phase_times
+from distkeras.utils import unflatten_weights
 from distkeras.utils import unpickle_object
 
 from distkeras.networking import determine_host_address
 
+from distkeras.tracing import merge_traces
+from distkeras.tracing import write_trace
+
 from distkeras.workers import ADAGWorker
 from distkeras.workers import AEASGDWorker
+from distkeras.workers import AveragingWorker
 from distkeras.workers import DOWNPOURWorker
 from distkeras.workers import DynSGDWorker
 from distkeras.workers import ExperimentalWorker
 from distkeras.workers import EAMSGDWorker
+from distkeras.workers import PeriodicAveragingWorker
 from distkeras.workers import SequentialWorker
 
 from keras import backend as K
@@ -58,16 +73,165 @@ class Trainer(object):
         self.loss_weights = loss_weights
         self.worker_optimizer = worker_optimizer
         self.metrics = metrics
-        self.history = []
+        self.history = concatenate_histories([])
+        self.phase_totals = []
         self.training_time_start = 0
         self.training_time_end = 0
         self.training_time = 0
         self.max_mini_batches_prefetch = 100
+        self.epoch_cache = True
+        self.epoch_cache_directory = None
+        self.epoch_shuffle = False
+        self.model_cache = True
+        self.statistics = None
+        self.steps_per_call = 1
+        self.history_sampling = None
+        self.history_sampling_size = 1
+        self.parameter_server = None
+        self.parameter_server_thread = None
+        self.broadcast_model = True
+        self.model_broadcast = None
+        self.partition_balancing = False
+        self.partition_tolerance = 0.1
+        self.warm_start = False
 
     def set_max_prefetch(self, max_mini_batches):
         """Sets the maximum amount of mini-batches that can be prefetched by a worker."""
         self.max_mini_batches_prefetch = max_mini_batches
 
+    def set_epoch_cache(self, enabled, directory=None, shuffle=False):
+        """Configures how the workers replay their partition over multiple epochs.
+
+        # Arguments
+            enabled: boolean. Spills the decoded partition of a worker to a local file
+                     during the first epoch, and replays the other epochs from that file
+                     instead of buffering all rows in memory.
+            directory: string. Local directory on the executors which holds the spilled
+                       partitions. Defaults to the temporary directory of the system.
+            shuffle: boolean. Shuffles the rows of a partition in every replayed epoch.
+        """
+        self.epoch_cache = enabled
+        self.epoch_cache_directory = directory
+        self.epoch_shuffle = shuffle
+
+    def set_steps_per_call(self, steps_per_call):
+        """Sets the number of mini-batches a worker trains on within a single call to Keras.
+
+        Stacking several mini-batches reduces the per-step dispatch overhead, which dominates
+        the training time of small models. The communication windows of the distributed
+        optimizers are evaluated per block of mini-batches: a worker communicates after the
+        block in which a window ends, so the number of mini-batches between two commits
+        varies around the window. EAMSGD applies its momentum per mini-batch, and ignores
+        this setting.
+        """
+        self.steps_per_call = steps_per_call
+
+    def set_history_sampling(self, sampling, sampling_size=1):
+        """Limits the number of iterations which are recorded in the training history.
+
+        # Arguments
+            sampling: string. None records every iteration, 'every' records every
+                      `sampling_size`-th iteration, and 'reservoir' keeps a uniform sample
+                      of `sampling_size` iterations per worker.
+            sampling_size: int. Sampling interval, or size of the reservoir.
+        """
+        self.history_sampling = sampling
+        self.history_sampling_size = sampling_size
+
+    def set_model_cache(self, enabled):
+        """Allows workers to reuse the compiled model of a previous task which was executed
+        by the same Python process on an executor (for example, in the next epoch, or in the
+        next call of train()). In that case, only the weights of the model are overwritten.
+        """
+        self.model_cache = enabled
+
+    def set_broadcast_model(self, enabled):
+        """Ships the serialized model to the executors through a Spark broadcast variable,
+        which is transferred once per executor, instead of pickling it into the closure of
+        every task.
+        """
+        self.broadcast_model = enabled
+
+    def unpersist_model(self):
+        """Removes the broadcast model of the last training procedure from the executors.
+
+        Only for internal use.
+        """
+        if self.model_broadcast is not None:
+            self.model_broadcast.unpersist()
+            self.model_broadcast = None
+
+    def set_partition_balancing(self, enabled, tolerance=0.1):
+        """Repartitions the dataframe into partitions with an equal number of rows before
+        training, instead of coalescing its partitions regardless of their size.
+
+        See distkeras.utils.balance_partitions.
+
+        # Arguments
+            enabled: boolean. Enables the balancing of the partitions.
+            tolerance: float. Allowed relative deviation of a partition size from the mean,
+                       before the dataframe is repartitioned.
+        """
+        self.partition_balancing = enabled
+        self.partition_tolerance = tolerance
+
+    def repartition(self, dataframe, num_partitions):
+        """Repartitions the dataframe into the specified number of partitions.
+
+        Only for internal use.
+        """
+        if self.partition_balancing:
+            return balance_partitions(dataframe, num_partitions, self.partition_tolerance)
+        # Check if we need to repartition the dataframe.
+        if dataframe.rdd.getNumPartitions() >= num_partitions:
+            return dataframe.coalesce(num_partitions)
+
+        return dataframe.repartition(num_partitions)
+
+    def get_statistics(self):
+        """Returns the statistics which were reported by the workers.
+
+        This includes the number of model cache hits and misses ('model_cache_hits',
+        'model_cache_misses'), the time spent on compiling models ('compile_time'), the
+        compilation time saved by the model cache ('compile_time_saved'), and the time
+        spent waiting in the barrier of a barrier stage ('barrier_wait_time').
+        """
+        if self.statistics is None:
+            return {}
+
+        return dict(self.statistics.value)
+
+    def configure_worker(self, worker, context):
+        """Applies the trainer-wide worker settings to the specified worker.
+
+        Only for internal use.
+
+        # Arguments
+            worker: worker. Worker to configure.
+            context: SparkContext. Spark context which will execute the worker.
+        """
+        # Set the maximum number of mini-batches.
+        worker.set_max_prefetch(self.max_mini_batches_prefetch)
+        # Set the epoch replay settings.
+        worker.set_epoch_cache(self.epoch_cache, self.epoch_cache_directory, self.epoch_shuffle)
+        # Set the model cache settings.
+        worker.set_model_cache(self.model_cache)
+        # Set the number of mini-batches per training call.
+        worker.set_steps_per_call(self.steps_per_call)
+        # Set the sampling method of the training history.
+        worker.set_history_sampling(self.history_sampling, self.history_sampling_size)
+        # Allocate the accumulator which collects the worker statistics.
+        if self.statistics is None:
+            self.statistics = context.accumulator({}, StatisticsAccumulatorParam())
+        worker.set_statistics(self.statistics)
+        # Ship the model through a broadcast variable.
+        if self.broadcast_model:
+            # Check if the broadcast model of the previous round can be reused.
+            if self.model_broadcast is None or not self.warm_start:
+                self.unpersist_model()
+                self.model_broadcast = context.broadcast(worker.model)
+            worker.set_model_broadcast(self.model_broadcast)
+
     def set_model(self, model):
         """Sets the master model to be used by the trainer."""
         self.master_model = serialize_keras_model(model)
@@ -92,18 +256,82 @@ class Trainer(object):
         """Returns the told training time."""
         return self.training_time
 
+    def record_worker_results(self, results):
+        """Stores the histories and the phase totals which were returned by the workers,
+        see distkeras.workers.Worker.get_history.
+
+        Only for internal use.
+        """
+        self.history = concatenate_histories([records for records, totals in results if records is not None])
+        self.phase_totals = [totals for records, totals in results]
+
     def get_history(self):
-        """Returns all history object aggregated during training."""
+        """Returns the training history of all workers as a single numpy record array.
+
+        See distkeras.utils.history_dtype for the fields of a record. Every record also
+        holds the time the worker spent waiting for data, training, serializing,
+        committing and pulling since its previous record. It also holds the number of
+        bytes the worker exchanged with the parameter server since that record.
+        """
         return self.history
 
-    def get_averaged_history(self):
-        """Returns the averaged history of the center variable."""
-        return history_executors_average(self.history)
+    def get_averaged_history(self, field='history'):
+        """Returns the averaged history of the center variable.
+
+        # Arguments
+            field: string. History field to average. By default the training metrics are
+                   averaged, but the phase times (e.g., 'compute_time') can be averaged as well.
+        """
+        return history_executors_average(self.history, field)
 
     def get_executor_history(self, executor_id):
         """Returns the history of a specific executor."""
         return history_executor(self.history, executor_id)
 
+    def get_phase_times(self, executor_id=None):
+        """Returns the total time spent in every phase of the training procedure, and the
+        total number of bytes exchanged with the parameter server.
+
+        This allows to determine whether the training procedure is data, compute, or
+        network bound. The totals are reported by the workers separately from their
+        history, so they are exact even if the history is sampled. See
+        distkeras.utils.sum_phase_times.
+
+        # Arguments
+            executor_id: int. Only aggregates the totals of the specified executor.
+                         By default, the totals of all executors are aggregated.
+        """
+        return sum_phase_times(self.phase_totals, executor_id)
+
+    def service(self):
+        """Executes the parameter server service."""
+        self.parameter_server.start()
+        self.parameter_server.initialize()
+        self.parameter_server.run()
+
+    def stop_service(self):
+        """Stops the parameter server service."""
+        self.parameter_server.stop()
+        self.parameter_server_thread.join()
+        self.parameter_server_thread = None
+
+    def start_service(self):
+        """Starts the parameter server service."""
+        # Check if a parameter server thread is already allocated.
+        if not self.parameter_server_thread is None:
+            # Stop the parameter server service.
+            self.stop_service()
+        # Allocate a new parameter service thread.
+        self.parameter_server_thread = threading.Thread(target=self.service)
+        self.parameter_server_thread.start()
+        # Wait until the parameter server listens, as the OS might assign its port.
+        self.parameter_server.initialized.wait()
+        # Check if the parameter server failed to listen, e.g., because the port is in use.
+        error = self.parameter_server.initialization_error
+        if error is not None:
+            self.stop_service()
+            raise error
+
     def train(self, dataframe, shuffle=False):
         """Trains the specified model using the specified dataframe.
 
@@ -170,21 +398,22 @@ class SingleTrainer(Trainer):
         """
         # Check if the data needs to be shuffled.
         if shuffle:
-            dataframe = shuffle(dataframe)
+            dataframe = shuffle_dataframe(dataframe)
         # Collect the dataframe on a single worker node.
         dataframe = dataframe.coalesce(1)
         # Cache the dataframe.
         dataframe.cache()
         # Allocate a worker.
         worker = self.allocate_worker()
-        # Set the maximum number of mini-batches.
-        worker.set_max_prefetch(self.max_mini_batches_prefetch)
+        # Configure the worker.
+        self.configure_worker(worker, dataframe.rdd.context)
         # Start recording training time.
         self.record_training_start()
         # Fetch the trained model.
         self.master_model = dataframe.rdd.mapPartitionsWithIndex(worker.train).collect()[0]
         # Stop recording of training time.
         self.record_training_end()
+        self.unpersist_model()
 
         return deserialize_keras_model(self.master_model)
 
@@ -192,7 +421,9 @@ class SingleTrainer(Trainer):
 class AveragingTrainer(Trainer):
     """A trainer which implements a data parallel technique using model averaging.
 
-    In this implementation, the model replicas are averages after every epoch.
+    In this implementation, the model replicas are averages after every epoch. When an
+    averaging period is specified, the model replicas are averaged every `averaging_period`
+    mini-batches instead (local SGD), within a single Spark job which trains all epochs.
     # Arguments
         keras_model: model. Keras model to train.
         worker_optimizer: string. String representing worker optimizer.
@@ -207,46 +438,79 @@ class AveragingTrainer(Trainer):
         batch_size: int. Mini-batch size.
         num_workers: int. Number of model replicas to train in parallel.
         loss_weights: optional list or dict specifying weights for different losses.
+        averaging_period: int. Number of mini-batches between two averaging rounds. None
+                          averages the model replicas after every epoch.
+        master_port: int. Port number of the averaging server, only used when an averaging
+                     period is specified.
     """
 
     def __init__(self, keras_model, worker_optimizer, loss, metrics=["accuracy"], features_col="features",
-                 label_col="label", num_epoch=1, batch_size=32, num_workers=2, loss_weights=None):
+                 label_col="label", num_epoch=1, batch_size=32, num_workers=2, loss_weights=None,
+                 averaging_period=None, master_port=5000):
         super(AveragingTrainer, self).__init__(keras_model, loss, worker_optimizer, metrics, loss_weights)
         self.features_column = features_col
         self.label_column = label_col
         self.num_epoch = num_epoch
         self.batch_size = batch_size
         self.num_workers = num_workers
-        self.parameter_buffer = np.asarray(keras_model.get_weights())
-        self.parameter_buffer.fill(0.0)
+        self.averaging_period = averaging_period
+        self.master_host = determine_host_address()
+        self.master_port = master_port
+        self.weight_shapes = [w.shape for w in keras_model.get_weights()]
 
-    def average_models(self, models):
-        """Averages the specified list of Keras models, and assigns the
-        averaged model as the master model.
+    def average_models(self, weights, num_models):
+        """Averages the summed weights of the model replicas, and assigns the averaged
+        weights to the master model.
 
         # Arguments:
-            models: list. A list of serialized Keras models.
+            weights: numpy array. Sum of the flattened weights of the model replicas.
+                     See: distkeras.utils.flatten_weights
+            num_models: int. Number of model replicas. When no replica was trained, e.g.,
+                        because all partitions are empty, the previous weights are kept.
         """
-        num_models = len(models)
-        # Get all weights of the models.
-        for i in range(0, num_models):
-            weights = np.asarray(deserialize_keras_model(models[i]).get_weights())
-            self.parameter_buffer += weights
-        # Average the parameters.
-        self.parameter_buffer /= num_models
-        temp_model = deserialize_keras_model(self.master_model)
-        temp_model.set_weights(self.parameter_buffer)
-        self.master_model = serialize_keras_model(temp_model)
-
+        # Check if any model replica was trained.
+        if num_models == 0:
+            print("No model replicas to average, keeping the previous weights.")
+            return
+        weights = unflatten_weights(weights / num_models, self.weight_shapes)
+        # Only the weights of the master model change, the architecture is kept as is.
+        self.master_model['weights'] = weights
 
     def allocate_worker(self):
         """Allocates the AveragingWorker for internal use."""
-        worker = SequentialWorker(model=self.master_model, features_col=self.features_column,
-                                  label_col=self.label_column, batch_size=self.batch_size, num_epoch = 1,
-                                  optimizer=self.worker_optimizer, loss=self.loss, loss_weights=self.loss_weights, metrics = self.metrics)
+        worker = AveragingWorker(model=self.master_model, features_col=self.features_column,
+                                 label_col=self.label_column, batch_size=self.batch_size, num_epoch = 1,
+                                 optimizer=self.worker_optimizer, loss=self.loss, loss_weights=self.loss_weights, metrics = self.metrics)
 
         return worker
 
+    def allocate_periodic_worker(self):
+        """Allocates the PeriodicAveragingWorker for internal use."""
+        worker = PeriodicAveragingWorker(self.master_model, self.worker_optimizer, self.loss, self.loss_weights,
+                                         self.metrics, self.features_column, self.label_column, self.batch_size,
+                                         self.num_epoch, self.master_host, self.master_port, self.averaging_period)
+
+        return worker
+
+    def average_periodically(self, dataframe):
+        """Trains all epochs in a single Spark job, in which the workers average their
+        model replicas every averaging period through an averaging server.
+
+        # Arguments
+            dataframe: dataframe. A Spark Dataframe containing the training data.
+        """
+        self.parameter_server = AveragingParameterServer(self.master_model, self.master_port)
+        # Start the communication service.
+        self.start_service()
+        # Allocate a worker.
+        worker = self.allocate_periodic_worker()
+        # Configure the worker.
+        self.configure_worker(worker, dataframe.rdd.context)
+        self.record_worker_results(dataframe.rdd.mapPartitionsWithIndex(worker.train).collect())
+        # Stop the communication service.
+        self.stop_service()
+        self.master_model = serialize_keras_model(self.parameter_server.get_model())
+
     def train(self, dataframe, shuffle=False):
         """Applies model averaging to the model replicas distributed over the specified
         number of Spark executors.
@@ -258,26 +522,28 @@ class AveragingTrainer(Trainer):
                      the network. It is recommended to shuffle the dataframe before
                      training and store it.
         """
-        # Repartition the data in order to fit the number of workers.
-        num_partitions = dataframe.rdd.getNumPartitions()
-        # Check if the dataframe needs to be shuffled.
+        # Check if the dataframe needs to be shuffled before training.
         if shuffle:
-            dataframe = shuffle(dataframe)
-        # Check if we need to repartition the dataframe.
-        if num_partitions >= self.num_workers:
-            dataframe = dataframe.coalesce(self.num_workers)
-        else:
-            dataframe = dataframe.repartition(self.num_workers)
+            dataframe = shuffle_dataframe(dataframe)
+        # Repartition in order to fit the number of workers.
+        dataframe = self.repartition(dataframe, self.num_workers)
         # Start the training procedure.
         self.record_training_start()
-        for i in range(0, self.num_epoch):
-            worker = self.allocate_worker()
-            # Set the maximum number of mini-batches.
-            worker.set_max_prefetch(self.max_mini_batches_prefetch)
-            models = dataframe.rdd.mapPartitionsWithIndex(worker.train).collect()
-            self.average_models(models)
+        # Check if the model replicas need to be averaged within the epochs.
+        if self.averaging_period is not None:
+            self.average_periodically(dataframe)
+        else:
+            for i in range(0, self.num_epoch):
+                worker = self.allocate_worker()
+                # Configure the worker.
+                self.configure_worker(worker, dataframe.rdd.context)
+                # Sum the flattened weights of the model replicas on the executors.
+                weights, num_models = dataframe.rdd.mapPartitionsWithIndex(worker.train).treeAggregate(
+                    (0.0, 0), lambda s, w: (s[0] + w, s[1] + 1), lambda a, b: (a[0] + b[0], a[1] + b[1]))
+                self.average_models(weights, num_models)
         # End the training procedure.
         self.record_training_end()
+        self.unpersist_model()
 
         return deserialize_keras_model(self.master_model)
 
@@ -298,17 +564,19 @@ class EnsembleTrainer(Trainer):
         batch_size: int. Mini-batch size.
         num_ensembles: int. Number of ensembles to train.
         loss_weights: optional list or dict specifying weights for different losses.
+        num_epoch: int. Number of epochs.
     # Note
         This will note employ a data-parallell approach for the ensembles.
     """
 
     def __init__(self, keras_model, worker_optimizer, loss, metrics=["accuracy"], features_col="features",
-                 label_col="label", batch_size=32, num_ensembles=2, loss_weights=None):
+                 label_col="label", batch_size=32, num_ensembles=2, loss_weights=None, num_epoch=1):
         super(EnsembleTrainer, self).__init__(keras_model, loss, worker_optimizer, metrics, loss_weights)
         self.features_column = features_col
         self.label_column = label_col
         self.batch_size = batch_size
         self.num_ensembles = num_ensembles
+        self.num_epoch = num_epoch
 
     def allocate_worker(self):
         """Allocates the EnsembleWorker for internal use."""
@@ -330,24 +598,20 @@ class EnsembleTrainer(Trainer):
         """
         # Allocate a worker.
         worker = self.allocate_worker()
-        # Set the maximum number of mini-batches.
-        worker.set_max_prefetch(self.max_mini_batches_prefetch)
-        # Repartition in order to fit the number of workers.
-        num_partitions = dataframe.rdd.getNumPartitions()
+        # Configure the worker.
+        self.configure_worker(worker, dataframe.rdd.context)
         # Check if the dataframe needs to be shuffled before training.
         if shuffle:
-            dataframe = shuffle(dataframe)
-        # Check if we need to repartition the dataframe.
-        if num_partitions >= self.num_workers:
-            dataframe = dataframe.coalesce(self.num_workers)
-        else:
-            dataframe = dataframe.repartition(self.num_workers)
+            dataframe = shuffle_dataframe(dataframe)
+        # Repartition in order to fit the number of workers.
+        dataframe = self.repartition(dataframe, self.num_ensembles)
         # Start the training procedure.
         self.record_training_start()
         # Train the models in parallel.
         models = dataframe.rdd.mapPartitionsWithIndex(worker.train).collect()
         # End the training procedure.
         self.record_training_end()
+        self.unpersist_model()
 
         return models
 
@@ -368,7 +632,8 @@ class DistributedTrainer(Trainer):
         num_epoch: int. Number of epochs.
         batch_size: int. Mini-batch size.
         num_workers: int. Number of distributed workers.
-        master_port: int. port number for the parameter server.
+        master_port: int. port number for the parameter server. None lets the OS assign a
+                     free port, e.g., to run several trainers at once.
         loss_weights: optional list or dict specifying weights for different losses.
     """
 
@@ -380,11 +645,25 @@ class DistributedTrainer(Trainer):
         self.features_column = features_col
         self.label_column = label_col
         self.num_epoch = num_epoch
-        self.parameter_server = None
-        self.parameter_server_thread = None
         self.master_host = determine_host_address()
         self.master_port = master_port
         self.learning_rate = 1.0
+        self.telemetry_callback = None
+        self.telemetry_interval = 10.0
+        self.metrics_path = None
+        self.metrics_interval = 10.0
+        self.tracing = False
+        self.trace = None
+        self.snapshot_interval = None
+        self.snapshots = []
+        self.snapshot_evaluator = None
+        self.barrier_execution = False
+        self.checkpoint_path = None
+        self.checkpoint_interval = 60.0
+        self.server_update_rule = None
+        self.staleness_bound = None
+        self.updated_hyperparameters = {}
+        self.prepared_dataframe = None
 
     def set_minibatch_size(self, size):
         """Sets the size of the mini-batch."""
@@ -418,6 +697,41 @@ class DistributedTrainer(Trainer):
         """
         self.learning_rate = learning_rate
 
+    def set_staleness_bound(self, staleness_bound):
+        """Sets the maximum number of center variable updates since the last pull of a
+        worker for its commit to be applied by the parameter server. More stale commits
+        are dropped, see the 'commits_dropped' metric. None applies all commits."""
+        self.staleness_bound = staleness_bound
+
+    def update_hyperparameters(self, **hyperparameters):
+        """Updates the hyperparameters of the running training procedure, without
+        restarting the parameter server or the workers. This method can be called from
+        another thread, e.g., from the telemetry callback (see set_telemetry_callback).
+
+        The workers apply the new learning rate and communication window on their next
+        pull, the parameter server applies the staleness bound to the next commit. The
+        learning rate of the delta based trainers (e.g., DOWNPOUR and ADAG) scales the
+        learning rate of the worker optimizer, a learning rate of 1 leaves the worker
+        optimizer as it was configured. The updated hyperparameters also apply to the
+        subsequent calls of train(), as every new parameter server pushes them to the
+        workers on their first pull.
+
+        # Arguments
+            learning_rate: float. Learning rate of the workers.
+            communication_window: int. Number of mini-batches between two commits.
+            staleness_bound: int. See set_staleness_bound.
+        """
+        for name in hyperparameters:
+            assert name in ['learning_rate', 'communication_window', 'staleness_bound'], \
+                "unknown hyperparameter: " + str(name)
+        # Keep the trainer configuration consistent with the running procedure.
+        for name, value in hyperparameters.items():
+            setattr(self, name, value)
+        self.updated_hyperparameters.update(hyperparameters)
+        parameter_server = self.parameter_server
+        if parameter_server is not None and parameter_server.running:
+            parameter_server.update_hyperparameters(hyperparameters)
+
     def set_num_epoch(self, num_epoch):
         """Sets the number of epochs."""
         self.num_epoch = num_epoch
@@ -461,31 +775,368 @@ class DistributedTrainer(Trainer):
 
     def num_updates(self):
         """Returns the number of model updates the parameter server performed."""
-        return self.parameter_server.num_updates()
+        return self.parameter_server.get_num_updates()
 
-    def service(self):
-        """Executes the parameter server service."""
-        self.parameter_server.start()
-        self.parameter_server.initialize()
-        self.parameter_server.run()
+    def set_metrics_export(self, path, interval=10.0):
+        """Periodically appends the metrics of the parameter server as JSON lines to a local
+        file on the driver while training.
 
-    def stop_service(self):
-        """Stops the parameter server service."""
-        self.parameter_server.stop()
-        self.parameter_server_thread.join()
-        self.parameter_server_thread = None
+        # Arguments
+            path: string. Path of the metrics file. None disables the export.
+            interval: float. Number of seconds between two exports.
+        """
+        self.metrics_path = path
+        self.metrics_interval = interval
 
-    def start_service(self):
-        """Starts the parameter server service."""
-        # Check if a parameter server thread is already allocated.
-        if not self.parameter_server_thread is None:
-            # Stop the parameter server service.
+    def get_parameter_server_metrics(self):
+        """Returns a snapshot of the metrics of the parameter server.
+
+        See distkeras.parameter_servers.SocketParameterServer.get_metrics.
+        """
+        if self.parameter_server is None:
+            return {}
+
+        return self.parameter_server.get_metrics()
+
+    def set_tracing(self, enabled):
+        """Records the data wait, compute, commit and pull phases of the workers, and the
+        commits, pulls and critical sections of the parameter server as trace events.
+
+        After train(), the trace events are merged into a single Chrome trace, see
+        get_trace() and write_trace().
+        """
+        self.tracing = enabled
+
+    def get_trace(self):
+        """Returns the Chrome trace of the last training procedure, if tracing is enabled."""
+        return self.trace
+
+    def write_trace(self, path):
+        """Writes the Chrome trace of the last training procedure to the specified path.
+
+        The trace can be inspected with chrome://tracing or https://ui.perfetto.dev.
+        """
+        write_trace(self.trace, path)
+
+    def collect_trace(self):
+        """Merges the trace events of the parameter server and the workers.
+
+        Only for internal use.
+        """
+        if self.tracing:
+            self.trace = merge_traces(self.parameter_server.get_traces())
+
+    def set_barrier_execution(self, enabled):
+        """Runs the workers in a Spark barrier stage (Spark 2.4 or higher), which schedules
+        all workers at once. The workers connect to the parameter server, prepare their
+        model, and wait for each other before they pull the initial center variable.
+
+        The cluster needs a free slot for every worker, and dynamic shards can not be
+        used in combination with barrier execution. The total time the workers spent
+        waiting is reported in the 'barrier_wait_time' statistic, see get_statistics().
+        """
+        self.barrier_execution = enabled
+
+    def set_warm_start(self, enabled):
+        """Keeps the parameter server, the repartitioned dataframe and the broadcast model
+        alive between successive calls of train(), e.g., by a Scheme. Every call is then
+        an incremental training round, which continues from the center variable of the
+        previous round. The workers of the next round reuse the compiled models on the
+        executors, if the model cache is enabled (see set_model_cache). The repartitioned
+        dataframe is only reused when train() is called without shuffle, a shuffled
+        dataframe is reshuffled in every round.
+
+        Change the hyperparameters between rounds with update_hyperparameters(), and call
+        shutdown() after the last round.
+        """
+        self.warm_start = enabled
+
+    def shutdown(self):
+        """Stops the parameter server, and releases the dataframe and the broadcast model
+        which were kept alive between the training rounds, see set_warm_start."""
+        if self.parameter_server_thread is not None:
             self.stop_service()
-        # Allocate a new parameter service thread.
-        self.parameter_server_thread = threading.Thread(target=self.service)
-        self.parameter_server_thread.start()
+        self.unpersist_model()
+        if self.prepared_dataframe is not None:
+            self.prepared_dataframe[2].unpersist()
+            self.prepared_dataframe = None
 
-    def train(self, dataframe, shuffle=False):
+    def prepare_parameter_server(self, resume_from=None):
+        """Allocates, configures and starts the parameter server. With warm start, the
+        running parameter server of the previous round is reused instead.
+
+        Only for internal use.
+        """
+        # Check if the parameter server of the previous round is still running.
+        warm = self.warm_start and self.parameter_server_thread is not None
+        if warm:
+            self.parameter_server.next_round()
+            self.parameter_server.set_staleness_bound(self.staleness_bound)
+        else:
+            # Check if a parameter server has been allocated.
+            if self.parameter_server is not None:
+                # Cleanup the old parameter server.
+                self.parameter_server.stop()
+                self.parameter_server = None
+            # Allocate the parameter server.
+            self.parameter_server = self.allocate_parameter_server()
+            self.configure_parameter_server(self.parameter_server)
+        # Check if the training procedure resumes from a checkpoint.
+        if resume_from is not None:
+            self.resume(resume_from)
+        # Start the communication service.
+        if not warm:
+            self.start_service()
+
+    def prepare_dataframe(self, dataframe, shuffle, num_partitions):
+        """Shuffles and repartitions the dataframe. With warm start, the prepared dataframe
+        is cached, and reused as long as train() is called with the same dataframe. A
+        dataframe which needs to be shuffled is reshuffled in every round instead.
+
+        Only for internal use.
+        """
+        if self.prepared_dataframe is not None:
+            source, source_partitions, prepared = self.prepared_dataframe
+            if self.warm_start and not shuffle and source is dataframe and source_partitions == num_partitions:
+                return prepared
+            prepared.unpersist()
+            self.prepared_dataframe = None
+        # Check if the dataframe needs to be shuffled before training.
+        if shuffle:
+            prepared = shuffle_dataframe(dataframe)
+        else:
+            prepared = dataframe
+        prepared = self.repartition(prepared, num_partitions)
+        if self.warm_start:
+            prepared.cache()
+            self.prepared_dataframe = (dataframe, num_partitions, prepared)
+
+        return prepared
+
+    def finish_round(self):
+        """Stops the parameter server, unless warm start is enabled, and returns the
+        trained model.
+
+        Only for internal use.
+        """
+        if not self.warm_start:
+            self.unpersist_model()
+            self.stop_service()
+
+            return self.parameter_server.get_model()
+        # The parameter server keeps running, the model holds a copy of the center variable.
+        model = {'model': self.master_model['model'], 'weights': self.parameter_server.get_center_variable()}
+
+        return deserialize_keras_model(model)
+
+    def run_workers(self, dataframe, worker):
+        """Executes the worker on every partition of the dataframe, in a barrier stage if
+        barrier execution is enabled.
+
+        Only for internal use.
+
+        # Returns
+            The collected results of the workers.
+        """
+        if self.barrier_execution:
+            return dataframe.rdd.barrier().mapPartitions(worker.train_barrier).collect()
+
+        return dataframe.rdd.mapPartitionsWithIndex(worker.train).collect()
+
+    def configure_worker(self, worker, context):
+        """See distkeras.trainers.Trainer.configure_worker."""
+        super(DistributedTrainer, self).configure_worker(worker, context)
+        # Connect to the port of the running parameter server, which is assigned by the OS
+        # if the master port is None.
+        worker.set_master_port(self.parameter_server.master_port)
+        worker.set_tracing(self.tracing)
+        worker.set_barrier(self.barrier_execution)
+
+    def set_checkpointing(self, path, interval=60.0):
+        """Periodically writes a checkpoint of the center variable, the update counter of
+        the parameter server and the trainer configuration to the specified path on the
+        driver while training. The checkpoint is serialized without blocking the commits
+        of the workers, and atomically replaces the previous checkpoint.
+
+        Pass the path to the `resume_from` argument of train() to resume the training
+        procedure from the checkpoint.
+
+        # Arguments
+            path: string. Path of the checkpoint (local, or on a mounted distributed file
+                  system). None disables the checkpoints.
+            interval: float. Number of seconds between two checkpoints.
+        """
+        self.checkpoint_path = path
+        self.checkpoint_interval = interval
+
+    def set_server_update_rule(self, update_rule):
+        """Sets the rule which the parameter server applies to integrate the incoming
+        deltas into the center variable, e.g., server-side momentum or Adam. The state of
+        the rule is kept on the parameter server, and is part of its checkpoints.
+
+        Only supported by the trainers which commit deltas or residuals, such as DOWNPOUR
+        and ADAG.
+
+        # Arguments
+            update_rule: UpdateRule. See distkeras.update_rules. None adds the deltas to
+                         the center variable.
+        """
+        assert update_rule is None or self.supports_server_update_rule(), \
+            type(self).__name__ + " does not support server update rules"
+        self.server_update_rule = update_rule
+
+    def supports_server_update_rule(self):
+        """Returns True if the workers of the trainer commit deltas or residuals, which
+        a server update rule can be applied to."""
+        return False
+
+    def get_checkpoint_config(self):
+        """Returns the configuration of the trainer which is stored in a checkpoint."""
+        config = {}
+        config['trainer'] = self.__class__.__name__
+        config['num_workers'] = self.num_workers
+        config['batch_size'] = self.batch_size
+        config['num_epoch'] = self.num_epoch
+        config['learning_rate'] = self.learning_rate
+        config['communication_window'] = getattr(self, 'communication_window', None)
+
+        return config
+
+    def resume(self, resume_from):
+        """Restores the center variable and update counter of the parameter server from
+        the specified checkpoint.
+
+        Only for internal use.
+        """
+        checkpoint = load_checkpoint(resume_from)
+        self.parameter_server.restore_checkpoint(checkpoint)
+
+    def configure_parameter_server(self, parameter_server):
+        """Applies the trainer settings to the allocated parameter server.
+
+        Only for internal use.
+        """
+        parameter_server.set_metrics_export(self.metrics_path, self.metrics_interval)
+        parameter_server.set_tracing(self.tracing)
+        parameter_server.set_checkpointing(self.checkpoint_path, self.checkpoint_interval,
+                                           self.get_checkpoint_config())
+        # Every parameter server starts with a fresh state of the update rule.
+        assert self.server_update_rule is None or self.supports_server_update_rule(), \
+            type(self).__name__ + " does not support server update rules"
+        parameter_server.set_update_rule(copy.deepcopy(self.server_update_rule))
+        parameter_server.set_staleness_bound(self.staleness_bound)
+        # Push the hyperparameters which were updated in previous rounds to the new workers.
+        if len(self.updated_hyperparameters) > 0:
+            parameter_server.update_hyperparameters(dict(self.updated_hyperparameters))
+
+    def get_telemetry(self):
+        """Returns a snapshot of the telemetry which the workers reported to the parameter
+        server. This method can be polled while the training procedure is running.
+
+        See distkeras.parameter_servers.SocketParameterServer.get_telemetry.
+        """
+        if self.parameter_server is None:
+            return {}
+
+        return self.parameter_server.get_telemetry()
+
+    def set_telemetry_callback(self, callback, interval=10.0):
+        """Sets a function which is periodically called with the telemetry of the workers
+        while the training procedure is running.
+
+        # Arguments
+            callback: function. Function which accepts the telemetry dictionary (see
+                      get_telemetry). When the function returns True, the training
+                      procedure is stopped early.
+            interval: float. Number of seconds between two calls.
+        """
+        self.telemetry_callback = callback
+        self.telemetry_interval = interval
+
+    def stop_training(self):
+        """Requests the workers to stop the training procedure.
+
+        The workers stop on their next request to the parameter server, after which
+        train() returns the current center variable.
+        """
+        if self.parameter_server is not None:
+            self.parameter_server.request_stop()
+
+    def monitor(self, training_done):
+        """Periodically passes the telemetry of the workers to the telemetry callback,
+        until the training procedure is done.
+
+        # Arguments
+            training_done: threading.Event. Event which is set when the training is done.
+        """
+        while not training_done.wait(self.telemetry_interval):
+            if self.telemetry_callback(self.get_telemetry()):
+                self.stop_training()
+
+    def set_snapshot_interval(self, interval):
+        """Periodically records the center variable of the parameter server while training.
+
+        This allows for an evaluation of the model as a function of the wallclock time
+        afterwards, e.g., to compare the time to reach a certain validation loss.
+
+        # Arguments
+            interval: float. Number of seconds between two snapshots. None disables the
+                      snapshots.
+        """
+        self.snapshot_interval = interval
+
+    def get_snapshots(self):
+        """Returns the snapshots of the last training procedure as a list of tuples, which
+        hold the number of seconds since the start of the training, and the weights of the
+        center variable at that time."""
+        return self.snapshots
+
+    def record_snapshots(self, training_done):
+        """Periodically records a snapshot of the center variable, until the training
+        procedure is done.
+
+        # Arguments
+            training_done: threading.Event. Event which is set when the training is done.
+        """
+        while True:
+            center_variable = self.parameter_server.get_center_variable()
+            self.snapshots.append((time.time() - self.training_time_start, center_variable))
+            if training_done.wait(self.snapshot_interval):
+                break
+
+    def set_snapshot_evaluator(self, evaluator):
+        """Evaluates snapshots of the center variable on a validation set in the background
+        while training, which allows for a live loss curve and early stopping.
+
+        # Arguments
+            evaluator: SnapshotEvaluator. See distkeras.evaluators.SnapshotEvaluator. None
+                       disables the evaluation.
+        """
+        self.snapshot_evaluator = evaluator
+
+    def start_monitor(self):
+        """Starts the telemetry monitor if a telemetry callback is set, the recording of the
+        snapshots if a snapshot interval is set, and the snapshot evaluator if one is set.
+
+        # Returns
+            Event which needs to be set to stop the monitor.
+        """
+        training_done = threading.Event()
+        if self.telemetry_callback is not None:
+            thread = threading.Thread(target=self.monitor, args=(training_done,))
+            thread.daemon = True
+            thread.start()
+        self.snapshots = []
+        if self.snapshot_interval is not None:
+            thread = threading.Thread(target=self.record_snapshots, args=(training_done,))
+            thread.daemon = True
+            thread.start()
+        if self.snapshot_evaluator is not None:
+            self.snapshot_evaluator.start(self.parameter_server, self.stop_training, training_done)
+
+        return training_done
+
+    def train(self, dataframe, shuffle=False, resume_from=None):
         """Training procedure of a distributed optimization process.
 
         # Arguments
@@ -494,42 +1145,31 @@ class DistributedTrainer(Trainer):
                      Warning: this will tell Spark to shuffle all partitions over
                      the network. It is recommended to shuffle the dataframe before
                      training and store it.
+            resume_from: string. Path of a checkpoint (see set_checkpointing). The center
+                         variable and the update counter of the parameter server are
+                         restored from the checkpoint before the workers start.
         """
-        # Check if a parameter server has been allocated.
-        if self.parameter_server is not None:
-            # Cleanup the old parameter server.
-            self.parameter_server.stop()
-            self.parameter_server = None
-        # Allocate the parameter server.
-        self.parameter_server = self.allocate_parameter_server()
-        # Start the communication service.
-        self.start_service()
+        # Allocate and start the parameter server, or reuse the one of the previous round.
+        self.prepare_parameter_server(resume_from)
         # Allocate a worker.
         worker = self.allocate_worker()
-        # Set the maximum number of mini-batches.
-        worker.set_max_prefetch(self.max_mini_batches_prefetch)
-        # Repartition in order to fit the number of workers.
-        num_partitions = dataframe.rdd.getNumPartitions()
-        # Check if the dataframe needs to be shuffled before training.
-        if shuffle:
-            dataframe = shuffle(dataframe)
-        # Check if we need to repartition the dataframe.
-        if num_partitions >= self.num_workers:
-            dataframe = dataframe.coalesce(self.num_workers)
-        else:
-            dataframe = dataframe.repartition(self.num_workers)
+        # Configure the worker.
+        self.configure_worker(worker, dataframe.rdd.context)
+        # Shuffle and repartition in order to fit the number of workers.
+        dataframe = self.prepare_dataframe(dataframe, shuffle, self.num_workers)
         # Cache the dataframe.
         dataframe.cache()
         # Start the training procedure.
         self.record_training_start()
+        training_done = self.start_monitor()
         # Iterate through the epochs.
-        self.history = dataframe.rdd.mapPartitionsWithIndex(worker.train).collect()
+        self.record_worker_results(self.run_workers(dataframe, worker))
+        training_done.set()
         # End the training procedure.
         self.record_training_end()
-        # Stop the communication service.
-        self.stop_service()
+        self.collect_trace()
 
-        return self.parameter_server.get_model()
+        return self.finish_round()
 
 
 class AsynchronousDistributedTrainer(DistributedTrainer):
@@ -572,6 +1212,7 @@ class AsynchronousDistributedTrainer(DistributedTrainer):
                                                              label_col, num_epoch, master_port, loss_weights)
         # Initialize asynchronous methods variables.
         self.parallelism_factor = 1
+        self.num_shards = None
 
     def allocate_worker(self):
         """Allocates the worker implementation.
@@ -592,7 +1233,28 @@ class AsynchronousDistributedTrainer(DistributedTrainer):
         """Returns the parallelization factor."""
         return self.parallelism_factor
 
-    def train(self, dataframe, shuffle=False):
+    def set_dynamic_shards(self, num_shards):
+        """Cuts the dataframe in `num_shards` small shards instead of `parallelism_factor *
+        num_workers` partitions.
+
+        Spark hands the next shard to the first executor which has a free core, so fast
+        executors process more shards than stragglers. Before training on a shard, a worker
+        claims it at the parameter server, which refuses the claims of shards which are, or
+        were, already trained on (e.g., by speculative copies of a task). We recommend to
+        enable the model cache, so the workers of subsequent shards do not recompile the
+        model, and continue with the optimizer state of the previous shard.
+
+        # Arguments
+            num_shards: int. Number of shards. None disables the dynamic shards.
+        """
+        self.num_shards = num_shards
+
+    def configure_worker(self, worker, context):
+        """See distkeras.trainers.Trainer.configure_worker."""
+        super(AsynchronousDistributedTrainer, self).configure_worker(worker, context)
+        worker.set_dynamic_shards(self.num_shards is not None)
+
+    def train(self, dataframe, shuffle=False, resume_from=None):
         """Training procedure of an asynchronous distributed optimization process.
 
         # Arguments
@@ -601,42 +1263,36 @@ class AsynchronousDistributedTrainer(DistributedTrainer):
                      Warning: this will tell Spark to shuffle all partitions over
                      the network. It is recommended to shuffle the dataframe before
                      training and store it.
+            resume_from: string. Path of a checkpoint (see set_checkpointing). The center
+                         variable and the update counter of the parameter server are
+                         restored from the checkpoint before the workers start.
         """
-        # Check if a parameter server has been allocated.
-        if self.parameter_server is not None:
-            # Cleanup the old parameter server.
-            self.parameter_server.stop()
-            self.parameter_server = None
-        # Allocate the parameter server.
-        self.parameter_server = self.allocate_parameter_server()
-        # Start the communication service.
-        self.start_service()
+        assert not (self.barrier_execution and self.num_shards is not None), \
+            "Barrier execution can not be combined with dynamic shards"
+        # Allocate and start the parameter server, or reuse the one of the previous round.
+        self.prepare_parameter_server(resume_from)
         # Allocate a worker.
         worker = self.allocate_worker()
-        # Set the maximum number of mini-batches.
-        worker.set_max_prefetch(self.max_mini_batches_prefetch)
-        # Repartition in order to fit the number of workers.
-        num_partitions = dataframe.rdd.getNumPartitions()
-        # Check if the dataframe needs to be shuffled before training.
-        if shuffle:
-            dataframe = shuffle(dataframe)
-        # Indicate the parallelism (number of worker times parallelism factor).
-        parallelism = self.parallelism_factor * self.num_workers
-        # Check if we need to repartition the dataframe.
-        if num_partitions >= parallelism:
-            dataframe = dataframe.coalesce(parallelism)
+        # Configure the worker.
+        self.configure_worker(worker, dataframe.rdd.context)
+        # Indicate the parallelism (number of worker times parallelism factor, or number of shards).
+        if self.num_shards is not None:
+            parallelism = self.num_shards
         else:
-            dataframe = dataframe.repartition(parallelism)
+            parallelism = self.parallelism_factor * self.num_workers
+        # Shuffle and repartition in order to fit the number of workers.
+        dataframe = self.prepare_dataframe(dataframe, shuffle, parallelism)
         # Start the training procedure.
         self.record_training_start()
+        training_done = self.start_monitor()
         # Iterate through the epochs.
-        self.history = dataframe.rdd.mapPartitionsWithIndex(worker.train).collect()
+        self.record_worker_results(self.run_workers(dataframe, worker))
+        training_done.set()
         # End the training procedure.
         self.record_training_end()
-        # Stop the communication service.
-        self.stop_service()
+        self.collect_trace()
 
-        return self.parameter_server.get_model()
+        return self.finish_round()
 
 
 class AEASGD(AsynchronousDistributedTrainer):
@@ -732,6 +1388,10 @@ class DOWNPOUR(AsynchronousDistributedTrainer):
 
         return worker
 
+    def supports_server_update_rule(self):
+        """See DistributedTrainer.supports_server_update_rule."""
+        return True
+
 
 class EAMSGD(AsynchronousDistributedTrainer):
     """Asynchronous Elastic Averaging w/ Momentum SGD optimizer.
@@ -834,6 +1494,10 @@ class ADAG(AsynchronousDistributedTrainer):
 
         return parameter_server
 
+    def supports_server_update_rule(self):
+        """See DistributedTrainer.supports_server_update_rule."""
+        return True
+
 
 class DynSGD(AsynchronousDistributedTrainer):
     """Dynamic SGD, dynamically maintains learning rate for every worker
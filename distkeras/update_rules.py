@@ -0,0 +1,177 @@
+"""Server-side update rules.
+
+An update rule defines how a parameter server integrates the deltas (or residuals)
+which are committed by the workers into the center variable. Besides the plain
+addition, the parameter server can apply momentum, Nesterov momentum, AdaGrad or Adam
+over the incoming deltas, combined with a learning rate schedule.
+
+Update rules operate on flat vectors (see distkeras.utils.flatten_weights), and keep
+their state in flat buffers. The state is replaced instead of updated in place, which
+allows the parameter server to take consistent snapshots of it.
+"""
+
+## BEGIN Imports. ##############################################################
+
+import math
+
+import numpy as np
+
+## END Imports. ################################################################
+
+class StepDecay(object):
+    """Learning rate schedule which multiplies the learning rate with `factor` every
+    `num_updates` center variable updates.
+
+    Schedules are classes instead of closures, as they are pickled with the checkpoints
+    of the parameter server.
+    """
+
+    def __init__(self, learning_rate, factor=0.1, num_updates=10000):
+        self.learning_rate = learning_rate
+        self.factor = factor
+        self.num_updates = num_updates
+
+    def __call__(self, update):
+        return self.learning_rate * math.pow(self.factor, update // self.num_updates)
+
+
+class ExponentialDecay(object):
+    """Learning rate schedule which continuously decays the learning rate with
+    `decay_rate` every `num_updates` center variable updates."""
+
+    def __init__(self, learning_rate, decay_rate=0.96, num_updates=1000):
+        self.learning_rate = learning_rate
+        self.decay_rate = decay_rate
+        self.num_updates = num_updates
+
+    def __call__(self, update):
+        return self.learning_rate * math.pow(self.decay_rate, float(update) / self.num_updates)
+
+
+class UpdateRule(object):
+    """Abstract class of a server-side update rule.
+
+    # Arguments
+        learning_rate: float. Learning rate which scales the incoming deltas.
+        schedule: function. Function which maps the number of center variable updates
+                  to a learning rate, e.g., StepDecay. Overrides `learning_rate` when
+                  specified.
+    """
+
+    def __init__(self, learning_rate=1.0, schedule=None):
+        self.learning_rate = learning_rate
+        self.schedule = schedule
+        self.num_steps = 0
+
+    def get_learning_rate(self, num_updates):
+        """Returns the learning rate after the specified number of center variable updates."""
+        if self.schedule is not None:
+            return self.schedule(num_updates)
+
+        return self.learning_rate
+
+    def apply(self, center_variable, delta, num_updates):
+        """Integrates the delta into the center variable.
+
+        # Arguments
+            center_variable: numpy array. Flattened center variable.
+            delta: numpy array. Flattened delta committed by a worker.
+            num_updates: int. Number of center variable updates performed so far.
+
+        # Returns
+            The new flattened center variable.
+        """
+        self.num_steps += 1
+
+        return center_variable + self.get_learning_rate(num_updates) * self.step(delta)
+
+    def step(self, delta):
+        """Updates the state of the rule, and returns the direction of the update."""
+        raise NotImplementedError
+
+
+class SGD(UpdateRule):
+    """Adds the scaled delta to the center variable."""
+
+    def step(self, delta):
+        return delta
+
+
+class Momentum(UpdateRule):
+    """Accumulates the deltas in a velocity, which is added to the center variable.
+
+    # Arguments
+        learning_rate: float. Learning rate which scales the incoming deltas.
+        momentum: float. Decay of the velocity.
+        nesterov: boolean. Applies Nesterov momentum.
+        schedule: function. Learning rate schedule, see UpdateRule.
+    """
+
+    def __init__(self, learning_rate=1.0, momentum=0.9, nesterov=False, schedule=None):
+        super(Momentum, self).__init__(learning_rate, schedule)
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.velocity = 0.0
+
+    def step(self, delta):
+        self.velocity = self.momentum * self.velocity + delta
+        if self.nesterov:
+            return self.momentum * self.velocity + delta
+
+        return self.velocity
+
+
+class Nesterov(Momentum):
+    """Nesterov momentum, see Momentum."""
+
+    def __init__(self, learning_rate=1.0, momentum=0.9, schedule=None):
+        super(Nesterov, self).__init__(learning_rate, momentum, True, schedule)
+
+
+class AdaGrad(UpdateRule):
+    """Scales every parameter by the inverse square root of its accumulated squared deltas.
+
+    # Arguments
+        learning_rate: float. Learning rate which scales the incoming deltas.
+        epsilon: float. Fuzz factor.
+        schedule: function. Learning rate schedule, see UpdateRule.
+    """
+
+    def __init__(self, learning_rate=0.01, epsilon=1e-8, schedule=None):
+        super(AdaGrad, self).__init__(learning_rate, schedule)
+        self.epsilon = epsilon
+        self.accumulator = 0.0
+
+    def step(self, delta):
+        self.accumulator = self.accumulator + np.square(delta)
+
+        return delta / (np.sqrt(self.accumulator) + self.epsilon)
+
+
+class Adam(UpdateRule):
+    """Applies Adam over the incoming deltas.
+
+    # Arguments
+        learning_rate: float. Learning rate which scales the incoming deltas.
+        beta_1: float. Decay of the first moment estimate.
+        beta_2: float. Decay of the second moment estimate.
+        epsilon: float. Fuzz factor.
+        schedule: function. Learning rate schedule, see UpdateRule.
+    """
+
+    def __init__(self, learning_rate=0.001, beta_1=0.9, beta_2=0.999, epsilon=1e-8, schedule=None):
+        super(Adam, self).__init__(learning_rate, schedule)
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.epsilon = epsilon
+        self.m = 0.0
+        self.v = 0.0
+
+    def step(self, delta):
+        self.m = self.beta_1 * self.m + (1.0 - self.beta_1) * delta
+        self.v = self.beta_2 * self.v + (1.0 - self.beta_2) * np.square(delta)
+        # Correct the bias of the moment estimates.
+        m = self.m / (1.0 - math.pow(self.beta_1, self.num_steps))
+        v = self.v / (1.0 - math.pow(self.beta_2, self.num_steps))
+
+        return m / (np.sqrt(v) + self.epsilon)
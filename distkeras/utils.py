@@ -8,6 +8,7 @@ from keras.models import model_from_json
 
 from keras import backend as K
 
+from pyspark.accumulators import AccumulatorParam
 from pyspark.mllib.linalg import DenseVector
 from pyspark.sql import Row
 from pyspark.sql.functions import rand
@@ -77,6 +78,27 @@ def unpickle_object(string):
     return pickle.loads(string)
 
 
+def write_checkpoint(checkpoint, path):
+    """Atomically writes the checkpoint to the specified path.
+
+    The checkpoint is written to a temporary file, which replaces the file at the
+    specified path once it is complete.
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(checkpoint, f, -1)
+        f.flush()
+        os.fsync(f.fileno())
+    # Python 2 does not provide os.replace, but os.rename replaces atomically on POSIX.
+    getattr(os, 'replace', os.rename)(temporary_path, path)
+
+
+def load_checkpoint(path):
+    """Loads the checkpoint at the specified path, see write_checkpoint."""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
 def serialize_keras_model(model):
     """Serializes the specified Keras model into a dictionary."""
     dictionary = {}
@@ -86,36 +108,162 @@ def serialize_keras_model(model):
     return dictionary
 
 
-def history_executors_average(history):
-    """Returns the averaged training metrics for all the executors."""
-    max_iteration = max(history, key=lambda x: x['iteration'])['iteration']
-    max_executor = max(history, key=lambda x: x['worker_id'])['worker_id']
-    histories = []
-    averaged_history = []
-    # Fetch the histories of the individual executors.
-    for i in range(0, max_executor):
-        histories.append(history_executor(history, i))
-    # Construct the averaged history.
-    for i in range(0, max_iteration):
-        num_executors = 0
-        sum = np.zeros(2)
-        for j in range(0, max_executor):
-            if len(histories[j]) - 1 >= i:
-                num_executors += 1
-                sum += histories[j][i]['history']
-        # Average the history.
-        sum /= num_executors
-        averaged_history.append(sum)
-
-    return averaged_history
+class StatisticsAccumulatorParam(AccumulatorParam):
+    """Spark accumulator which sums dictionaries of numeric worker statistics key-wise."""
+
+    def zero(self, value):
+        return {}
+
+    def addInPlace(self, statistics, other):
+        for key, value in other.items():
+            statistics[key] = statistics.get(key, 0) + value
+
+        return statistics
+
+
+def history_dtype(num_metrics):
+    """Returns the numpy record type of a training history with the specified number
+    of training metrics (including the loss)."""
+    return np.dtype([('worker_id', np.int32), ('iteration', np.int64), ('timestamp', np.float64),
+                     ('history', np.float64, (num_metrics,)),
+                     ('wait_time', np.float64), ('compute_time', np.float64), ('serialize_time', np.float64),
+                     ('commit_time', np.float64), ('pull_time', np.float64),
+                     ('bytes_sent', np.int64), ('bytes_received', np.int64)])
+
+
+class TrainingHistory(object):
+    """Preallocated record array which holds the training history of a worker.
+
+    By default, every iteration is recorded. Optionally, only every n-th iteration is
+    recorded ('every'), or a uniform sample of n iterations is maintained ('reservoir').
+
+    # Arguments
+        num_metrics: int. Number of training metrics (including the loss).
+        sampling: string. Sampling method: None, 'every' or 'reservoir'.
+        sampling_size: int. Sampling interval for 'every', number of records for 'reservoir'.
+        capacity: int. Initial number of preallocated records.
+    """
+
+    def __init__(self, num_metrics, sampling=None, sampling_size=1, capacity=1024):
+        assert sampling in [None, 'every', 'reservoir'], "unknown sampling method: " + str(sampling)
+        self.sampling = sampling
+        self.sampling_size = sampling_size
+        if self.sampling == 'reservoir':
+            capacity = self.sampling_size
+        self.records = np.zeros(capacity, dtype=history_dtype(num_metrics))
+        self.num_records = 0
+        self.num_iterations = 0
+
+    def append(self, record):
+        """Offers the record of an iteration to the history.
+
+        # Arguments
+            record: tuple. Values of the fields, in the order of distkeras.utils.history_dtype.
+
+        # Returns
+            True if the record was stored.
+        """
+        self.num_iterations += 1
+        if self.sampling == 'every' and (self.num_iterations - 1) % self.sampling_size != 0:
+            return False
+        if self.sampling == 'reservoir' and self.num_records == self.sampling_size:
+            index = np.random.randint(0, self.num_iterations)
+            if index >= self.sampling_size:
+                return False
+            self.records[index] = record
+            return True
+        if self.num_records == len(self.records):
+            self.records = np.resize(self.records, 2 * len(self.records))
+        self.records[self.num_records] = record
+        self.num_records += 1
+
+        return True
+
+    def get_records(self):
+        """Returns the stored records, ordered by iteration."""
+        records = self.records[:self.num_records]
+
+        return records[np.argsort(records['iteration'], kind='mergesort')]
+
+
+def concatenate_histories(histories):
+    """Concatenates the record arrays of the worker histories into a single record array."""
+    if len(histories) == 0:
+        return np.zeros(0, dtype=history_dtype(0))
+
+    return np.concatenate(histories)
+
+
+def history_executors_average(history, field='history'):
+    """Returns the averaged training metrics for all the executors.
+
+    The i-th row holds the metrics of the i-th recorded iteration, averaged over all
+    executors which recorded at least i + 1 iterations.
+
+    # Arguments
+        history: record array. Training history of all executors.
+        field: string. History field to average, e.g., 'history' (the training
+               metrics), or one of the phase times such as 'compute_time'.
+    """
+    if len(history) == 0:
+        return np.zeros((0,) + history.dtype[field].shape)
+    history = history[np.lexsort((history['iteration'], history['worker_id']))]
+    worker_ids = history['worker_id']
+    # Position of every record in the history of its executor.
+    positions = np.arange(len(history)) - np.searchsorted(worker_ids, worker_ids)
+    num_executors = np.bincount(positions)
+    values = history[field].reshape(len(history), -1).astype(np.float64)
+    averaged_history = np.zeros((len(num_executors), values.shape[1]))
+    np.add.at(averaged_history, positions, values)
+    averaged_history /= num_executors[:, np.newaxis]
+
+    return averaged_history.reshape((len(num_executors),) + history.dtype[field].shape)
+
+
+# Phases of the training procedure of a worker, and the bytes exchanged with the parameter server.
+phase_names = ['wait_time', 'compute_time', 'serialize_time', 'commit_time', 'pull_time',
+               'bytes_sent', 'bytes_received']
+
+
+def history_phase_times(history):
+    """Returns the time spent in every phase of the training procedure, and the number
+    of bytes exchanged with the parameter server, summed over the history records.
+
+    The phases are 'wait_time' (waiting for prefetched data), 'compute_time' (training
+    on mini-batches), 'serialize_time', 'commit_time' and 'pull_time'. When the history
+    is sampled, only the phases of the stored records are counted, see sum_phase_times
+    for the exact totals.
+    """
+    phase_times = {}
+    for name in phase_names:
+        phase_times[name] = history[name].sum().item()
+
+    return phase_times
+
+
+def sum_phase_times(phase_totals, worker_id=None):
+    """Sums the phase totals which were reported by the workers.
+
+    # Arguments
+        phase_totals: list. Dictionaries with the 'worker_id' and the phase totals of a
+                      worker, see distkeras.workers.Worker.get_phase_totals.
+        worker_id: int. Only sums the totals of the specified worker.
+    """
+    phase_times = dict((name, 0) for name in phase_names)
+    for totals in phase_totals:
+        if worker_id is not None and totals['worker_id'] != worker_id:
+            continue
+        for name in phase_names:
+            phase_times[name] += totals[name]
+
+    return phase_times
 
 
 def history_executor(history, id):
     """Returns the history of a specific executor."""
-    executor_history = [h for h in history if h['worker_id'] == id]
-    executor_history.sort(key=lambda x: x['iteration'])
+    executor_history = history[history['worker_id'] == id]
 
-    return executor_history
+    return executor_history[np.argsort(executor_history['iteration'], kind='mergesort')]
 
 
 def deserialize_keras_model(dictionary):
@@ -128,6 +276,38 @@ def deserialize_keras_model(dictionary):
     return model
 
 
+def flatten_weights(weights):
+    """Concatenates the specified list of weight arrays into a single flat vector."""
+    return np.concatenate([np.ravel(w) for w in weights])
+
+
+def weights_array(weights):
+    """Converts the specified list of weight arrays into a one-dimensional object array,
+    which supports elementwise arithmetic over the layers.
+
+    np.asarray can not be used for this, as it fails (or builds a multi-dimensional
+    array) when the leading dimensions of the weight arrays agree, e.g., for the kernel
+    and the bias of a square dense layer.
+    """
+    array = np.empty(len(weights), dtype=object)
+    for i, w in enumerate(weights):
+        array[i] = w
+
+    return array
+
+
+def unflatten_weights(vector, shapes):
+    """Splits a flat vector (see flatten_weights) into weight arrays of the specified shapes."""
+    weights = []
+    offset = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        weights.append(vector[offset:offset + size].reshape(shape))
+        offset += size
+
+    return weights
+
+
 def uniform_weights(model, constraints=[-0.5, 0.5]):
     """Initializes the parameters of the specified Keras model with uniform
     weights between the specified ranges.
@@ -184,3 +364,40 @@ def precache(dataset, num_workers):
     dataset.count()
 
     return dataset
+
+
+def partition_counts(dataset):
+    """Returns the number of rows in every partition of the specified Spark Dataframe."""
+    return dataset.rdd.mapPartitions(lambda iterator: [sum(1 for row in iterator)]).collect()
+
+
+def balance_partitions(dataset, num_partitions, tolerance=0.1):
+    """Repartitions the specified dataset into partitions with an equal number of rows.
+
+    Every row is assigned a global index, after which consecutive ranges of indices
+    are assigned to the same partition, which preserves the order of the rows. If the
+    dataset already has the desired number of partitions, and their sizes are within
+    the tolerance of the mean, the dataset is returned as is, which preserves its
+    locality. Make sure the dataset is cached, as it is evaluated twice.
+
+    # Arguments
+        dataset: dataframe. A Spark Dataframe.
+        num_partitions: int. Desired number of partitions.
+        tolerance: float. Allowed relative deviation of a partition size from the mean.
+    """
+    counts = partition_counts(dataset)
+    num_rows = sum(counts)
+    mean = float(num_rows) / num_partitions
+    # Check if the dataset is already balanced.
+    if len(counts) == num_partitions and all(abs(c - mean) <= tolerance * mean for c in counts):
+        return dataset
+    # Compute the global index of the first row in every partition.
+    offsets = np.cumsum([0] + counts[:-1]).tolist()
+    def assign(index, iterator):
+        for i, row in enumerate(iterator, offsets[index]):
+            yield (i * num_partitions // num_rows, row)
+    rdd = dataset.rdd.mapPartitionsWithIndex(assign) \
+                     .partitionBy(num_partitions, lambda partition: partition) \
+                     .values()
+
+    return rdd.toDF(dataset.schema)
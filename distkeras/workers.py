@@ -7,24 +7,49 @@ algorithms.
 ## BEGIN Imports. ##############################################################
 
 from distkeras.networking import connect
+from distkeras.networking import deserialize_data
+from distkeras.networking import recv_buffer
 from distkeras.networking import recv_data
+from distkeras.networking import send_buffer
 from distkeras.networking import send_data
+from distkeras.networking import serialize_data
+
+from distkeras.tracing import NullSpan
+from distkeras.tracing import Tracer
 
 from distkeras.utils import deserialize_keras_model
+from distkeras.utils import flatten_weights
+from distkeras.utils import phase_names
 from distkeras.utils import serialize_keras_model
 from distkeras.utils import set_keras_base_directory
 from distkeras.utils import shuffle
+from distkeras.utils import TrainingHistory
+from distkeras.utils import unflatten_weights
 from distkeras.utils import uniform_weights
+from distkeras.utils import weights_array
 
 from keras.optimizers import Optimizer, serialize, deserialize
 import keras.backend as K
 
+from collections import OrderedDict
+
+from itertools import islice
 from itertools import tee
 
 from multiprocessing import Pool
 
+import hashlib
+
+import json
+
 import numpy as np
 
+import os
+
+import shutil
+
+import tempfile
+
 import threading
 
 import tensorflow as tf
@@ -38,14 +63,244 @@ if use_python3:
 else:
     import Queue as queue
 
+# Barrier execution is only available from Spark 2.4 on.
+try:
+    from pyspark import BarrierTaskContext
+except ImportError:
+    BarrierTaskContext = None
+
 import random
 
 import socket
 
 import time
 
+import uuid
+
+import weakref
+
 ## END Imports. ################################################################
 
+# Compiled Keras models, shared by all workers which are executed by the same Python process.
+# Spark reuses its Python workers for subsequent tasks, which allows us to skip the construction
+# and compilation of the model when a task trains the same architecture with the same settings.
+compiled_models = OrderedDict()
+max_compiled_models = 4
+
+
+class EpochReplayCache(object):
+    """Spills the decoded columns of a partition to local memory-mapped files.
+
+    During the first epoch the worker appends every decoded mini-batch to the cache.
+    Subsequent epochs are replayed from the memory-mapped column files, which means
+    that the rows of the partition do not have to be kept alive in memory.
+
+    # Arguments
+        num_columns: int. Number of decoded columns (inputs and outputs).
+        directory: string. Local directory in which the column files are stored.
+                   Defaults to the temporary directory of the system.
+    """
+
+    def __init__(self, num_columns, directory=None):
+        self.num_columns = num_columns
+        self.directory = tempfile.mkdtemp(prefix="distkeras-", dir=directory)
+        self.files = [None] * num_columns
+        self.dtypes = [None] * num_columns
+        self.shapes = [None] * num_columns
+        self.columns = None
+        self.num_rows = 0
+
+    def get_num_rows(self):
+        """Returns the number of rows stored in the cache."""
+        return self.num_rows
+
+    def append(self, columns):
+        """Appends the decoded columns of a set of rows to the cache.
+
+        The dtype and the row shape of a column are fixed by the first set of rows. All
+        columns are validated before anything is written, so the cache remains
+        consistent when a set of rows is rejected.
+
+        # Arguments
+            columns: list. A numpy array per column, with the rows on the first axis.
+
+        # Raises
+            ValueError: if a column can not be stored without loss, e.g., an object
+                        (ragged) column, a different row shape, or a dtype which can not
+                        be safely cast to the dtype of the first set of rows.
+        """
+        columns = [np.ascontiguousarray(column) for column in columns]
+        for i, column in enumerate(columns):
+            if column.dtype == object:
+                raise ValueError("column " + str(i) + " can not be spilled to disk")
+            if self.files[i] is None:
+                continue
+            if column.shape[1:] != self.shapes[i]:
+                raise ValueError("column " + str(i) + " changed its shape from " + str(self.shapes[i]) +
+                                 " to " + str(column.shape[1:]))
+            if not np.can_cast(column.dtype, self.dtypes[i], casting='safe'):
+                raise ValueError("column " + str(i) + " can not be cast from " + str(column.dtype) +
+                                 " to " + str(self.dtypes[i]))
+        for i, column in enumerate(columns):
+            if self.files[i] is None:
+                self.dtypes[i] = column.dtype
+                self.shapes[i] = column.shape[1:]
+                self.files[i] = open(os.path.join(self.directory, "column_" + str(i) + ".bin"), "wb")
+            self.files[i].write(column.astype(self.dtypes[i], copy=False).tobytes())
+        self.num_rows += len(columns[0])
+
+    def finalize(self):
+        """Closes the column files and maps them into memory for replay."""
+        self.columns = []
+        for i in range(0, self.num_columns):
+            if self.files[i] is None:
+                continue
+            self.files[i].close()
+            self.columns.append(np.memmap(self.files[i].name, dtype=self.dtypes[i], mode="r",
+                                          shape=(self.num_rows,) + self.shapes[i]))
+
+    def batches(self, batch_size, shuffle=False):
+        """Iterates over the cached rows in mini-batches of the specified size.
+
+        Incomplete trailing mini-batches are dropped, similar to the first epoch.
+
+        # Arguments
+            batch_size: int. Number of rows in a mini-batch.
+            shuffle: boolean. Shuffles the rows of the partition before iterating.
+        """
+        if shuffle:
+            indices = np.random.permutation(self.num_rows)
+        for start in range(0, self.num_rows - batch_size + 1, batch_size):
+            if shuffle:
+                index = np.sort(indices[start:start + batch_size])
+            else:
+                index = slice(start, start + batch_size)
+            # Copy the rows, the memory-mapped files are removed once the cache is closed.
+            yield [np.array(column[index]) for column in self.columns]
+
+    def close(self):
+        """Releases the memory-mapped files and removes them from disk."""
+        for f in self.files:
+            if f is not None:
+                f.close()
+        self.columns = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ElasticAveragingUpdates(object):
+    """Elastic averaging and momentum updates of the EASGD based workers, implemented as
+    backend operations on the variables of the model.
+
+    The weights of the model only leave the backend at the communication boundaries, when
+    the elastic difference is committed to the parameter server. When momentum is used,
+    the variables of the model hold the look-ahead weights (W + momentum * r), which are
+    used to compute the gradient, while the weights W and the momentum buffer r are kept
+    in separate backend variables.
+
+    # Arguments
+        model: Keras model. The compiled model of the worker.
+        alpha: float. Elastic moving rate (learning rate times rho).
+        learning_rate: float. Learning rate of the momentum update.
+        momentum: float. Momentum term. A momentum of 0 disables the momentum updates.
+    """
+
+    def __init__(self, model, alpha, learning_rate=0.01, momentum=0.0):
+        self.variables = model.weights
+        self.alpha = K.variable(alpha)
+        self.learning_rate = K.variable(learning_rate)
+        self.momentum = momentum
+        self.center_variable = [K.placeholder(shape=K.int_shape(v), dtype=K.dtype(v)) for v in self.variables]
+        if self.momentum > 0:
+            self.weights = [K.zeros(K.int_shape(v), dtype=K.dtype(v)) for v in self.variables]
+            self.velocities = [K.zeros(K.int_shape(v), dtype=K.dtype(v)) for v in self.variables]
+        else:
+            self.weights = self.variables
+            self.velocities = None
+        self.elastic_function = self.build_elastic_function()
+        self.momentum_function = None
+        self.initialize_function = None
+        if self.velocities is not None:
+            self.momentum_function = self.build_momentum_function()
+            self.initialize_function = K.function([], [], updates=
+                [K.update(w, v) for w, v in zip(self.weights, self.variables)] +
+                [K.update(r, K.zeros_like(r)) for r in self.velocities])
+
+    def build_elastic_function(self):
+        """Builds the backend function which moves the weights towards the center variable,
+        and returns the elastic difference."""
+        updates = []
+        elastic_differences = []
+        for i, w in enumerate(self.weights):
+            e = self.alpha * (w - self.center_variable[i])
+            new_w = w - e
+            elastic_differences.append(e)
+            updates.append(K.update(w, new_w))
+            if self.velocities is not None:
+                updates.append(K.update(self.variables[i], new_w + self.momentum * self.velocities[i]))
+
+        return K.function(self.center_variable, elastic_differences, updates=updates)
+
+    def build_momentum_function(self):
+        """Builds the backend function which applies the momentum update, given that the
+        worker optimizer updated the look-ahead weights held by the model."""
+        updates = []
+        for v, w, r in zip(self.variables, self.weights, self.velocities):
+            r_t = self.momentum * r
+            gradient = v - (w + r_t)
+            new_r = r_t - self.learning_rate * gradient
+            new_w = w - new_r
+            updates.append(K.update(r, new_r))
+            updates.append(K.update(w, new_w))
+            updates.append(K.update(v, new_w + self.momentum * new_r))
+
+        return K.function([], [], updates=updates)
+
+    def set_learning_rate(self, learning_rate, alpha):
+        """Sets the learning rate and the elastic moving rate."""
+        K.set_value(self.learning_rate, learning_rate)
+        K.set_value(self.alpha, alpha)
+
+    def initialize(self):
+        """Initializes the weights with the current weights of the model, and resets the
+        momentum buffer. Call this method after the weights of the model are set."""
+        if self.initialize_function is not None:
+            self.initialize_function([])
+
+    def elastic_update(self, center_variable):
+        """Applies the elastic update with respect to the specified center variable.
+
+        # Returns
+            The elastic difference which needs to be committed to the parameter server.
+        """
+        return weights_array(self.elastic_function(list(center_variable)))
+
+    def momentum_update(self):
+        """Applies the momentum update after a training step of the worker optimizer."""
+        self.momentum_function([])
+
+
+# Elastic averaging updates of the compiled models, see elastic_averaging_updates.
+elastic_updates_cache = weakref.WeakKeyDictionary()
+
+
+def elastic_averaging_updates(model, alpha, learning_rate=0.01, momentum=0.0):
+    """Returns the ElasticAveragingUpdates of the specified compiled model.
+
+    The backend operations are built once for every compiled model and momentum term,
+    as the model cache reuses compiled models across tasks and training rounds. Only the
+    learning rate and the elastic moving rate of cached operations are updated.
+    """
+    model_updates = elastic_updates_cache.setdefault(model, {})
+    updates = model_updates.get(momentum)
+    if updates is None:
+        updates = ElasticAveragingUpdates(model, alpha, learning_rate, momentum)
+        model_updates[momentum] = updates
+    else:
+        updates.set_learning_rate(learning_rate, alpha)
+
+    return updates
+
+
 class Worker(object):
     """Abstract class of a worker.
 
@@ -70,16 +325,134 @@ class Worker(object):
         self.prefetching_thread = None
         self.mini_batches = None
         self.is_prefetching = True
+        self.prefetching_stopped = False
         self.worker_id = -1
         self.learning_rate = learning_rate
         self.num_inputs = len(self.features_column)
         self.num_outputs = len(self.label_column)
         self.current_epoch = 0
+        self.epoch_cache = True
+        self.epoch_cache_directory = None
+        self.epoch_shuffle = False
+        self.model_cache = True
+        self.statistics = None
+        self.steps_per_call = 1
+        self.training_history = None
+        self.history_sampling = None
+        self.history_sampling_size = 1
+        self.iteration = 1
+        self.wait_time = 0.0
+        self.compute_time = 0.0
+        self.serialize_time = 0.0
+        self.commit_time = 0.0
+        self.pull_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.recorded_phase_times = self.get_phase_times()
+        self.reset_telemetry()
+        self.tracing = False
+        self.tracer = None
+        self.model_broadcast = None
+        self.optimizer_state_key = None
 
     def set_max_prefetch(self, max_mini_batches):
         """Sets the maximum number of mini-batches that can be prefetched."""
         self.max_mini_batches = max_mini_batches
 
+    def set_epoch_cache(self, enabled, directory=None, shuffle=False):
+        """Configures the replay of the partition over multiple epochs.
+
+        # Arguments
+            enabled: boolean. Spills the decoded partition to local disk during the first
+                     epoch, and replays the subsequent epochs from disk.
+            directory: string. Local directory which will hold the spilled partition.
+            shuffle: boolean. Shuffles the rows of the partition in every replayed epoch.
+        """
+        self.epoch_cache = enabled
+        self.epoch_cache_directory = directory
+        self.epoch_shuffle = shuffle
+
+    def set_steps_per_call(self, steps_per_call):
+        """Sets the number of mini-batches which are trained on within a single call to Keras.
+
+        Workers stack `steps_per_call` prefetched mini-batches into a single block, and
+        fit the model on that block. Communication windows are evaluated at block
+        granularity: the worker communicates after the block in which a window ends, so
+        the number of mini-batches between two commits varies around the window.
+        """
+        self.steps_per_call = steps_per_call
+
+    def set_tracing(self, enabled):
+        """Records the phases of the training procedure as trace events.
+
+        See distkeras.tracing.
+        """
+        self.tracing = enabled
+
+    def trace(self, name):
+        """Returns a context manager which records the enclosed code as a trace event,
+        if tracing is enabled."""
+        if self.tracer is None:
+            return NullSpan()
+
+        return self.tracer.span(name, 'worker')
+
+    def start_tracing(self):
+        """Allocates the tracer of the worker, if tracing is enabled.
+
+        Workers are identified by process id `worker_id + 1` in the trace, the parameter
+        server by process id 0.
+        """
+        if self.tracing:
+            self.tracer = Tracer(self.worker_id + 1, "Worker " + str(self.worker_id))
+
+    def set_history_sampling(self, sampling, sampling_size=1):
+        """Sets the sampling method of the training history.
+
+        See distkeras.utils.TrainingHistory.
+        """
+        self.history_sampling = sampling
+        self.history_sampling_size = sampling_size
+
+    def set_model_broadcast(self, broadcast):
+        """Ships the serialized model through the specified Spark broadcast variable instead
+        of pickling it into every task. The model is resolved when the worker prepares it.
+
+        # Arguments
+            broadcast: Broadcast. Broadcast variable which holds the serialized model.
+        """
+        self.model_broadcast = broadcast
+        self.model = None
+
+    def set_model_cache(self, enabled):
+        """Allows the worker to reuse a compiled model of a previous task which was
+        executed by the same Python process."""
+        self.model_cache = enabled
+
+    def set_optimizer_state_key(self, key):
+        """Lets a task continue with the optimizer state of the previous task in the same
+        Python process, if both tasks share the specified key. Otherwise the optimizer
+        state of a cached model is reset, see prepare_cached_model.
+
+        # Arguments
+            key: string. Key which identifies the training round. None always resets the
+                 optimizer state.
+        """
+        self.optimizer_state_key = key
+
+    def set_statistics(self, statistics):
+        """Sets the Spark accumulator which collects the statistics of the workers.
+
+        # Arguments
+            statistics: accumulator. See distkeras.utils.StatisticsAccumulatorParam.
+        """
+        self.statistics = statistics
+
+    def record_statistic(self, name, value):
+        """Adds the value to the specified worker statistic, if statistics are collected."""
+        if self.statistics is not None:
+            self.statistics.add({name: value})
+
     def set_learning_rate(self, learning_rate):
         """Sets the learning rate of the worker."""
         self.learning_rate = learning_rate
@@ -100,10 +473,58 @@ class Worker(object):
         """Returns the worker id."""
         return self.worker_id
 
+    def model_cache_key(self):
+        """Returns the key which identifies the compiled model in the model cache.
+
+        The key is composed of the architecture of the model and the settings which
+        are used to compile the model.
+        """
+        configuration = [self.model['model'], json.dumps(self.optimizer, sort_keys=True),
+                         repr(self.loss), repr(self.loss_weights), repr(self.metrics)]
+
+        return hashlib.sha1("\n".join(configuration).encode()).hexdigest()
+
+    def prepare_cached_model(self, key):
+        """Prepares the model using a compiled model of the model cache.
+
+        # Returns
+            True if the model cache contained a compiled model with the specified key.
+        """
+        entry = compiled_models.pop(key, None)
+        if entry is None:
+            return False
+        # Mark the entry as the most recently used one.
+        compiled_models[key] = entry
+        if entry['session'] is not None:
+            K.set_session(entry['session'])
+        model = entry['model']
+        model.set_weights(self.model['weights'])
+        # Check if the optimizer state belongs to a previous task of the same training round.
+        if self.optimizer_state_key is None or entry.get('optimizer_state_key') != self.optimizer_state_key:
+            # Reset the state of the optimizer, as if the model was just compiled.
+            K.batch_set_value([(w, np.zeros(K.int_shape(w), dtype=K.dtype(w))) for w in model.optimizer.weights])
+            entry['optimizer_state_key'] = self.optimizer_state_key
+        # Reset the learning rate, which might have been updated while training.
+        K.set_value(model.optimizer.lr, entry['learning_rate'])
+        self.model = model
+        self.optimizer = model.optimizer
+        self.record_statistic('model_cache_hits', 1)
+        self.record_statistic('compile_time_saved', entry['compile_time'])
+
+        return True
+
     def prepare_model(self):
         """Prepares the model for training."""
         # Set the Keras directory.
         set_keras_base_directory()
+        # Resolve the serialized model, if it was shipped as a broadcast variable.
+        if self.model_broadcast is not None:
+            self.model = self.model_broadcast.value
+        key = self.model_cache_key() if self.model_cache else None
+        if key is not None and self.prepare_cached_model(key):
+            return
+        time_start = time.time()
+        sess = None
         if K.backend() == 'tensorflow':
             # set GPU option allow_growth to False for GPU-enabled tensorflow
             config = tf.ConfigProto()
@@ -117,10 +538,157 @@ class Worker(object):
         # Compile the model with the specified loss and optimizer.
         self.model.compile(loss=self.loss, loss_weights = self.loss_weights, 
             optimizer=self.optimizer, metrics=self.metrics)
+        compile_time = time.time() - time_start
+        self.record_statistic('model_cache_misses', 1)
+        self.record_statistic('compile_time', compile_time)
+        # Store the compiled model in the model cache.
+        if key is not None:
+            compiled_models[key] = {'model': self.model, 'session': sess, 'compile_time': compile_time,
+                                    'learning_rate': K.get_value(self.model.optimizer.lr),
+                                    'optimizer_state_key': self.optimizer_state_key}
+            while len(compiled_models) > max_compiled_models:
+                compiled_models.popitem(last=False)
+
+    def get_phase_times(self):
+        """Returns the total time spent in the different phases of the training procedure,
+        and the total number of bytes exchanged with the parameter server.
+
+        The order of the phases is: wait, compute, serialize, commit and pull time, bytes
+        sent and bytes received.
+        """
+        return [self.wait_time, self.compute_time, self.serialize_time, self.commit_time,
+                self.pull_time, self.bytes_sent, self.bytes_received]
+
+    def reset_telemetry(self):
+        """Starts a new telemetry summary."""
+        self.telemetry_start = time.time()
+        self.telemetry_samples = 0
+        self.telemetry_iterations = 0
+        self.telemetry_loss = 0.0
+        self.telemetry_phase_times = self.get_phase_times()
+
+    def get_telemetry(self):
+        """Returns a summary of the training progress since the previous summary.
+
+        The summary holds the current iteration, the number of samples and mini-batches
+        trained on, the mean training loss over these mini-batches, the duration of the
+        summary period, and the time spent in every phase of the training procedure.
+        """
+        summary = {}
+        summary['iteration'] = self.iteration
+        summary['samples'] = self.telemetry_samples
+        summary['iterations'] = self.telemetry_iterations
+        summary['loss'] = self.telemetry_loss / max(self.telemetry_iterations, 1)
+        summary['duration'] = time.time() - self.telemetry_start
+        names = ['wait_time', 'compute_time', 'serialize_time', 'commit_time', 'pull_time',
+                 'bytes_sent', 'bytes_received']
+        for name, value, previous in zip(names, self.get_phase_times(), self.telemetry_phase_times):
+            summary[name] = value - previous
+        self.reset_telemetry()
+
+        return summary
 
     def get_next_minibatch(self):
-        """Returns the next mini-batch."""
-        return self.mini_batches.get(timeout=10)
+        """Returns the next mini-batch.
+
+        Raises queue.Empty once the prefetching thread reached the end of the partition.
+        """
+        time_start = time.time()
+        try:
+            with self.trace('data wait'):
+                minibatch = self.mini_batches.get()
+        finally:
+            self.wait_time += time.time() - time_start
+        # Check if the end of the partition is reached.
+        if minibatch is None:
+            # Keep the sentinel in the queue for subsequent calls.
+            self.mini_batches.put(None)
+            raise queue.Empty
+
+        return minibatch
+
+    def get_next_minibatch_block(self):
+        """Returns a block of at most `steps_per_call` mini-batches, stacked along
+        the sample axis.
+
+        # Returns
+            The features and labels of the block, and the number of mini-batches in the block.
+        """
+        X, Y = self.get_next_minibatch()
+        if self.steps_per_call == 1:
+            return X, Y, 1
+        minibatches = [[X, Y]]
+        try:
+            while len(minibatches) < self.steps_per_call:
+                minibatches.append(self.get_next_minibatch())
+        except queue.Empty:
+            # The partition is exhausted, train on an incomplete block.
+            pass
+        X = [np.concatenate([b[0][i] for b in minibatches]) for i in range(0, self.num_inputs)]
+        Y = [np.concatenate([b[1][i] for b in minibatches]) for i in range(0, self.num_outputs)]
+
+        return X, Y, len(minibatches)
+
+    def train_on_block(self, X, Y, num_steps):
+        """Applies `num_steps` optimizer steps on the specified block of mini-batches.
+
+        # Returns
+            The training loss and metrics, averaged over the mini-batches of the block.
+        """
+        time_start = time.time()
+        with self.trace('compute'):
+            if num_steps == 1:
+                h = self.model.train_on_batch(X, Y)
+            else:
+                history = self.model.fit(X, Y, batch_size=self.batch_size, epochs=1, verbose=0, shuffle=False)
+                h = [history.history[name][0] for name in self.model.metrics_names]
+                h = h[0] if len(h) == 1 else h
+        self.compute_time += time.time() - time_start
+        self.telemetry_samples += len(X[0])
+
+        return h
+
+    def add_history(self, h, num_steps=1):
+        """Appends the specified history data.
+
+        Besides the training metrics, a history record holds the time (in seconds) the
+        worker spent waiting for data, training, (de)serializing, committing and pulling,
+        and the number of bytes sent to and received from the parameter server, since
+        the previous stored record.
+
+        # Arguments
+            h: training loss and metrics, averaged over the mini-batches of the block.
+            num_steps: int. Number of mini-batches in the block.
+        """
+        if self.training_history is None:
+            self.training_history = TrainingHistory(np.size(h), self.history_sampling,
+                                                    self.history_sampling_size)
+        phase_times = self.get_phase_times()
+        phase_deltas = [value - previous for value, previous in zip(phase_times, self.recorded_phase_times)]
+        record = tuple([self.worker_id, self.iteration, time.time(), h] + phase_deltas)
+        if self.training_history.append(record):
+            self.recorded_phase_times = phase_times
+        self.telemetry_iterations += num_steps
+        self.telemetry_loss += num_steps * float(np.ravel(h)[0])
+
+    def get_phase_totals(self):
+        """Returns the phase totals of the worker as a dictionary, which also holds the
+        'worker_id'. The totals are kept outside the history, as a sampled history does
+        not hold every iteration."""
+        totals = dict(zip(phase_names, self.get_phase_times()))
+        totals['worker_id'] = self.worker_id
+
+        return totals
+
+    def get_history(self):
+        """Returns the list which is returned to the driver, which holds a tuple of the
+        record array of the history (None if nothing was recorded), and the phase totals
+        of the worker."""
+        records = None
+        if self.training_history is not None:
+            records = self.training_history.get_records()
+
+        return [(records, self.get_phase_totals())]
 
     def start_prefetching_thread(self, iterator):
         """Starts the data prefetching thread."""
@@ -129,27 +697,121 @@ class Worker(object):
         self.prefetching_thread = threading.Thread(target=self.prefetching)
         self.prefetching_thread.start()
 
+    def decode_rows(self, rows):
+        """Converts a list of rows into the feature and label arrays of a mini-batch."""
+        X = [np.asarray([x[column] for x in rows]) for column in self.features_column]
+        Y = [np.asarray([x[column] for x in rows]) for column in self.label_column]
+
+        return [X, Y]
+
+    def enqueue_minibatch(self, minibatch):
+        """Places the mini-batch in the prefetch queue once there is room for it.
+
+        # Returns
+            False if prefetching was stopped before the mini-batch could be queued.
+        """
+        while self.is_prefetching:
+            if self.mini_batches.qsize() < self.max_mini_batches:
+                self.mini_batches.put(minibatch)
+                return True
+
+        return False
+
     def prefetching(self):
+        """Prefetches the mini-batches of all epochs, followed by a None sentinel which
+        marks the end of the partition."""
+        try:
+            if self.epoch_cache and self.num_epoch > 1:
+                self.prefetching_replay()
+            else:
+                self.prefetching_epochs()
+        finally:
+            self.mini_batches.put(None)
+
+    def prefetching_epochs(self):
+        """Prefetches the mini-batches of all epochs from the partition iterator."""
         partition_iterators_all_epochs = tee(self.iterator, self.num_epoch)
         for iter_one_epoch in partition_iterators_all_epochs:
+            # Check if the training procedure stopped prefetching.
+            if self.prefetching_stopped:
+                break
             self.current_epoch += 1
             self.is_prefetching = True
             try:
-                while self.is_prefetching:
+                while self.is_prefetching and not self.prefetching_stopped:
                     if self.mini_batches.qsize() < self.max_mini_batches:
                         batch = [next(iter_one_epoch) for _ in range(self.batch_size)]
-                        batch_iterator_copies = tee(batch, self.num_inputs + self.num_outputs)
-                        feature_iterators = batch_iterator_copies[:self.num_inputs]
-                        label_iterators = batch_iterator_copies[self.num_inputs:]
-                        X = [np.asarray([x[self.features_column[i]] for x in iterator]) 
-                            for i, iterator in enumerate(feature_iterators)]
-                        Y = [np.asarray([x[self.label_column[i]] for x in iterator])
-                            for i, iterator in enumerate(label_iterators)]
-                        self.mini_batches.put([X, Y])
+                        self.mini_batches.put(self.decode_rows(batch))
             except Exception as e:
                 print(e)
                 self.is_prefetching = False
 
+    def prefetching_replay(self):
+        """Prefetches the first epoch from the partition iterator, while spilling the
+        decoded mini-batches to an EpochReplayCache. The other epochs are replayed from
+        the cache.
+
+        Once the cache rejects a mini-batch (see EpochReplayCache.append), the remaining
+        mini-batches of the partition are kept in memory instead, and are replayed after
+        the cached ones.
+        """
+        cache = EpochReplayCache(self.num_inputs + self.num_outputs, self.epoch_cache_directory)
+        # Mini-batches which could not be spilled to the cache.
+        minibatches = None
+        try:
+            self.current_epoch += 1
+            while self.is_prefetching:
+                rows = list(islice(self.iterator, self.batch_size))
+                if len(rows) == 0:
+                    break
+                X, Y = self.decode_rows(rows)
+                # Incomplete mini-batches are not trained on.
+                if len(rows) < self.batch_size:
+                    if minibatches is None:
+                        self.spill_minibatch(cache, X, Y)
+                    break
+                if minibatches is None and not self.spill_minibatch(cache, X, Y):
+                    minibatches = []
+                if minibatches is not None:
+                    minibatches.append([X, Y])
+                self.enqueue_minibatch([X, Y])
+            cache.finalize()
+            while self.is_prefetching and self.current_epoch < self.num_epoch:
+                self.current_epoch += 1
+                for columns in cache.batches(self.batch_size, self.epoch_shuffle):
+                    if not self.enqueue_minibatch([columns[:self.num_inputs], columns[self.num_inputs:]]):
+                        break
+                if minibatches is not None:
+                    if self.epoch_shuffle:
+                        random.shuffle(minibatches)
+                    for minibatch in minibatches:
+                        if not self.enqueue_minibatch(minibatch):
+                            break
+        except Exception as e:
+            print(e)
+            self.is_prefetching = False
+        finally:
+            cache.close()
+
+    def spill_minibatch(self, cache, X, Y):
+        """Appends the decoded mini-batch to the epoch replay cache.
+
+        # Returns
+            False if the cache rejected the mini-batch.
+        """
+        try:
+            cache.append(X + Y)
+        except ValueError as e:
+            print("Replaying the partition from memory: " + str(e))
+            return False
+
+        return True
+
+    def stop_prefetching(self):
+        """Stops the prefetching thread, including the prefetching of subsequent epochs."""
+        self.prefetching_stopped = True
+        self.is_prefetching = False
+
     def optimize(self):
         """Optimization procedure of a worker."""
         raise NotImplementedError
@@ -164,13 +826,15 @@ class Worker(object):
         # Prepare the optimization procedure.
         self.start_prefetching_thread(iterator)
         self.set_worker_id(worker_id)
-        self.prepare_model()
+        self.start_tracing()
+        with self.trace('prepare model'):
+            self.prepare_model()
         # Start the optimization procedure.
         try:
             self.optimize()
         except Exception as e:
             # Stop the prefetching process.
-            self.is_prefetching = False
+            self.stop_prefetching()
             print(e)
         # Wait for the prefetching thread to stop.
         self.prefetching_thread.join()
@@ -197,9 +861,33 @@ class SequentialWorker(Worker):
             Trained serialized Keras model.
         """
         while True:
-            X, Y = self.get_next_minibatch()
-            h = self.model.train_on_batch(X, Y)
-            self.add_history(h)
+            X, Y, num_steps = self.get_next_minibatch_block()
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            self.iteration += num_steps
+
+
+class AveragingWorker(SequentialWorker):
+    """Sequential worker which returns its weights as a single flat vector instead of a
+    serialized model, which allows the driver to sum the model replicas with a tree
+    aggregation.
+    """
+
+    def __init__(self, model, optimizer, loss, loss_weights, metrics=["accuracy"],
+                 features_col="features", label_col="label", batch_size=32, num_epoch=1):
+        # Initialize the parent class.
+        super(AveragingWorker, self).__init__(model, optimizer, loss, loss_weights, metrics, features_col,
+                                              label_col, batch_size, num_epoch)
+
+    def train(self, worker_id, iterator):
+        """See distkeras.workers.Worker.train
+
+        # Returns
+            The flattened weights of the trained model (see distkeras.utils.flatten_weights).
+        """
+        super(AveragingWorker, self).train(worker_id, iterator)
+
+        return iter([flatten_weights(self.model.get_weights())])
 
 
 class NetworkWorker(Worker):
@@ -214,19 +902,131 @@ class NetworkWorker(Worker):
         self.socket = None
         self.center_variable = None
         self.disable_nagle = True
-        self.training_history = []
         self.worker_id = 0
+        self.communication_window = 1
+        self.dynamic_shards = False
+        self.barrier = False
+        self.hyperparameters_version = 0
 
     def connect(self):
         """Connect with the remote parameter server."""
         self.socket = connect(self.master_host, self.master_port, self.disable_nagle)
 
+    def set_dynamic_shards(self, enabled):
+        """Lets the worker claim its partition at the parameter server before training on it,
+        see distkeras.parameter_servers.SocketParameterServer.handle_shard.
+
+        The tasks of the shards which run in the same Python process continue with the
+        optimizer state of the previous shard, as if they were a single worker.
+        """
+        self.dynamic_shards = enabled
+        self.set_optimizer_state_key(uuid.uuid4().hex if enabled else None)
+
+    def set_barrier(self, enabled):
+        """Lets the worker wait for all other workers of the barrier stage, before it pulls
+        the initial center variable."""
+        self.barrier = enabled
+
+    def wait_for_barrier(self):
+        """Waits until all workers of the barrier stage prepared their model, and records
+        the time spent waiting in the 'barrier_wait_time' statistic."""
+        time_start = time.time()
+        with self.trace('barrier'):
+            BarrierTaskContext.get().barrier()
+        self.record_statistic('barrier_wait_time', time.time() - time_start)
+
+    def claim_shard(self, done=False):
+        """Claims the partition of the worker, or reports it as done.
+
+        # Returns
+            True if the parameter server granted the claim.
+        """
+        data = {}
+        data['shard'] = self.get_worker_id()
+        data['done'] = done
+        self.socket.sendall(b's')
+        send_data(self.socket, data)
+
+        return recv_data(self.socket)
+
+    def send_commit(self, data):
+        """Sends a commit request with the specified data to the parameter server.
+
+        A summary of the training progress is piggybacked on every commit.
+        """
+        data['telemetry'] = self.get_telemetry()
+        time_start = time.time()
+        with self.trace('commit'):
+            serialized_data = serialize_data(data)
+            time_serialized = time.time()
+            # Request a commit from the parameter server.
+            self.socket.sendall(b'c')
+            # Send the data to the paramter server.
+            send_buffer(self.socket, serialized_data)
+        self.serialize_time += time_serialized - time_start
+        self.commit_time += time.time() - time_serialized
+        self.bytes_sent += len(serialized_data) + 21
+
+    def receive_pull(self):
+        """Requests the data of a pull from the parameter server.
+
+        # Returns
+            The deserialized data sent by the parameter server.
+        """
+        time_start = time.time()
+        with self.trace('pull'):
+            # Request a pull from the parameter server.
+            self.socket.sendall(b'p')
+            serialized_data = recv_buffer(self.socket)
+            serialized_hyperparameters = recv_buffer(self.socket)
+            time_received = time.time()
+            data = deserialize_data(serialized_data)
+            hyperparameters = deserialize_data(serialized_hyperparameters)
+        self.pull_time += time_received - time_start
+        self.serialize_time += time.time() - time_received
+        self.bytes_sent += 1
+        self.bytes_received += len(serialized_data) + len(serialized_hyperparameters) + 40
+        # Check if the trainer updated the hyperparameters since the last pull.
+        if hyperparameters is not None and hyperparameters['version'] > self.hyperparameters_version:
+            self.hyperparameters_version = hyperparameters['version']
+            self.apply_hyperparameters(hyperparameters['hyperparameters'])
+
+        return data
+
+    def apply_hyperparameters(self, hyperparameters):
+        """Applies the hyperparameters which the trainer updated while training, see
+        distkeras.parameter_servers.SocketParameterServer.update_hyperparameters.
+
+        # Arguments
+            hyperparameters: dict. May hold a 'learning_rate' and a 'communication_window'.
+        """
+        if 'learning_rate' in hyperparameters:
+            self.update_learning_rate(hyperparameters['learning_rate'])
+        if 'communication_window' in hyperparameters:
+            self.communication_window = hyperparameters['communication_window']
+
+    def update_learning_rate(self, learning_rate):
+        """Updates the learning rate while training. By default, the learning rate of the
+        worker scales the learning rate of its Keras optimizer, i.e., a learning rate of 1
+        leaves the optimizer as it was configured."""
+        scale = learning_rate / self.learning_rate
+        self.set_learning_rate(learning_rate)
+        K.set_value(self.model.optimizer.lr, K.get_value(self.model.optimizer.lr) * scale)
+
+    def send_trace(self):
+        """Sends the recorded trace events to the parameter server, if tracing is enabled."""
+        if self.tracer is None:
+            return
+        try:
+            self.socket.sendall(b't')
+            send_data(self.socket, self.tracer.get_events())
+        except Exception as e:
+            print(e)
+
     def pull(self):
         """Requests the center variable from the parameter server."""
-        # Request a pull from the parameter server.
-        self.socket.sendall(b'p')
         # Fetch the center variable from the parameter server.
-        self.center_variable = np.asarray(recv_data(self.socket))
+        self.center_variable = np.asarray(self.receive_pull())
 
     def commit(self, residual):
         """Sends the gradient residual to the parameter server."""
@@ -234,10 +1034,8 @@ class NetworkWorker(Worker):
         data = {}
         data['worker_id'] = self.get_worker_id()
         data['delta'] = residual
-        # Request a commit from the parameter server.
-        self.socket.sendall(b'c')
         # Send the data to the paramter server.
-        send_data(self.socket, data)
+        self.send_commit(data)
 
     def set_tcp_no_delay(self, flag):
         """Disables or enables Nagle's algorithm.
@@ -265,37 +1063,152 @@ class NetworkWorker(Worker):
         """Returns the port of the master parameter server."""
         return self.master_port
 
-    def add_history(self, h):
-        """Appends the specified history data."""
-        d = {}
-        d['history'] = h
-        d['worker_id'] = self.worker_id
-        d['iteration'] = self.iteration
-        d['timestamp'] = time.time()
-        self.training_history.append(d)
+    def set_master_port(self, port):
+        """Sets the port of the master parameter server."""
+        self.master_port = port
+
+    def communication_due(self, num_steps):
+        """Checks if the communication window ends within the next `num_steps` iterations.
+
+        # Arguments
+            num_steps: int. Number of mini-batches which will be trained on, starting
+                       from the current iteration.
+        """
+        first_iteration = self.iteration
+        last_iteration = self.iteration + num_steps - 1
+
+        return last_iteration // self.communication_window > (first_iteration - 1) // self.communication_window
 
     def optimize(self):
         """Optimization procedure of a network worker."""
         raise NotImplementedError
 
+    def finalize(self):
+        """Called when the worker exhausted its partition, before it disconnects from
+        the parameter server."""
+        pass
+
+    def leave(self):
+        """Stops prefetching and disconnects from the parameter server, without training.
+
+        # Returns
+            The history of the worker, see get_history.
+        """
+        self.stop_prefetching()
+        self.socket.close()
+        if self.prefetching_thread is not None:
+            self.prefetching_thread.join(timeout=1)
+
+        return iter(self.get_history())
+
     def train(self, worker_id, iterator):
-        """Training procedure of a networked worker with a parameter server."""
-        self.start_prefetching_thread(iterator)
+        """Training procedure of a networked worker with a parameter server.
+
+        The parameter server closes the connections of new workers once the training
+        procedure was stopped (see distkeras.trainers.DistributedTrainer.stop_training),
+        workers which start after the stop leave without training. So do the workers
+        whose partition was already claimed by another task, see set_dynamic_shards.
+        """
         self.set_worker_id(worker_id)
-        self.prepare_model()
         self.connect()
-        self.pull()
+        try:
+            # Check if another task already claimed the partition.
+            if self.dynamic_shards and not self.claim_shard():
+                return self.leave()
+        except (EOFError, ValueError, socket.error) as e:
+            print("The parameter server stopped the training procedure: " + str(e))
+            return self.leave()
+        self.start_prefetching_thread(iterator)
+        self.start_tracing()
+        with self.trace('prepare model'):
+            self.prepare_model()
+        try:
+            # Start training together with the other workers of the barrier stage.
+            if self.barrier:
+                self.wait_for_barrier()
+            self.pull()
+        except (EOFError, ValueError, socket.error) as e:
+            print("The parameter server stopped the training procedure: " + str(e))
+            return self.leave()
         self.model.set_weights(self.center_variable)
         try:
             self.optimize()
         except Exception as e:
             # Stop the prefetching process.
-            self.is_prefetching = False
+            self.stop_prefetching()
+            print(e)
+        self.finalize()
+        try:
+            # Report the partition as done.
+            if self.dynamic_shards:
+                self.claim_shard(done=True)
+        except Exception as e:
             print(e)
+        self.send_trace()
         self.socket.close()
         self.prefetching_thread.join(timeout=1)
 
-        return iter(self.training_history)
+        return iter(self.get_history())
+
+    def train_barrier(self, iterator):
+        """Training procedure of a worker in a barrier stage, in which the partition index
+        is provided by the barrier task context."""
+        return self.train(BarrierTaskContext.get().partitionId(), iterator)
+
+
+class PeriodicAveragingWorker(NetworkWorker):
+    """Worker which periodically averages its model with the models of the other
+    workers (local SGD), see distkeras.parameter_servers.AveragingParameterServer.
+
+    The communication window is the averaging period in mini-batches.
+    """
+
+    def __init__(self, model, optimizer, loss, loss_weights, metrics=["accuracy"], features_col="features", label_col="label",
+                 batch_size=32, num_epoch=1, master_host="localhost", master_port=5000, communication_window=32):
+        # Initialize the parent object.
+        super(PeriodicAveragingWorker, self).__init__(model, optimizer, loss, loss_weights, metrics, features_col, label_col,
+                                                      batch_size, num_epoch, master_host, master_port)
+        self.communication_window = communication_window
+        self.iteration = 1
+
+    def pull(self):
+        """Requests the averaged model from the parameter server."""
+        shapes = [w.shape for w in self.model.get_weights()]
+        self.center_variable = unflatten_weights(self.receive_pull(), shapes)
+
+    def commit(self, weights, final=False):
+        """Sends the flattened weights of the model replica to the parameter server.
+
+        # Arguments
+            weights: numpy array. Flattened weights, see distkeras.utils.flatten_weights.
+            final: boolean. Indicates that the worker leaves the averaging procedure.
+        """
+        # Prepare the datastructure.
+        data = {}
+        data['worker_id'] = self.get_worker_id()
+        data['weights'] = weights
+        data['final'] = final
+        # Send the data to the paramter server.
+        self.send_commit(data)
+
+    def optimize(self):
+        """Trains the model replica, and averages it at the end of every period."""
+        while True:
+            X, Y, num_steps = self.get_next_minibatch_block()
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            if self.communication_due(num_steps):
+                self.commit(flatten_weights(self.model.get_weights()))
+                self.pull()
+                self.model.set_weights(self.center_variable)
+            self.iteration += num_steps
+
+    def finalize(self):
+        """Contributes the final model replica to the average of the current round."""
+        try:
+            self.commit(flatten_weights(self.model.get_weights()), final=True)
+        except Exception as e:
+            print(e)
 
 
 class ADAGWorker(NetworkWorker):
@@ -319,27 +1232,30 @@ class ADAGWorker(NetworkWorker):
         data = {}
         data['worker_id'] = self.get_worker_id()
         data['residual'] = residual
-        # Request a commit from the parameter server.
-        self.socket.sendall(b'c')
         # Send the data to the paramter server.
-        send_data(self.socket, data)
+        self.send_commit(data)
 
     def optimize(self):
         """Optimization procedure of ADAG."""
-        W1 = np.asarray(self.model.get_weights())
+        W1 = weights_array(self.model.get_weights())
+        # Number of mini-batches since the last commit, which differs from the
+        # communication window when mini-batches are trained on in blocks.
+        num_window_steps = 0
         while True:
-            X, Y = self.get_next_minibatch()
-            h = self.model.train_on_batch(X, Y)
-            self.add_history(h)
-            if self.iteration % self.communication_window == 0:
-                W2 = np.asarray(self.model.get_weights())
+            X, Y, num_steps = self.get_next_minibatch_block()
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            num_window_steps += num_steps
+            if self.communication_due(num_steps):
+                W2 = weights_array(self.model.get_weights())
                 delta = W2 - W1
-                delta /= self.communication_window
+                delta /= num_window_steps
+                num_window_steps = 0
                 self.commit(delta)
                 self.pull()
                 self.model.set_weights(self.center_variable)
                 W1 = self.center_variable
-            self.iteration += 1
+            self.iteration += num_steps
 
 
 class DOWNPOURWorker(NetworkWorker):
@@ -359,22 +1275,50 @@ class DOWNPOURWorker(NetworkWorker):
 
     def optimize(self):
         """Specific optimization procedure for DOWNPOUR."""
-        W1 = np.asarray(self.model.get_weights())
+        W1 = weights_array(self.model.get_weights())
         while True:
-            X, Y = self.get_next_minibatch()
-            if self.iteration % self.communication_window == 0:
-                W2 = np.asarray(self.model.get_weights())
+            X, Y, num_steps = self.get_next_minibatch_block()
+            if self.communication_due(num_steps):
+                W2 = weights_array(self.model.get_weights())
                 delta = W2 - W1
                 self.commit(delta)
                 self.pull()
                 self.model.set_weights(self.center_variable)
                 W1 = self.center_variable
-            h = self.model.train_on_batch(X, Y)
-            self.add_history(h)
-            self.iteration += 1
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            self.iteration += num_steps
+
 
+class ElasticAveragingWorker(NetworkWorker):
+    """Abstract class of a worker which is elastically attracted by the center variable,
+    see distkeras.workers.elastic_averaging_updates.
+
+    # Arguments
+        rho: float. Strength of the elastic force, the elastic moving rate is
+             `rho * learning_rate`.
+        learning_rate: float. Learning rate.
+    """
 
-class AEASGDWorker(NetworkWorker):
+    def __init__(self, model, optimizer, loss, loss_weights, metrics=['accuracy'], features_col="features", label_col="label",
+                 batch_size=32, num_epoch=1, master_host="localhost", master_port=5000, rho=5.0, learning_rate=0.01):
+        # Initialize the parent object.
+        super(ElasticAveragingWorker, self).__init__(model, optimizer, loss, loss_weights, metrics, features_col, label_col,
+                                                     batch_size, num_epoch, master_host, master_port)
+        self.rho = rho
+        self.learning_rate = learning_rate
+        self.alpha = self.rho * self.learning_rate
+        self.elastic_updates = None
+
+    def update_learning_rate(self, learning_rate):
+        """Updates the learning rate, and the elastic moving rate which depends on it."""
+        self.learning_rate = learning_rate
+        self.alpha = self.rho * self.learning_rate
+        if self.elastic_updates is not None:
+            self.elastic_updates.set_learning_rate(self.learning_rate, self.alpha)
+
+
+class AEASGDWorker(ElasticAveragingWorker):
     """Implementation of asynchronous EASGD worker.
 
     Introduced by Zhang et al.
@@ -386,31 +1330,27 @@ class AEASGDWorker(NetworkWorker):
                  learning_rate=0.01, communication_window=32):
         # Initialize the parent object.
         super(AEASGDWorker, self).__init__(model, optimizer, loss, loss_weights, metrics, features_col, label_col,
-                                           batch_size, num_epoch, master_host, master_port)
+                                           batch_size, num_epoch, master_host, master_port, rho, learning_rate)
         # Initialize AEASGD specific variables.
-        self.rho = rho
-        self.learning_rate = learning_rate
         self.communication_window = communication_window
-        self.alpha = self.rho * self.learning_rate
         self.iteration = 1
 
     def optimize(self):
         """Specific training procedure for AEASGD."""
+        updates = elastic_averaging_updates(self.model, self.alpha)
+        self.elastic_updates = updates
         while True:
-            X, Y = self.get_next_minibatch()
-            if self.iteration % self.communication_window == 0:
+            X, Y, num_steps = self.get_next_minibatch_block()
+            if self.communication_due(num_steps):
                 self.pull()
-                W = np.asarray(self.model.get_weights())
-                E = self.alpha * (W - self.center_variable)
-                W = W - E
-                self.model.set_weights(W)
+                E = updates.elastic_update(self.center_variable)
                 self.commit(E)
-            h = self.model.train_on_batch(X, Y)
-            self.add_history(h)
-            self.iteration += 1
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            self.iteration += num_steps
 
 
-class EAMSGDWorker(NetworkWorker):
+class EAMSGDWorker(ElasticAveragingWorker):
     """Worker implementation of Asynchronous EA Momentum SGD.
 
     Introduced by Zhang et al.
@@ -422,39 +1362,27 @@ class EAMSGDWorker(NetworkWorker):
                  learning_rate=0.01, momentum=0.9, communication_window=32):
         # Initialize the parent object.
         super(EAMSGDWorker, self).__init__(model, optimizer, loss, loss_weights, metrics, features_col, label_col,
-                                           batch_size, num_epoch, master_host, master_port)
+                                           batch_size, num_epoch, master_host, master_port, rho, learning_rate)
         # Initialize EAMSGD specific variables.
-        self.rho = rho
-        self.learning_rate = learning_rate
         self.momentum = momentum
         self.communication_window = communication_window
-        self.alpha = self.learning_rate * self.rho
         self.iteration = 1
 
     def optimize(self):
         """Specific training procedure of asynchronous EAMSGD."""
-        r = np.asarray(self.model.get_weights())
-        r.fill(0.0)
+        updates = elastic_averaging_updates(self.model, self.alpha, self.learning_rate, self.momentum)
+        updates.initialize()
+        self.elastic_updates = updates
+        # The momentum is applied after every mini-batch, mini-batches are therefore not fused.
         while True:
             X, Y = self.get_next_minibatch()
-            if self.iteration % self.communication_window == 0:
+            if self.communication_due(1):
                 self.pull()
-                W = np.asarray(self.model.get_weights())
-                E = self.alpha * (W - self.center_variable)
-                W = W - E
-                self.model.set_weights(W)
+                E = updates.elastic_update(self.center_variable)
                 self.commit(E)
-            r_t = self.momentum * r
-            W_copy = np.asarray(self.model.get_weights())
-            W = np.asarray(self.model.get_weights())
-            W += r_t
-            self.model.set_weights(W)
-            h = self.model.train_on_batch(X, Y)
+            h = self.train_on_block(X, Y, 1)
             self.add_history(h)
-            gradient = np.asarray(self.model.get_weights()) - W
-            r = r_t - self.learning_rate * gradient
-            W_copy -= r
-            self.model.set_weights(W_copy)
+            updates.momentum_update()
             self.iteration += 1
 
 
@@ -473,11 +1401,9 @@ class DynSGDWorker(NetworkWorker):
 
     def pull(self):
         """Requests the center variable and last update from the parameter server."""
-        # Request a pull from the parameter server.
-        self.socket.sendall(b'p')
         # Fetch the dictionary from the parameter server.
-        data = recv_data(self.socket)
-        self.center_variable = np.asarray(data['model'])
+        data = self.receive_pull()
+        self.center_variable = weights_array(data['model'])
         self.last_update = data['update']
 
     def commit(self, residual):
@@ -487,26 +1413,24 @@ class DynSGDWorker(NetworkWorker):
         data['worker_id'] = self.get_worker_id()
         data['residual'] = residual
         data['last_update'] = self.last_update
-        # Request a commit from the parameter server.
-        self.socket.sendall(b'c')
         # Send the data to the paramter server.
-        send_data(self.socket, data)
+        self.send_commit(data)
 
     def optimize(self):
         """Optimization procedure of DynSGD."""
-        W1 = np.asarray(self.model.get_weights())
+        W1 = weights_array(self.model.get_weights())
         while True:
-            X, Y = self.get_next_minibatch()
-            h = self.model.train_on_batch(X, Y)
-            self.add_history(h)
-            if self.iteration % self.communication_window == 0:
-                W2 = np.asarray(self.model.get_weights())
+            X, Y, num_steps = self.get_next_minibatch_block()
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            if self.communication_due(num_steps):
+                W2 = weights_array(self.model.get_weights())
                 delta = W2 - W1
                 self.commit(delta)
                 self.pull()
                 self.model.set_weights(self.center_variable)
                 W1 = self.center_variable
-            self.iteration += 1
+            self.iteration += num_steps
 
 
 class ExperimentalWorker(NetworkWorker):
@@ -528,6 +1452,11 @@ class ExperimentalWorker(NetworkWorker):
         self.inverse_learning_rate = 1 / self.learning_rate
         self.iteration = 1
 
+    def update_learning_rate(self, learning_rate):
+        """Updates the learning rate, which is applied by the parameter server."""
+        self.learning_rate = learning_rate
+        self.inverse_learning_rate = 1 / self.learning_rate
+
     def commit(self, residual):
         """Sends the gradient residual to the parameter server."""
         # Prepare the datastructure.
@@ -535,31 +1464,32 @@ class ExperimentalWorker(NetworkWorker):
         data['worker_id'] = self.get_worker_id()
         data['residual'] = residual
         data['stale_center_variable'] = self.center_variable
-        # Request a commit from the parameter server.
-        self.socket.sendall(b'c')
         # Send the data to the paramter server.
-        send_data(self.socket, data)
+        self.send_commit(data)
 
     def pull(self):
         """Requests the center variable from the parameter server."""
-        # Request a pull from the parameter server.
-        self.socket.sendall(b'p')
         # Fetch the center variable from the parameter server.
-        self.center_variable = np.asarray(recv_data(self.socket))
+        self.center_variable = np.asarray(self.receive_pull())
 
     def optimize(self):
         """Optimization procedure of ADAG."""
-        W1 = np.asarray(self.model.get_weights())
+        W1 = weights_array(self.model.get_weights())
+        # Number of mini-batches since the last commit, which differs from the
+        # communication window when mini-batches are trained on in blocks.
+        num_window_steps = 0
         while True:
-            X, Y = self.get_next_minibatch()
-            h = self.model.train_on_batch(X, Y)
-            self.add_history(h)
-            if self.iteration % self.communication_window == 0:
-                W2 = np.asarray(self.model.get_weights())
+            X, Y, num_steps = self.get_next_minibatch_block()
+            h = self.train_on_block(X, Y, num_steps)
+            self.add_history(h, num_steps)
+            num_window_steps += num_steps
+            if self.communication_due(num_steps):
+                W2 = weights_array(self.model.get_weights())
                 delta = W2 - W1
-                delta /= self.communication_window
+                delta /= num_window_steps
+                num_window_steps = 0
                 self.commit(delta)
                 self.pull()
                 self.model.set_weights(self.center_variable)
                 W1 = self.center_variable
-            self.iteration += 1
+            self.iteration += num_steps
@@ -0,0 +1,191 @@
+"""Micro-benchmark of the networking protocol of distkeras.
+
+Measures the round-trip latency and throughput of `send_data` / `recv_data` over
+loopback TCP. An echo server, running in a separate thread, receives every frame
+and sends it back. The benchmark sweeps the payload size, the payload type (a single
+ndarray, a list of layer arrays, or a dictionary envelope like the commits of the
+workers), and the TCP_NODELAY setting. Serialization and deserialization are timed
+separately, so the framing cost can be distinguished from the cost of pickling.
+
+Results are emitted as JSON, one entry per configuration.
+
+Example:
+
+    python scripts/benchmark_networking.py --min-size 1024 --max-size 1073741824 --output net.json
+"""
+
+## BEGIN Imports. ##############################################################
+
+from distkeras.networking import connect
+from distkeras.networking import deserialize_data
+from distkeras.networking import recv_buffer
+from distkeras.networking import send_buffer
+from distkeras.networking import serialize_data
+
+import json
+
+import math
+
+import numpy as np
+
+import optparse
+
+import socket
+
+import threading
+
+import time
+
+## END Imports. ################################################################
+
+def parse_arguments():
+    parser = optparse.OptionParser()
+    parser.set_defaults(min_size=1024, max_size=1024 * 1024 * 1024, factor=4, num_layers=8,
+                        budget=1024 * 1024 * 1024, max_repetitions=100, output=None)
+    parser.add_option('--min-size', action='store', dest='min_size', type='int',
+                      help='smallest payload size in bytes')
+    parser.add_option('--max-size', action='store', dest='max_size', type='int',
+                      help='largest payload size in bytes')
+    parser.add_option('--factor', action='store', dest='factor', type='int',
+                      help='growth factor of the payload size')
+    parser.add_option('--num-layers', action='store', dest='num_layers', type='int',
+                      help='number of arrays in the layer payloads')
+    parser.add_option('--budget', action='store', dest='budget', type='int',
+                      help='number of payload bytes transferred per configuration')
+    parser.add_option('--max-repetitions', action='store', dest='max_repetitions', type='int')
+    parser.add_option('--output', action='store', dest='output', type='string',
+                      help='path of the JSON file which will hold the results')
+    (options, args) = parser.parse_args()
+
+    return options
+
+def allocate_payload(payload_type, size, num_layers):
+    """Allocates a payload of approximately `size` bytes.
+
+    # Arguments
+        payload_type: string. 'ndarray', 'layers' or 'envelope'.
+        size: int. Number of bytes of the payload.
+        num_layers: int. Number of arrays in the 'layers' payload, and number of
+                    kernel and bias pairs in the 'envelope' payload.
+    """
+    num_elements = max(1, size // 4)
+    if payload_type == 'ndarray':
+        return np.random.rand(num_elements).astype(np.float32)
+    num_layers = min(num_layers, num_elements)
+    layer_size = num_elements // num_layers
+    if payload_type == 'layers':
+        return [np.random.rand(layer_size).astype(np.float32) for i in range(0, num_layers)]
+    # Construct the envelope a worker sends when it commits. The layers of a model have
+    # different shapes, such that the residual is an object array of kernels and biases.
+    num_units = max(1, int(math.sqrt(layer_size)))
+    residual = np.empty(2 * num_layers, dtype=object)
+    for i in range(0, num_layers):
+        num_rows = max(1, (layer_size - num_units) // num_units)
+        residual[2 * i] = np.random.rand(num_rows, num_units).astype(np.float32)
+        residual[2 * i + 1] = np.random.rand(num_units).astype(np.float32)
+    data = {}
+    data['worker_id'] = 0
+    data['residual'] = residual
+    data['last_update'] = 1
+
+    return data
+
+def echo(server_socket, disable_nagle):
+    """Echoes every frame it receives back to the sender, until the connection is closed."""
+    conn, addr = server_socket.accept()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if disable_nagle else 0)
+    try:
+        while True:
+            send_buffer(conn, recv_buffer(conn))
+    except EOFError:
+        pass
+    conn.close()
+
+def measure(payload, disable_nagle, num_repetitions):
+    """Measures the serialization costs and the round-trip time of the payload.
+
+    # Returns
+        Dictionary with the timings (in seconds) of every repetition.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('127.0.0.1', 0))
+    server_socket.listen(1)
+    port = server_socket.getsockname()[1]
+    thread = threading.Thread(target=echo, args=(server_socket, disable_nagle))
+    thread.start()
+    fd = connect('127.0.0.1', port, disable_nagle)
+    timings = {'serialize': [], 'deserialize': [], 'round_trip': []}
+    num_bytes = 0
+    for i in range(0, num_repetitions):
+        time_start = time.time()
+        buffer = serialize_data(payload)
+        time_serialized = time.time()
+        send_buffer(fd, buffer)
+        buffer = recv_buffer(fd)
+        time_received = time.time()
+        deserialize_data(buffer)
+        time_deserialized = time.time()
+        num_bytes = len(buffer)
+        timings['serialize'].append(time_serialized - time_start)
+        timings['round_trip'].append(time_received - time_serialized)
+        timings['deserialize'].append(time_deserialized - time_received)
+    fd.close()
+    thread.join()
+    server_socket.close()
+    timings['num_bytes'] = num_bytes
+
+    return timings
+
+def summarize(timings):
+    """Returns the median, 90th percentile and minimum in milliseconds."""
+    timings = np.asarray(timings) * 1000.0
+    summary = {}
+    summary['p50'] = float(np.percentile(timings, 50))
+    summary['p90'] = float(np.percentile(timings, 90))
+    summary['min'] = float(timings.min())
+
+    return summary
+
+def benchmark(options):
+    results = []
+    sizes = []
+    size = options.min_size
+    while size <= options.max_size:
+        sizes.append(size)
+        size *= options.factor
+    for size in sizes:
+        num_repetitions = int(max(1, min(options.max_repetitions, options.budget // size)))
+        for payload_type in ['ndarray', 'layers', 'envelope']:
+            payload = allocate_payload(payload_type, size, options.num_layers)
+            for disable_nagle in [True, False]:
+                timings = measure(payload, disable_nagle, num_repetitions)
+                round_trip = np.median(timings['round_trip'])
+                result = {}
+                result['payload_size'] = size
+                result['payload_type'] = payload_type
+                result['tcp_nodelay'] = disable_nagle
+                result['num_repetitions'] = num_repetitions
+                result['serialized_size'] = timings['num_bytes']
+                result['serialize_ms'] = summarize(timings['serialize'])
+                result['deserialize_ms'] = summarize(timings['deserialize'])
+                result['round_trip_ms'] = summarize(timings['round_trip'])
+                # Both directions of the round trip carry the frame.
+                result['throughput_mb_per_second'] = 2 * timings['num_bytes'] / round_trip / 1e6
+                results.append(result)
+                print(json.dumps(result, sort_keys=True))
+            del payload
+
+    return results
+
+def main():
+    # Parse the options.
+    options = parse_arguments()
+    # Run the benchmark.
+    results = benchmark(options)
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
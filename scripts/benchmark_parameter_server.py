@@ -0,0 +1,238 @@
+"""Load generator and benchmark for the parameter servers.
+
+Starts a parameter server on localhost with a synthetic weight layout, and drives it
+with a number of simulated workers (threads or processes) which issue commits and
+pulls at a configurable rate. No Spark cluster or Keras training is involved, which
+makes this a reproducible benchmark of the hot path of the parameter servers.
+
+Example:
+
+    python scripts/benchmark_parameter_server.py --parameter-server adag \\
+        --num-parameters 10000000 --num-layers 10 --num-workers 8 --num-commits 100
+"""
+
+## BEGIN Imports. ##############################################################
+
+from distkeras.networking import connect
+from distkeras.networking import recv_data
+from distkeras.networking import send_data
+from distkeras.parameter_servers import ADAGParameterServer
+from distkeras.parameter_servers import DeltaParameterServer
+from distkeras.parameter_servers import DynSGDParameterServer
+from distkeras.parameter_servers import ExperimentalParameterServer
+from distkeras.utils import serialize_keras_model
+
+from keras.layers import Dense
+from keras.models import Sequential
+
+from multiprocessing import Pool
+
+import json
+
+import math
+
+import numpy as np
+
+import optparse
+
+import resource
+
+import threading
+
+import time
+
+## END Imports. ################################################################
+
+def parse_arguments():
+    parser = optparse.OptionParser()
+    parser.set_defaults(parameter_server='delta', num_parameters=1000000, num_layers=4, num_workers=4,
+                        num_commits=50, rate=0.0, processes=False, output=None)
+    parser.add_option('--parameter-server', action='store', dest='parameter_server', type='choice',
+                      choices=['delta', 'adag', 'dynsgd', 'experimental'])
+    parser.add_option('--num-parameters', action='store', dest='num_parameters', type='int')
+    parser.add_option('--num-layers', action='store', dest='num_layers', type='int')
+    parser.add_option('--num-workers', action='store', dest='num_workers', type='int')
+    parser.add_option('--num-commits', action='store', dest='num_commits', type='int')
+    parser.add_option('--rate', action='store', dest='rate', type='float',
+                      help='commits per second per worker, 0 means as fast as possible')
+    parser.add_option('--processes', action='store_true', dest='processes',
+                      help='simulate the workers with processes instead of threads')
+    parser.add_option('--output', action='store', dest='output', type='string',
+                      help='path of the JSON file which will hold the results')
+    (options, args) = parser.parse_args()
+
+    return options
+
+def allocate_model(num_parameters, num_layers):
+    """Allocates a stack of square dense layers with approximately the specified
+    number of parameters."""
+    num_units = max(1, int(math.sqrt(float(num_parameters) / num_layers)))
+    model = Sequential()
+    model.add(Dense(num_units, input_dim=num_units))
+    for i in range(1, num_layers):
+        model.add(Dense(num_units))
+
+    return model
+
+def allocate_parameter_server(name, model):
+    """Allocates the specified parameter server, listening on a port assigned by the OS."""
+    serialized_model = serialize_keras_model(model)
+    if name == 'delta':
+        parameter_server = DeltaParameterServer(serialized_model, None)
+    elif name == 'adag':
+        parameter_server = ADAGParameterServer(serialized_model, None)
+    elif name == 'dynsgd':
+        parameter_server = DynSGDParameterServer(serialized_model, None)
+    else:
+        parameter_server = ExperimentalParameterServer(serialized_model, None, 1.0)
+
+    return parameter_server
+
+def commit_data(name, worker_id, residual, pulled):
+    """Constructs the commit message a worker of the specified parameter server sends."""
+    data = {}
+    data['worker_id'] = worker_id
+    if name == 'delta':
+        data['delta'] = residual
+    else:
+        data['residual'] = residual
+    if name == 'dynsgd':
+        data['last_update'] = pulled['update']
+    elif name == 'experimental':
+        data['stale_center_variable'] = pulled
+
+    return data
+
+def pull(fd):
+    """Pulls the center variable, every pull is followed by the hyperparameter frame."""
+    fd.sendall(b'p')
+    pulled = recv_data(fd)
+    recv_data(fd)
+
+    return pulled
+
+def simulate_worker(arguments):
+    """Issues `num_commits` commits, each followed by a pull, at the specified rate.
+
+    The commit send time only covers handing the commit to the socket, the parameter
+    server handles the commit while the worker already waits for the pull. The round
+    trip time of a commit and its pull is therefore the latency of the parameter server.
+
+    # Returns
+        The commit send times, and the commit and pull round trip times in seconds.
+    """
+    name, worker_id, port, shapes, num_commits, rate = arguments
+    # The layers have different shapes, such that the residual is an object array.
+    residual = np.empty(len(shapes), dtype=object)
+    for i, shape in enumerate(shapes):
+        residual[i] = np.full(shape, 1e-6, dtype=np.float32)
+    commit_send_times = []
+    round_trip_latencies = []
+    fd = connect('localhost', port)
+    pulled = pull(fd)
+    time_next = time.time()
+    for i in range(0, num_commits):
+        # Wait for the next commit slot.
+        if rate > 0:
+            time_next += 1.0 / rate
+            time.sleep(max(0.0, time_next - time.time()))
+        time_start = time.time()
+        fd.sendall(b'c')
+        send_data(fd, commit_data(name, worker_id, residual, pulled))
+        time_committed = time.time()
+        pulled = pull(fd)
+        time_pulled = time.time()
+        commit_send_times.append(time_committed - time_start)
+        round_trip_latencies.append(time_pulled - time_start)
+    fd.close()
+
+    return commit_send_times, round_trip_latencies
+
+def run_workers(arguments, processes):
+    """Runs the simulated workers in threads or processes, and returns their results."""
+    if processes:
+        pool = Pool(len(arguments))
+        results = pool.map(simulate_worker, arguments)
+        pool.close()
+        pool.join()
+        return results
+    results = [None] * len(arguments)
+    def run(i):
+        results[i] = simulate_worker(arguments[i])
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(0, len(arguments))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+def latency_summary(latencies):
+    """Returns the latency percentiles in milliseconds."""
+    latencies = np.asarray(latencies) * 1000.0
+    summary = {}
+    for percentile in [50, 90, 99]:
+        summary['p' + str(percentile)] = float(np.percentile(latencies, percentile))
+    summary['max'] = float(latencies.max())
+    summary['mean'] = float(latencies.mean())
+
+    return summary
+
+def cpu_time():
+    """Returns the CPU time consumed by this process and its terminated children."""
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return usage_self.ru_utime + usage_self.ru_stime + usage_children.ru_utime + usage_children.ru_stime
+
+def benchmark(options):
+    model = allocate_model(options.num_parameters, options.num_layers)
+    shapes = [w.shape for w in model.get_weights()]
+    parameter_server = allocate_parameter_server(options.parameter_server, model)
+    parameter_server.start()
+    parameter_server.initialize()
+    thread = threading.Thread(target=parameter_server.run)
+    thread.start()
+    arguments = [(options.parameter_server, i, parameter_server.master_port, shapes,
+                  options.num_commits, options.rate) for i in range(0, options.num_workers)]
+    cpu_start = cpu_time()
+    time_start = time.time()
+    results = run_workers(arguments, options.processes)
+    duration = time.time() - time_start
+    cpu_duration = cpu_time() - cpu_start
+    metrics = parameter_server.get_metrics()
+    parameter_server.stop()
+    thread.join()
+    commit_send_times = [l for result in results for l in result[0]]
+    round_trip_latencies = [l for result in results for l in result[1]]
+    report = {}
+    report['parameter_server'] = options.parameter_server
+    report['num_parameters'] = int(sum(np.prod(shape) for shape in shapes))
+    report['num_layers'] = options.num_layers
+    report['num_workers'] = options.num_workers
+    report['processes'] = options.processes
+    report['rate'] = options.rate
+    report['duration'] = duration
+    report['commits_per_second'] = len(round_trip_latencies) / duration
+    report['pulls_per_second'] = len(round_trip_latencies) / duration
+    report['commit_send_time_ms'] = latency_summary(commit_send_times)
+    report['round_trip_latency_ms'] = latency_summary(round_trip_latencies)
+    report['cpu_time'] = cpu_duration
+    report['cpu_utilization'] = cpu_duration / duration
+    report['lock_wait_time'] = metrics['lock_wait_time']
+    report['lock_hold_time'] = metrics['lock_hold_time']
+
+    return report
+
+def main():
+    # Parse the options.
+    options = parse_arguments()
+    # Run the benchmark.
+    report = benchmark(options)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
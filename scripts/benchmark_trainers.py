@@ -0,0 +1,183 @@
+"""End-to-end throughput benchmark of the trainers.
+
+Builds a synthetic DataFrame with a configurable number of rows, feature width and
+partitions on a local Spark master, and trains a small multilayer perceptron on it
+with every trainer. For every trainer the benchmark reports the number of samples
+per second, the number of bytes the driver shipped to the executors (the serialized
+workers and the broadcast model), and the wall time broken down into setup, training
+and teardown.
+
+Example:
+
+    python scripts/benchmark_trainers.py --master "local[4]" --num-rows 100000 --output trainers.json
+
+Pass --num-shards to let the asynchronous trainers train on dynamic shards, see
+distkeras.trainers.AsynchronousDistributedTrainer.set_dynamic_shards.
+"""
+
+## BEGIN Imports. ##############################################################
+
+from distkeras.trainers import ADAG
+from distkeras.trainers import AEASGD
+from distkeras.trainers import AveragingTrainer
+from distkeras.trainers import DOWNPOUR
+from distkeras.trainers import DynSGD
+from distkeras.trainers import EAMSGD
+from distkeras.trainers import EnsembleTrainer
+from distkeras.trainers import SingleTrainer
+from distkeras.utils import pickle_object
+
+from keras.layers import Dense
+from keras.models import Sequential
+
+from pyspark.sql import Row
+from pyspark.sql import SparkSession
+
+import json
+
+import numpy as np
+
+import optparse
+
+import time
+
+## END Imports. ################################################################
+
+def parse_arguments():
+    parser = optparse.OptionParser()
+    parser.set_defaults(master='local[4]', num_rows=100000, num_features=64, num_classes=10,
+                        num_partitions=8, num_executors=1, num_workers=4, num_epoch=1, batch_size=32, hidden_units=128,
+                        trainers='single,averaging,ensemble,adag,downpour,aeasgd,eamsgd,dynsgd',
+                        num_shards=None, output=None)
+    parser.add_option('--master', action='store', dest='master', type='string')
+    parser.add_option('--num-rows', action='store', dest='num_rows', type='int')
+    parser.add_option('--num-features', action='store', dest='num_features', type='int')
+    parser.add_option('--num-classes', action='store', dest='num_classes', type='int')
+    parser.add_option('--num-executors', action='store', dest='num_executors', type='int',
+                      help='number of executors which receive the broadcast model')
+    parser.add_option('--num-partitions', action='store', dest='num_partitions', type='int')
+    parser.add_option('--num-workers', action='store', dest='num_workers', type='int')
+    parser.add_option('--num-epoch', action='store', dest='num_epoch', type='int')
+    parser.add_option('--batch-size', action='store', dest='batch_size', type='int')
+    parser.add_option('--hidden-units', action='store', dest='hidden_units', type='int')
+    parser.add_option('--trainers', action='store', dest='trainers', type='string',
+                      help='comma separated list of the trainers to benchmark')
+    parser.add_option('--num-shards', action='store', dest='num_shards', type='int',
+                      help='number of dynamic shards of the asynchronous trainers')
+    parser.add_option('--output', action='store', dest='output', type='string',
+                      help='path of the JSON file which will hold the results')
+    (options, args) = parser.parse_args()
+
+    return options
+
+def allocate_dataframe(spark, num_rows, num_features, num_classes, num_partitions):
+    """Generates a synthetic classification dataset on the executors.
+
+    The labels are derived from a random linear projection of the features, so the
+    trainers have an actual signal to learn.
+    """
+    def generate(index, iterator):
+        rng = np.random.RandomState(index)
+        projection = np.random.RandomState(0).randn(num_features, num_classes)
+        for i in iterator:
+            x = rng.randn(num_features)
+            y = np.zeros(num_classes)
+            y[int(np.argmax(x.dot(projection)))] = 1.0
+            yield Row(features=x.tolist(), label=y.tolist())
+    rdd = spark.sparkContext.range(0, num_rows, numSlices=num_partitions)
+    dataframe = rdd.mapPartitionsWithIndex(generate).toDF()
+    # Materialize the dataset, so its generation is not part of the measurements.
+    dataframe.cache()
+    dataframe.count()
+
+    return dataframe
+
+def allocate_model(num_features, num_classes, hidden_units):
+    model = Sequential()
+    model.add(Dense(hidden_units, input_shape=(num_features,), activation='relu'))
+    model.add(Dense(num_classes, activation='softmax'))
+
+    return model
+
+def allocate_trainer(name, model, options):
+    """Allocates the trainer with the specified name."""
+    arguments = {'keras_model': model, 'worker_optimizer': 'adam', 'loss': 'categorical_crossentropy',
+                 'features_col': 'features', 'label_col': 'label', 'batch_size': options.batch_size,
+                 'num_epoch': options.num_epoch}
+    if name == 'single':
+        return SingleTrainer(**arguments)
+    if name == 'averaging':
+        return AveragingTrainer(num_workers=options.num_workers, **arguments)
+    if name == 'ensemble':
+        return EnsembleTrainer(num_ensembles=options.num_workers, **arguments)
+    trainers = {'adag': ADAG, 'downpour': DOWNPOUR, 'aeasgd': AEASGD, 'eamsgd': EAMSGD, 'dynsgd': DynSGD}
+    trainer = trainers[name](num_workers=options.num_workers, **arguments)
+    trainer.set_dynamic_shards(options.num_shards)
+
+    return trainer
+
+def instrument(trainer):
+    """Records the size of every worker the trainer ships to the executors, and the size
+    of the broadcast model which accompanies it.
+
+    Spark serializes the worker once for every task, the number of tasks is derived from
+    the model cache statistics, as every task records either a hit or a miss. Broadcast
+    variables are transferred once per executor.
+    """
+    sizes = {'worker': [], 'broadcast': []}
+    configure_worker = trainer.configure_worker
+    def configure(worker, context):
+        configure_worker(worker, context)
+        sizes['worker'].append(len(pickle_object(worker)))
+        if worker.model_broadcast is not None:
+            sizes['broadcast'].append(len(pickle_object(worker.model_broadcast.value)))
+    trainer.configure_worker = configure
+
+    return sizes
+
+def benchmark_trainer(name, dataframe, options):
+    model = allocate_model(options.num_features, options.num_classes, options.hidden_units)
+    trainer = allocate_trainer(name, model, options)
+    sizes = instrument(trainer)
+    time_start = time.time()
+    trainer.train(dataframe)
+    time_end = time.time()
+    statistics = trainer.get_statistics()
+    num_tasks = statistics.get('model_cache_hits', 0) + statistics.get('model_cache_misses', 0)
+    num_samples = options.num_rows * options.num_epoch
+    result = {}
+    result['trainer'] = name
+    result['num_shards'] = options.num_shards if name not in ['single', 'averaging', 'ensemble'] else None
+    result['setup_time'] = trainer.training_time_start - time_start
+    result['training_time'] = trainer.get_training_time()
+    result['teardown_time'] = time_end - trainer.training_time_end
+    result['wall_time'] = time_end - time_start
+    result['samples_per_second'] = num_samples / trainer.get_training_time()
+    result['num_tasks'] = num_tasks
+    result['worker_bytes'] = int(np.mean(sizes['worker'])) if sizes['worker'] else 0
+    result['broadcast_bytes'] = int(sum(sizes['broadcast'])) * options.num_executors
+    result['driver_to_executor_bytes'] = result['worker_bytes'] * num_tasks + result['broadcast_bytes']
+    result['statistics'] = statistics
+
+    return result
+
+def main():
+    # Parse the options.
+    options = parse_arguments()
+    spark = SparkSession.builder.master(options.master) \
+                        .appName("Distributed Keras trainer benchmark") \
+                        .getOrCreate()
+    dataframe = allocate_dataframe(spark, options.num_rows, options.num_features, options.num_classes,
+                                   options.num_partitions)
+    results = []
+    for name in options.trainers.split(','):
+        result = benchmark_trainer(name, dataframe, options)
+        print(json.dumps(result, sort_keys=True))
+        results.append(result)
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    spark.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Time-to-accuracy comparison of the asynchronous distributed optimizers.
+
+Samples per second hide the cost of staleness: a fast optimizer which converges
+slowly is of little use. This harness trains the same synthetic classification
+problem with every asynchronous optimizer, for several numbers of workers and
+communication windows. While training, the center variable of the parameter server
+is periodically recorded (see DistributedTrainer.set_snapshot_interval). Afterwards,
+the snapshots are evaluated on a validation set, and the wallclock time to reach the
+target validation loss is reported in a comparison table.
+
+Example:
+
+    python scripts/time_to_accuracy.py --master "local[8]" --num-workers 2,4,8 \\
+        --communication-windows 5,15 --target-loss 0.5
+"""
+
+## BEGIN Imports. ##############################################################
+
+from distkeras.trainers import ADAG
+from distkeras.trainers import AEASGD
+from distkeras.trainers import DOWNPOUR
+from distkeras.trainers import DynSGD
+from distkeras.trainers import EAMSGD
+
+from keras.layers import Dense
+from keras.models import Sequential
+
+from pyspark.sql import Row
+from pyspark.sql import SparkSession
+
+import json
+
+import numpy as np
+
+import optparse
+
+## END Imports. ################################################################
+
+def parse_arguments():
+    parser = optparse.OptionParser()
+    parser.set_defaults(master='local[4]', num_rows=100000, num_validation=10000, num_features=64,
+                        num_classes=10, num_epoch=2, batch_size=32, hidden_units=128,
+                        trainers='adag,downpour,aeasgd,eamsgd,dynsgd', num_workers='2,4',
+                        communication_windows='5,20', target_loss=0.5, snapshot_interval=1.0,
+                        port=5000, output=None)
+    parser.add_option('--master', action='store', dest='master', type='string')
+    parser.add_option('--num-rows', action='store', dest='num_rows', type='int')
+    parser.add_option('--num-validation', action='store', dest='num_validation', type='int')
+    parser.add_option('--num-features', action='store', dest='num_features', type='int')
+    parser.add_option('--num-classes', action='store', dest='num_classes', type='int')
+    parser.add_option('--num-epoch', action='store', dest='num_epoch', type='int')
+    parser.add_option('--batch-size', action='store', dest='batch_size', type='int')
+    parser.add_option('--hidden-units', action='store', dest='hidden_units', type='int')
+    parser.add_option('--trainers', action='store', dest='trainers', type='string',
+                      help='comma separated list of the optimizers to compare')
+    parser.add_option('--num-workers', action='store', dest='num_workers', type='string',
+                      help='comma separated list of the numbers of workers')
+    parser.add_option('--communication-windows', action='store', dest='communication_windows', type='string',
+                      help='comma separated list of the communication windows')
+    parser.add_option('--target-loss', action='store', dest='target_loss', type='float')
+    parser.add_option('--snapshot-interval', action='store', dest='snapshot_interval', type='float')
+    parser.add_option('--port', action='store', dest='port', type='int',
+                      help='port of the first parameter server, every run uses the next port')
+    parser.add_option('--output', action='store', dest='output', type='string',
+                      help='path of the JSON file which will hold the results')
+    (options, args) = parser.parse_args()
+
+    return options
+
+def generate_samples(seed, num_samples, num_features, num_classes):
+    """Generates samples of which the label is derived from a fixed random projection."""
+    rng = np.random.RandomState(seed)
+    projection = np.random.RandomState(0).randn(num_features, num_classes)
+    X = rng.randn(num_samples, num_features)
+    Y = np.zeros((num_samples, num_classes))
+    Y[np.arange(num_samples), np.argmax(X.dot(projection), axis=1)] = 1.0
+
+    return X, Y
+
+def allocate_dataframe(spark, options, num_partitions):
+    def generate(index, iterator):
+        X, Y = generate_samples(index + 1, len(list(iterator)), options.num_features, options.num_classes)
+        for x, y in zip(X, Y):
+            yield Row(features=x.tolist(), label=y.tolist())
+    rdd = spark.sparkContext.range(0, options.num_rows, numSlices=num_partitions)
+    dataframe = rdd.mapPartitionsWithIndex(generate).toDF()
+    dataframe.cache()
+    dataframe.count()
+
+    return dataframe
+
+def allocate_model(options):
+    model = Sequential()
+    model.add(Dense(options.hidden_units, input_shape=(options.num_features,), activation='relu'))
+    model.add(Dense(options.num_classes, activation='softmax'))
+    model.compile(loss='categorical_crossentropy', optimizer='sgd')
+
+    return model
+
+def allocate_trainer(name, model, num_workers, communication_window, port, options):
+    trainers = {'adag': ADAG, 'downpour': DOWNPOUR, 'aeasgd': AEASGD, 'eamsgd': EAMSGD, 'dynsgd': DynSGD}
+    trainer = trainers[name](keras_model=model, worker_optimizer='adam', loss='categorical_crossentropy',
+                             num_workers=num_workers, batch_size=options.batch_size,
+                             features_col='features', label_col='label', num_epoch=options.num_epoch,
+                             communication_window=communication_window, master_port=port)
+    trainer.set_snapshot_interval(options.snapshot_interval)
+
+    return trainer
+
+def evaluate_snapshots(model, snapshots, X, Y):
+    """Computes the validation loss of every snapshot.
+
+    # Returns
+        List of (time, loss) tuples.
+    """
+    curve = []
+    for t, weights in snapshots:
+        model.set_weights(weights)
+        curve.append((t, float(model.evaluate(X, Y, batch_size=1024, verbose=0))))
+
+    return curve
+
+def time_to_target(curve, target_loss):
+    """Returns the time of the first snapshot which reached the target loss, or None."""
+    for t, loss in curve:
+        if loss <= target_loss:
+            return t
+
+    return None
+
+def print_table(results, target_loss):
+    print("")
+    print("Time to validation loss <= " + str(target_loss))
+    print("%-10s %8s %8s %12s %12s %12s" % ("optimizer", "workers", "window", "time (s)", "final loss", "train (s)"))
+    for r in results:
+        t = "-" if r['time_to_target'] is None else "%.1f" % r['time_to_target']
+        print("%-10s %8d %8d %12s %12.4f %12.1f" % (r['trainer'], r['num_workers'], r['communication_window'],
+                                                     t, r['final_loss'], r['training_time']))
+
+def main():
+    # Parse the options.
+    options = parse_arguments()
+    spark = SparkSession.builder.master(options.master) \
+                        .appName("Distributed Keras time-to-accuracy") \
+                        .getOrCreate()
+    num_workers = [int(n) for n in options.num_workers.split(',')]
+    communication_windows = [int(w) for w in options.communication_windows.split(',')]
+    dataframe = allocate_dataframe(spark, options, max(num_workers))
+    X_validation, Y_validation = generate_samples(0, options.num_validation, options.num_features,
+                                                  options.num_classes)
+    model = allocate_model(options)
+    initial_weights = model.get_weights()
+    results = []
+    port = options.port
+    for name in options.trainers.split(','):
+        for n in num_workers:
+            for window in communication_windows:
+                model.set_weights(initial_weights)
+                trainer = allocate_trainer(name, model, n, window, port, options)
+                trained_model = trainer.train(dataframe)
+                port += 1
+                # Evaluate the snapshots, and the final center variable.
+                snapshots = trainer.get_snapshots() + [(trainer.get_training_time(), trained_model.get_weights())]
+                curve = evaluate_snapshots(model, snapshots, X_validation, Y_validation)
+                result = {}
+                result['trainer'] = name
+                result['num_workers'] = n
+                result['communication_window'] = window
+                result['training_time'] = trainer.get_training_time()
+                result['time_to_target'] = time_to_target(curve, options.target_loss)
+                result['final_loss'] = curve[-1][1]
+                result['curve'] = curve
+                results.append(result)
+                print(json.dumps({k: v for k, v in result.items() if k != 'curve'}, sort_keys=True))
+    print_table(results, options.target_loss)
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    spark.stop()
+
+if __name__ == '__main__':
+    main()
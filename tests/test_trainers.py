@@ -0,0 +1,45 @@
+"""Tests of the distributed trainers."""
+
+## BEGIN Imports. ##############################################################
+
+import pytest
+
+pytest.importorskip("keras")
+pyspark_sql = pytest.importorskip("pyspark.sql")
+
+from keras.layers import Dense
+from keras.models import Sequential
+
+from distkeras.evaluators import SnapshotEvaluator
+from distkeras.evaluators import collect_validation_set
+
+from distkeras.trainers import DOWNPOUR
+
+## END Imports. ################################################################
+
+
+@pytest.fixture(scope='module')
+def spark():
+    """Local Spark session with a single executor core."""
+    session = pyspark_sql.SparkSession.builder.master('local[1]') \
+                         .appName('dist-keras-tests').getOrCreate()
+    yield session
+    session.stop()
+
+
+def test_early_stopping_with_more_partitions_than_executors(spark):
+    rows = [([float(i % 2), float(i % 3)], [float(i % 2), 0.0]) for i in range(64)]
+    dataframe = spark.createDataFrame(rows, ['features', 'label'])
+    model = Sequential()
+    model.add(Dense(2, input_shape=(2,)))
+    X, Y = collect_validation_set(dataframe)
+    # Every evaluation after the first one stops the training procedure.
+    evaluator = SnapshotEvaluator(model, 'mse', X, Y, interval=0.1, patience=1, min_delta=1e9)
+    trainer = DOWNPOUR(model, 'sgd', 'mse', metrics=[], num_workers=1, batch_size=8,
+                       num_epoch=50, master_port=5123)
+    # The tasks of the partitions which start after the stop leave without training.
+    trainer.set_parallelism_factor(8)
+    trainer.set_snapshot_evaluator(evaluator)
+    trained_model = trainer.train(dataframe)
+    assert trained_model is not None
+    assert len(evaluator.get_losses()) >= 2
@@ -0,0 +1,65 @@
+"""Tests of the training procedures of the workers."""
+
+## BEGIN Imports. ##############################################################
+
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip("keras")
+pytest.importorskip("pyspark")
+
+from keras.layers import Dense
+from keras.models import Sequential
+
+from distkeras.utils import serialize_keras_model
+
+from distkeras.workers import DOWNPOURWorker
+
+## END Imports. ################################################################
+
+
+def start_stopped_server():
+    """Starts a stub parameter server which closes every connection at the first
+    action of the worker, as the parameter server does once the training procedure
+    was stopped.
+
+    # Returns
+        The listening socket and the thread which serves the connections.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('localhost', 0))
+    server.listen(5)
+
+    def serve():
+        while True:
+            try:
+                conn, addr = server.accept()
+            except socket.error:
+                return
+            conn.recv(1)
+            conn.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    return server, thread
+
+
+def test_worker_leaves_stopped_parameter_server():
+    server, thread = start_stopped_server()
+    model = Sequential()
+    model.add(Dense(2, input_shape=(2,)))
+    worker = DOWNPOURWorker(serialize_keras_model(model), 'sgd', 'mse', None,
+                            master_port=server.getsockname()[1])
+    rows = [{'features': [0.0, 1.0], 'label': [1.0, 0.0]} for i in range(8)]
+    try:
+        history = list(worker.train(0, iter(rows)))
+    finally:
+        server.close()
+    # The worker leaves without training, and reports an empty history.
+    assert len(history) == 1
+    assert history[0][0] is None
+    assert not worker.prefetching_thread.is_alive()